@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+#
+# filename parser benchmark
+#
+# parses a synthetic corpus of filenames and reports the throughput.
+# with --against, the parsers.py of another git revision is timed on
+# the same corpus and both are checked to parse every file the same.
+#
+#   $ python3 bench/parse_bench.py
+#   $ python3 bench/parse_bench.py --against 7545ee4
+#
+# run it from the top of the source tree.
+#
+
+import os, sys
+import re
+import gc
+import time
+import random
+import logging
+import argparse
+import subprocess
+import importlib.util
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import madodl.gvars as _g
+
+TITLES = ['Berserk', 'One Piece', 'Nisekoi', 'Bakuman', 'Yotsuba&!',
+          'Vagabond', 'Oyasumi Punpun', '20th Century Boys']
+GROUPS = ['HorribleScans', 'norwayscans', 'Kirei Cake', 'Mangastream',
+          'LOL', 'Cyan', 'danke-Empire', 'AnimeHot']
+EXTS   = ['.zip', '.cbz', '.rar', '.7z']
+
+def gen_name(rng):
+    t = rng.choice(TITLES)
+    r = rng.random()
+    g = rng.choice(GROUPS)
+    e = rng.choice(EXTS)
+    n = rng.randint
+
+    if r < 0.25:
+        return '{} v{:02d} [{}]{}'.format(t, n(1, 40), g, e)
+    if r < 0.4:
+        return '{} v{:02d}-{:02d} ({}){}'.format(t, n(1, 10), n(11, 40), g, e)
+    if r < 0.6:
+        return '{} - c{:03d} [{}]{}'.format(t, n(1, 400), g, e)
+    if r < 0.7:
+        return '{} v{:02d} c{:03d}-{:03d} [{}]{}'.format(t, n(1, 40),
+                                                         n(1, 200),
+                                                         n(201, 400), g, e)
+    if r < 0.75:
+        return '{} (Complete) [{}]{}'.format(t, g, e)
+    if r < 0.8:
+        return '{} - {:03d} [{}]{}'.format(t, n(1, 400), g, e)
+    if r < 0.85:
+        return '{} {:03d}-{:03d}{}'.format(t, n(1, 100), n(101, 200), e)
+    if r < 0.9:
+        return '{} v{:02d} Extra [{}]{}'.format(t, n(1, 40), g, e)
+    if r < 0.93:
+        return '{} Artbook{}'.format(t, e)
+    if r < 0.96:
+        return '{}_v{:02d}_ch{:03d}.5_[{}]{}'.format(t.replace(' ', '_'),
+                                                    n(1, 40), n(1, 300), g, e)
+
+    return '{} Chapter {}, {}{}'.format(t, n(1, 50), n(51, 60), e)
+
+def load_rev(rev):
+    '''Load madodl/parsers.py as it was at git revision `rev`.'''
+    src = subprocess.check_output(['git', 'show',
+                                   '{}:madodl/parsers.py'.format(rev)])
+    spec = importlib.util.spec_from_loader('parsers_' + rev, loader=None)
+    mod  = importlib.util.module_from_spec(spec)
+
+    # older parsers put (?x) in the middle of their token regex, which
+    # Python 3.11 rejects. strip it and pass the flag instead.
+    fixre = type(re)('re')
+    fixre.__dict__.update(re.__dict__)
+
+    def finditer(p, s, flags=0):
+        if isinstance(p, str) and '(?x)' in p:
+            return re.finditer(p.replace('(?x)', ''), s, flags | re.X)
+
+        return re.finditer(p, s, flags)
+
+    fixre.finditer = finditer
+    exec(compile(src, 'parsers.py@' + rev, 'exec'), mod.__dict__)
+    mod.re = fixre
+
+    return mod
+
+def parses(P, names):
+    '''Returns the names that `P` can parse at all.'''
+    ok = []
+
+    for n in names:
+        try:
+            P.ParseFile(n, 'x')
+            ok.append(n)
+        except SystemExit:
+            pass
+
+    return ok
+
+def nums(s):
+    return (sorted(set(float(n) for n in s)), getattr(s, 'tail', None))
+
+def result(fo):
+    return (nums(fo._vols), nums(fo._chps), fo._all, list(fo._tag))
+
+def bench(parsers, names, runs):
+    '''Best time of `runs` parses of `names` with each parser, in CPU
+       seconds. The parsers take turns, so a noisy machine slows them
+       down alike.'''
+    best = [None] * len(parsers)
+
+    for _ in range(runs):
+        for i, P in enumerate(parsers):
+            gc.collect()
+            t = time.process_time()
+
+            for n in names:
+                P.ParseFile(n, 'x')
+
+            t = time.process_time() - t
+            best[i] = t if best[i] is None else min(best[i], t)
+
+    return best
+
+def main():
+    ap = argparse.ArgumentParser(description='filename parser benchmark')
+    ap.add_argument('-n', type=int, default=20000,
+                    help='number of filenames (default: 20000)')
+    ap.add_argument('-r', '--runs', type=int, default=5,
+                    help='timed runs, the best one counts (default: 5)')
+    ap.add_argument('--seed', type=int, default=7)
+    ap.add_argument('--against', metavar='REV',
+                    help='also time the parser of git revision REV')
+    args = ap.parse_args()
+
+    _g.log = logging.getLogger('madodl.bench')
+    _g.log.addHandler(logging.NullHandler())
+    _g.log.propagate = False
+
+    import madodl.parsers as P
+
+    rng   = random.Random(args.seed)
+    names = parses(P, [gen_name(rng) for _ in range(args.n)])
+
+    print('{} filenames, {} parseable'.format(args.n, len(names)))
+
+    parsers = [('tree', P)]
+
+    if args.against:
+        O     = load_rev(args.against)
+        names = parses(O, names)
+        diff  = [n for n in names
+                 if result(O.ParseFile(n, 'x')) != result(P.ParseFile(n, 'x'))]
+
+        if diff:
+            print('{} file(s) parse differently, e.g. {!r}'
+                  .format(len(diff), diff[0]))
+        else:
+            print('both parse all {} files the same'.format(len(names)))
+
+        parsers.insert(0, (args.against, O))
+
+    times = bench([p for name, p in parsers], names, args.runs)
+
+    for (name, p), t in zip(parsers, times):
+        print('{:>10}: {:.0f} files/s'.format(name, len(names) / t))
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,2 +1,2 @@
 __all__ = ['main', 'exceptions', 'curl', 'out', 'parsers', 'util', 'version',
-           'gvars' ]
+           'gvars', 'cache', 'intervals', 'cover', 'journal' ]
@@ -0,0 +1,786 @@
+#!/usr/bin/env python3
+
+#
+# persistent on-disk caches
+#
+
+import os
+import re
+import time
+import json
+import sqlite3
+import hashlib
+
+import madodl.parsers   as _parsers
+import madodl.intervals as _intervals
+import madodl.gvars     as _g
+from madodl.version import __version__
+
+def open_db(path):
+    '''Open (and create if needed) a cache database.
+
+       The database is shared by every madodl process, so it is opened
+       in WAL mode with a generous lock timeout.
+    '''
+    os.makedirs(os.path.dirname(path), 0o770, True)
+
+    db = sqlite3.connect(path, timeout=30)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA synchronous=NORMAL')
+
+    return db
+
+def tree_meta(jsonloc):
+    '''Returns the freshness metadata of the dumbtree JSON file.
+
+       The metadata holds the ETag and Last-Modified headers it was
+       served with and the time it was last checked. Files from older
+       versions have no metadata, so their mtime is used as the time
+       they were fetched.
+    '''
+    try:
+        with open(jsonloc + '.meta') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        pass
+
+    try:
+        return {'fetched' : os.path.getmtime(jsonloc)}
+    except OSError:
+        return {}
+
+def tree_meta_save(jsonloc, meta):
+    tmploc = '{}.meta.{}.tmp'.format(jsonloc, os.getpid())
+
+    with open(tmploc, 'w') as f:
+        json.dump(meta, f)
+
+    os.replace(tmploc, jsonloc + '.meta')
+
+    return None
+
+def tree_stale(jsonloc, ttl):
+    '''Check if the dumbtree JSON file is older than `ttl` seconds.'''
+    return time.time() - tree_meta(jsonloc).get('fetched', 0) > ttl
+
+class ListCache:
+    '''A size-bounded LRU cache of raw FTP LISTings.
+
+       Entries are keyed by the full FTP URL of the directory and expire
+       `ttl` seconds after they were fetched. When the cached LISTings
+       grow past `maxsize` bytes, the least recently used ones are
+       dropped.
+
+       Parameters:
+       db - sqlite3 connection from open_db().
+       ttl - lifetime of an entry in seconds.
+       maxsize - max total size of the cached LISTings in bytes.
+       refresh - ignore cached entries, but still store fresh ones.
+    '''
+    def __init__(self, db, ttl, maxsize, refresh=False):
+        self._db     = db
+        self.ttl     = ttl
+        self.maxsize = maxsize
+        self.refresh = refresh
+        self.hits    = 0
+        self.misses  = 0
+
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS listcache ('
+                             'url TEXT PRIMARY KEY, data BLOB NOT NULL, '
+                             'size INTEGER NOT NULL, '
+                             'fetched REAL NOT NULL, atime REAL NOT NULL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS listcache_atime '
+                             'ON listcache (atime)')
+
+    def get(self, url):
+        '''Returns the cached LISTing for `url` or None.'''
+        row = None
+
+        if not self.refresh:
+            row = self._db.execute('SELECT data, fetched FROM listcache '
+                                   'WHERE url = ?', (url,)).fetchone()
+
+        now = time.time()
+
+        if row is None or now - row[1] > self.ttl:
+            self.misses += 1
+            return None
+
+        with self._db:
+            self._db.execute('UPDATE listcache SET atime = ? WHERE url = ?',
+                             (now, url))
+
+        self.hits += 1
+        _g.log.info('LIST cache hit: {}'.format(url))
+
+        return bytes(row[0])
+
+    def put(self, url, data):
+        now = time.time()
+
+        with self._db:
+            self._db.execute('INSERT OR REPLACE INTO listcache '
+                             '(url, data, size, fetched, atime) '
+                             'VALUES (?, ?, ?, ?, ?)',
+                             (url, data, len(data), now, now))
+            self.evict()
+
+        return None
+
+    def evict(self):
+        total, = self._db.execute('SELECT TOTAL(size) FROM listcache') \
+                         .fetchone()
+
+        if total <= self.maxsize:
+            return None
+
+        drop = []
+
+        for url, size in self._db.execute('SELECT url, size FROM listcache '
+                                          'ORDER BY atime'):
+            if total <= self.maxsize:
+                break
+
+            drop.append((url,))
+            total -= size
+
+        self._db.executemany('DELETE FROM listcache WHERE url = ?', drop)
+
+        _g.log.info('evicted {} LISTings from cache'.format(len(drop)))
+
+        return None
+
+class TreeIndex:
+    '''An indexed copy of the stupidapi dumbtree (files.json).
+
+       Each title directory under /Manga is stored as one row, keyed by
+       its NWO path (see util.create_nwo_path()) and its lower-cased
+       name, together with the JSON of its contents. Finding a title is
+       then a B-tree lookup instead of a load of the whole tree.
+
+       Every title is also indexed by the trigrams of its name for
+       offline fuzzy searching (see search()).
+
+       The index lives next to the JSON file and is rebuilt whenever
+       the JSON file changes.
+
+       Parameters:
+       jsonloc - location of the dumbtree JSON file.
+    '''
+    VERSION = 2
+
+    def __init__(self, jsonloc):
+        self.jsonloc = jsonloc
+        self.dbloc   = os.path.splitext(jsonloc)[0] + '.db'
+
+        if self.stale():
+            self.build()
+
+        self._db = sqlite3.connect(self.dbloc, timeout=30)
+
+    def source_id(self):
+        st = os.stat(self.jsonloc)
+
+        return '{}:{}:{}'.format(self.VERSION, st.st_mtime_ns, st.st_size)
+
+    def stale(self):
+        if not os.path.exists(self.dbloc):
+            return True
+
+        db = sqlite3.connect(self.dbloc, timeout=30)
+
+        try:
+            row = db.execute("SELECT val FROM meta WHERE key = 'source'") \
+                    .fetchone()
+        except sqlite3.DatabaseError:
+            row = None
+        finally:
+            db.close()
+
+        return row is None or row[0] != self.source_id()
+
+    def iter_titles(self):
+        '''Yields (nwo path, title, contents) for every title directory.'''
+        with open(self.jsonloc, errors='surrogateescape') as f:
+            yield from _parsers.dumbtree_titles(f)
+
+    @staticmethod
+    def trigrams(name):
+        '''Returns the set of trigrams of the words in `name`.'''
+        tris = set()
+
+        for w in re.split(r'\W+', name.lower()):
+            if not w:
+                continue
+
+            w = ' {} '.format(w)
+
+            for i in range(len(w)-2):
+                tris.add(w[i:i+3])
+
+        return tris
+
+    def iter_rows(self):
+        for nwo, name, contents in self.iter_titles():
+            yield (nwo, name.lower(), name, json.dumps(contents),
+                   len(self.trigrams(name)))
+
+    def build(self):
+        '''Convert the JSON file into a fresh index.
+
+           The index is written to a temporary file that is renamed into
+           place, so other madodl processes never see a partial index.
+        '''
+        _g.log.info('indexing {}...'.format(self.jsonloc))
+
+        tmploc = '{}.{}.tmp'.format(self.dbloc, os.getpid())
+        db     = sqlite3.connect(tmploc)
+        # taken before reading, so if a refresh replaces the JSON file
+        # meanwhile the index looks stale rather than up to date
+        src    = self.source_id()
+
+        try:
+            with db:
+                db.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, '
+                           'val TEXT)')
+                db.execute('CREATE TABLE titles (id INTEGER PRIMARY KEY, '
+                           'nwo TEXT NOT NULL, lname TEXT NOT NULL, '
+                           'name TEXT NOT NULL, contents TEXT NOT NULL, '
+                           'ntri INTEGER NOT NULL)')
+                db.execute('CREATE TABLE trigrams (tri TEXT NOT NULL, '
+                           'id INTEGER NOT NULL)')
+                db.executemany('INSERT INTO titles (nwo, lname, name, '
+                               'contents, ntri) VALUES (?, ?, ?, ?, ?)',
+                               self.iter_rows())
+                db.executemany('INSERT INTO trigrams VALUES (?, ?)',
+                               ((tri, tid) for tid, name
+                                in db.execute('SELECT id, name FROM titles')
+                                          .fetchall()
+                                for tri in self.trigrams(name)))
+                db.execute('CREATE INDEX titles_path ON titles (nwo, lname)')
+                db.execute('CREATE INDEX trigrams_tri ON trigrams (tri)')
+                db.execute("INSERT INTO meta VALUES ('source', ?)",
+                           (src,))
+        except:
+            db.close()
+            os.remove(tmploc)
+            raise
+
+        db.close()
+        os.replace(tmploc, self.dbloc)
+
+        return None
+
+    def lookup(self, nwo, name):
+        '''Find a title by its NWO path and name (case insensitive).
+
+           Returns a 2-tuple of the title's contents and its exact name,
+           or None if there is no such title.
+        '''
+        row = self._db.execute('SELECT contents, name FROM titles '
+                               'WHERE nwo = ? AND lname = ? ORDER BY id '
+                               'LIMIT 1', (nwo, name.lower())).fetchone()
+
+        if row is None:
+            return None
+
+        return (json.loads(row[0]), row[1])
+
+    def search(self, query, limit=10, minscore=0.3):
+        '''Fuzzy search the titles by name.
+
+           Titles are ranked by the Jaccard similarity of their trigrams
+           to the query's, and an exact (case insensitive) match always
+           ranks first.
+
+           Returns a list of (nwo path, title, score) tuples, best first.
+        '''
+        qtris = self.trigrams(query)
+
+        if not qtris:
+            return []
+
+        qlow = ' '.join(re.split(r'\W+', query.lower())).strip()
+        rows = self._db.execute('SELECT t.nwo, t.name, t.ntri, COUNT(*) '
+                                'FROM trigrams g JOIN titles t '
+                                'ON t.id = g.id WHERE g.tri IN ({}) '
+                                'GROUP BY g.id'
+                                .format(','.join('?'*len(qtris))),
+                                tuple(qtris))
+        hits = []
+
+        for nwo, name, ntri, common in rows:
+            score = common / (len(qtris) + ntri - common)
+
+            if ' '.join(re.split(r'\W+', name.lower())).strip() == qlow:
+                score += 1
+
+            if score >= minscore:
+                hits.append((nwo, name, score))
+
+        hits.sort(key=lambda h: (-h[2], h[1]))
+
+        return hits[:limit]
+
+    def close(self):
+        self._db.close()
+
+        return None
+
+class AliasCache:
+    '''Maps the names used in requests to the titles they resolved to.
+
+       Once a name has been resolved by a search, the next run can go
+       straight to the title's directory, without searching again or
+       asking the user to pick from several matches.
+
+       Parameters:
+       db - sqlite3 connection from open_db().
+    '''
+    def __init__(self, db):
+        self._db = db
+
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS aliases ('
+                             'name TEXT PRIMARY KEY, path TEXT NOT NULL, '
+                             'title TEXT NOT NULL, used REAL NOT NULL)')
+
+    @staticmethod
+    def normalize(name):
+        return ' '.join(name.lower().split())
+
+    def get(self, name):
+        '''Returns a 2-tuple of the remote path and title or None.'''
+        name = self.normalize(name)
+        row  = self._db.execute('SELECT path, title FROM aliases '
+                                'WHERE name = ?', (name,)).fetchone()
+
+        if row is None:
+            return None
+
+        with self._db:
+            self._db.execute('UPDATE aliases SET used = ? WHERE name = ?',
+                             (time.time(), name))
+
+        return row
+
+    def put(self, name, path, title):
+        with self._db:
+            self._db.execute('INSERT OR REPLACE INTO aliases '
+                             '(name, path, title, used) VALUES (?, ?, ?, ?)',
+                             (self.normalize(name), path, title, time.time()))
+
+        return None
+
+    def remove(self, name):
+        '''Returns True if there was an alias to remove.'''
+        with self._db:
+            cur = self._db.execute('DELETE FROM aliases WHERE name = ?',
+                                   (self.normalize(name),))
+
+        return cur.rowcount > 0
+
+    def prune(self, age):
+        '''Remove aliases that weren't used in `age` seconds.
+
+           Returns the number of aliases removed.
+        '''
+        with self._db:
+            cur = self._db.execute('DELETE FROM aliases WHERE used < ?',
+                                   (time.time() - age,))
+
+        return cur.rowcount
+
+    def items(self):
+        return self._db.execute('SELECT name, path, title FROM aliases '
+                                'ORDER BY name').fetchall()
+
+class ThroughputStats:
+    '''Download throughput of recent runs, for estimating how long a
+       download will take.
+
+       Each run that downloads at least MIN_BYTES records how many bytes
+       it got and how long that took. Only the last `keep` runs are
+       kept.
+
+       Parameters:
+       db - sqlite3 connection from open_db().
+       keep - number of runs to keep.
+    '''
+    MIN_BYTES = 1024**2
+
+    def __init__(self, db, keep=20):
+        self._db  = db
+        self.keep = keep
+
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS throughput ('
+                             'time REAL NOT NULL, bytes INTEGER NOT NULL, '
+                             'secs REAL NOT NULL)')
+
+    def record(self, nbytes, secs):
+        if nbytes < self.MIN_BYTES or secs <= 0:
+            return None
+
+        with self._db:
+            self._db.execute('INSERT INTO throughput (time, bytes, secs) '
+                             'VALUES (?, ?, ?)', (time.time(), nbytes, secs))
+            self._db.execute('DELETE FROM throughput WHERE rowid NOT IN '
+                             '(SELECT rowid FROM throughput '
+                             'ORDER BY time DESC LIMIT ?)', (self.keep,))
+
+        return None
+
+    def rate(self):
+        '''Returns the average rate of the kept runs in bytes per second
+           or None if nothing has been recorded yet.'''
+        nbytes, secs = self._db.execute('SELECT TOTAL(bytes), TOTAL(secs) '
+                                        'FROM throughput').fetchone()
+
+        return nbytes / secs if secs else None
+
+class LibraryIndex:
+    '''What is already in an output directory.
+
+       Each file in the directory is stored with its size and mtime, so
+       a rescan only has to stat the directory to find what changed.
+       Files madodl downloaded are marked as known, with the size and
+       mtime the remote file had if the listing had them. That is what
+       later runs compare the listings against.
+
+       A local file that changed since it was indexed is no longer
+       known, and files that are gone are dropped.
+
+       Parameters:
+       db - sqlite3 connection from open_db().
+       outdir - the output directory.
+       hashing - also keep a SHA-1 of each new or changed file.
+    '''
+    # LIST only gives the day for files older than six months, so the
+    # mtime of the same remote file can move by up to a day.
+    MTIME_SLACK = 86400
+
+    def __init__(self, db, outdir, hashing=False):
+        self._db     = db
+        self.outdir  = os.path.realpath(outdir)
+        self.hashing = hashing
+        self._rows   = {}
+
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS library ('
+                             'dir TEXT NOT NULL, name TEXT NOT NULL, '
+                             'size INTEGER NOT NULL, mtime REAL NOT NULL, '
+                             'known INTEGER NOT NULL, rsize INTEGER, '
+                             'rmtime REAL, hash TEXT, '
+                             'PRIMARY KEY (dir, name))')
+
+    @staticmethod
+    def file_hash(path):
+        h = hashlib.sha1()
+
+        with open(path, 'rb') as fh:
+            for blk in iter(lambda: fh.read(1024**2), b''):
+                h.update(blk)
+
+        return h.hexdigest()
+
+    def scan(self):
+        '''Bring the index up to date with the directory.
+
+           Returns the number of new or changed files.
+        '''
+        rows = {}
+
+        for row in self._db.execute('SELECT name, size, mtime, known, '
+                                    'rsize, rmtime, hash FROM library '
+                                    'WHERE dir = ?', (self.outdir,)):
+            rows[row[0]] = list(row[1:])
+
+        try:
+            names = os.listdir(self.outdir)
+        except FileNotFoundError:
+            names = []
+
+        seen = {}
+        new  = []
+
+        for name in names:
+            if name.startswith('.') or name.endswith(('.part', '.segpart')):
+                continue
+
+            path = os.path.join(self.outdir, name)
+
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+
+            if not os.path.isfile(path):
+                continue
+
+            row = rows.get(name)
+
+            if row is None or row[:2] != [st.st_size, st.st_mtime]:
+                row = [st.st_size, st.st_mtime, 0, None, None,
+                       self.file_hash(path) if self.hashing else None]
+                new.append((self.outdir, name) + tuple(row))
+
+            seen[name] = row
+
+        gone = [(self.outdir, name) for name in rows if name not in seen]
+
+        if new or gone:
+            with self._db:
+                self._db.executemany('INSERT OR REPLACE INTO library '
+                                     '(dir, name, size, mtime, known, '
+                                     'rsize, rmtime, hash) '
+                                     'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', new)
+                self._db.executemany('DELETE FROM library '
+                                     'WHERE dir = ? AND name = ?', gone)
+
+        self._rows = seen
+
+        _g.log.info('library {}: {} file(s), {} new or changed, {} gone'
+                    .format(self.outdir, len(seen), len(new), len(gone)))
+
+        return len(new)
+
+    def _set_remote(self, name, rsize, rmtime):
+        row      = self._rows[name]
+        row[2:5] = [1, rsize, rmtime]
+
+        with self._db:
+            self._db.execute('UPDATE library SET known = 1, rsize = ?, '
+                             'rmtime = ? WHERE dir = ? AND name = ?',
+                             (rsize, rmtime, self.outdir, name))
+
+        return None
+
+    def have(self, f):
+        '''Check if the remote file `f` (a listing entry) is already in
+           the directory.
+
+           A file madodl downloaded matches as long as the remote size
+           and mtime didn't change. Any other file with the same name
+           only matches if it has the size of the remote file, and then
+           counts as downloaded from now on.
+        '''
+        row = self._rows.get(f.name)
+
+        if row is None:
+            return False
+
+        size, mtime, known, rsize, rmtime, hsh = row
+        fsize  = getattr(f, 'size', None)
+        fmtime = getattr(f, 'mtime', None)
+
+        if not known:
+            if fsize is None or fsize != size:
+                return False
+
+            self._set_remote(f.name, fsize, fmtime)
+
+            return True
+
+        if fsize is not None and rsize is not None and fsize != rsize:
+            return False
+
+        if (fmtime is not None and rmtime is not None and
+            abs(fmtime - rmtime) > self.MTIME_SLACK):
+            return False
+
+        return True
+
+    def size(self, name):
+        '''Returns the local size of an indexed file.'''
+        return self._rows[name][0]
+
+    def add(self, f):
+        '''Index the file that was just downloaded for the remote file
+           `f` (a listing entry).'''
+        path = os.path.join(self.outdir, f.name)
+        st   = os.stat(path)
+        row  = [st.st_size, st.st_mtime, 1, getattr(f, 'size', None),
+                getattr(f, 'mtime', None),
+                self.file_hash(path) if self.hashing else None]
+
+        self._rows[f.name] = row
+
+        with self._db:
+            self._db.execute('INSERT OR REPLACE INTO library '
+                             '(dir, name, size, mtime, known, rsize, '
+                             'rmtime, hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                             (self.outdir, f.name) + tuple(row))
+
+        return None
+
+class WatchState:
+    '''When each followed title is next checked by --watch.
+
+       Every title of the follow list has a row with its current poll
+       interval, the time it is due and the last time a check found
+       new files. Rows are keyed by the follow list entry, so the
+       schedule survives restarts.
+
+       Parameters:
+       db - sqlite3 connection from open_db().
+    '''
+    def __init__(self, db):
+        self._db = db
+
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS watch ('
+                             'key TEXT PRIMARY KEY, '
+                             'interval REAL NOT NULL, due REAL NOT NULL, '
+                             'checked REAL, new REAL)')
+
+    def get(self, key, interval):
+        '''Returns the (interval, due time) of `key`. A title that isn't
+           known yet gets `interval` and is due now.'''
+        row = self._db.execute('SELECT interval, due FROM watch '
+                               'WHERE key = ?', (key,)).fetchone()
+
+        return tuple(row) if row else (interval, 0)
+
+    def put(self, key, interval, due, new=False):
+        now = time.time()
+
+        with self._db:
+            self._db.execute('INSERT OR IGNORE INTO watch '
+                             '(key, interval, due) VALUES (?, ?, ?)',
+                             (key, interval, due))
+            self._db.execute('UPDATE watch SET interval = ?, due = ?, '
+                             'checked = ?, new = CASE WHEN ? THEN ? '
+                             'ELSE new END WHERE key = ?',
+                             (interval, due, now, new, now, key))
+
+        return None
+
+    def prune(self, keys):
+        '''Forget the titles that aren't in `keys` anymore.'''
+        keys = set(keys)
+        drop = [(k,) for k, in self._db.execute('SELECT key FROM watch')
+                if k not in keys]
+
+        with self._db:
+            self._db.executemany('DELETE FROM watch WHERE key = ?', drop)
+
+        return len(drop)
+
+class ParseCache:
+    '''Remembers what ParseFile made of each filename.
+
+       Results are keyed by the filename and the title it was parsed
+       for, and tagged with a fingerprint of the parser. A new or
+       modified parser has a different fingerprint, so results it
+       didn't produce are never returned and are dropped on start-up.
+       When there are more than `maxrows` results, the least recently
+       used ones are dropped.
+
+       Parameters:
+       db - sqlite3 connection from open_db().
+       maxrows - max number of cached results.
+    '''
+    # max number of host parameters in one statement
+    CHUNK = 500
+    # access times are only refreshed when they are older than this,
+    # which keeps warm runs from rewriting every row they read.
+    ATIME_RES = 3600
+
+    def __init__(self, db, maxrows):
+        self._db     = db
+        self.maxrows = maxrows
+        self.fp      = self.fingerprint()
+        self.hits    = 0
+        self.misses  = 0
+
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS parsecache ('
+                             'fname TEXT NOT NULL, title TEXT NOT NULL, '
+                             'fp TEXT NOT NULL, data TEXT NOT NULL, '
+                             'atime REAL NOT NULL, '
+                             'PRIMARY KEY (fname, title))')
+            self._db.execute('CREATE INDEX IF NOT EXISTS parsecache_atime '
+                             'ON parsecache (atime)')
+            self._db.execute('DELETE FROM parsecache WHERE fp != ?',
+                             (self.fp,))
+
+    @staticmethod
+    def fingerprint():
+        '''Returns a hash of the parser source and the madodl version.'''
+        h = hashlib.sha1(__version__.encode())
+
+        for mod in (_parsers, _intervals):
+            with open(mod.__file__, 'rb') as f:
+                h.update(f.read())
+
+        return h.hexdigest()
+
+    def get_many(self, fnames, title):
+        '''Returns a dict of filename -> cached fields for every one of
+           `fnames` that has a cached result. See
+           ParseFile.from_fields().'''
+        found  = []
+        datas  = []
+        old    = []
+        now    = time.time()
+        fnames = list(set(fnames))
+
+        for i in range(0, len(fnames), self.CHUNK):
+            chunk = fnames[i:i+self.CHUNK]
+            rows  = self._db.execute('SELECT fname, data, atime '
+                                     'FROM parsecache '
+                                     'WHERE title = ? AND fp = ? AND '
+                                     'fname IN ({})'
+                                     .format(','.join('?' * len(chunk))),
+                                     [title, self.fp] + chunk)
+
+            for fname, data, atime in rows:
+                found.append(fname)
+                datas.append(data)
+
+                if now - atime > self.ATIME_RES:
+                    old.append((now, fname, title))
+
+        if old:
+            with self._db:
+                self._db.executemany('UPDATE parsecache SET atime = ? '
+                                     'WHERE fname = ? AND title = ?', old)
+
+        self.hits   += len(found)
+        self.misses += len(fnames) - len(found)
+
+        # decoding everything in one go is a lot cheaper than one
+        # json.loads() per row.
+        return dict(zip(found, json.loads('[{}]'.format(','.join(datas)))))
+
+    def put_many(self, fos, title):
+        now = time.time()
+
+        with self._db:
+            self._db.executemany('INSERT OR REPLACE INTO parsecache '
+                                 '(fname, title, fp, data, atime) '
+                                 'VALUES (?, ?, ?, ?, ?)',
+                                 ((fo._f, title, self.fp,
+                                   json.dumps(fo.fields()), now)
+                                  for fo in fos))
+            self.evict()
+
+        return None
+
+    def evict(self):
+        count, = self._db.execute('SELECT COUNT(*) FROM parsecache') \
+                         .fetchone()
+
+        if count <= self.maxrows:
+            return None
+
+        self._db.execute('DELETE FROM parsecache WHERE rowid IN '
+                         '(SELECT rowid FROM parsecache ORDER BY atime '
+                         'LIMIT ?)', (count - self.maxrows,))
+
+        _g.log.info('evicted {} parse results from cache'
+                    .format(count - self.maxrows))
+
+        return None
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+
+#
+# byte-minimizing file selection
+#
+
+import heapq
+from collections import Counter
+
+import madodl.gvars as _g
+
+# cost multipliers for files with a `prefer`/`not prefer` tag
+PREF_WEIGHT  = 0.5
+NPREF_WEIGHT = 2.0
+
+# groups of overlapping files larger than this, or that need more search
+# steps than EXACT_MAX_NODES, keep the greedy solution.
+EXACT_MAX_FILES = 64
+EXACT_MAX_NODES = 50000
+
+class _Budget(Exception):
+    pass
+
+def file_units(req, fo):
+    '''Returns the set of requested volumes and chapters a file covers
+       as (`v` or `c`, number) pairs.
+
+       Files that would also bring in something that wasn't requested
+       (a volume outside the request, or chapters outside it that don't
+       come with a requested volume) can't be used and give None. So do
+       complete archives and files that cover nothing.
+
+       Parameters:
+       req - the ParseRequest.
+       fo - the ParseFile of the file.
+    '''
+    if fo._all or fo._vols.tail is not None or fo._chps.tail is not None:
+        return None
+
+    if req._all:
+        vols = list(fo._vols)
+        chps = list(fo._chps)
+    else:
+        vols = [v for v in fo._vols if v in req._vols]
+        chps = [c for c in fo._chps if c in req._chps]
+
+        if req._vols and len(vols) != len(fo._vols):
+            return None
+
+        # the chapters of a requested volume come with it
+        if not vols and len(chps) != len(fo._chps):
+            return None
+
+    units = set(('v', v) for v in vols)
+    units.update(('c', c) for c in chps)
+
+    return units or None
+
+def _components(cands):
+    '''Split the candidates into groups that share no volume/chapter.'''
+    parent = list(range(len(cands)))
+    owner  = {}
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+
+        return i
+
+    for i, (cost, units) in enumerate(cands):
+        for u in units:
+            j = owner.setdefault(u, i)
+
+            if j != i:
+                parent[find(i)] = find(j)
+
+    groups = {}
+
+    for i in range(len(cands)):
+        groups.setdefault(find(i), []).append(i)
+
+    return list(groups.values())
+
+def _greedy(cands, ids):
+    '''Weighted greedy set cover: keep picking the file with the lowest
+       cost per newly covered volume/chapter, then drop picks that ended
+       up redundant, most expensive first.'''
+    left = set()
+
+    for i in ids:
+        left.update(cands[i][1])
+
+    heap = [(cands[i][0] / len(cands[i][1]), i) for i in ids]
+    heapq.heapify(heap)
+    pick = []
+
+    while left:
+        ratio, i = heapq.heappop(heap)
+        new      = cands[i][1] & left
+
+        if not new:
+            continue
+
+        cur = cands[i][0] / len(new)
+
+        if cur > ratio:
+            # stale, some of its units got covered since
+            heapq.heappush(heap, (cur, i))
+            continue
+
+        pick.append(i)
+        left -= new
+
+    return _prune(cands, pick)
+
+def _prune(cands, pick, keep=None):
+    '''Drop the files of `pick` whose volumes/chapters are all covered
+       by the others, most expensive first. `keep` is never dropped.'''
+    seen = Counter()
+
+    for i in pick:
+        seen.update(cands[i][1])
+
+    for i in sorted(pick, key=lambda i: -cands[i][0]):
+        if i != keep and all(seen[u] > 1 for u in cands[i][1]):
+            seen.subtract(cands[i][1])
+            pick.remove(i)
+
+    return pick
+
+def _improve(cands, ids, pick):
+    '''Try swapping each unpicked file in for the picks it makes
+       redundant. Catches what greedy misses when one bundle is cheaper
+       than the many small files it replaces, but not per file.'''
+    cost = sum(cands[i][0] for i in pick)
+
+    for j in sorted(ids, key=lambda i: cands[i][0]):
+        # a file with one volume/chapter can only replace another one,
+        # and greedy already picked the cheapest of those
+        if j in pick or len(cands[j][1]) < 2:
+            continue
+
+        new  = _prune(cands, pick + [j], j)
+        ncst = sum(cands[i][0] for i in new)
+
+        if ncst < cost:
+            pick, cost = new, ncst
+
+    return pick
+
+def _exact(cands, ids, best):
+    '''Branch and bound over the files of one group, seeded with the
+       greedy solution `best`. Returns the cheapest cover found within
+       EXACT_MAX_NODES steps.'''
+    covers = {}
+
+    for i in sorted(ids, key=lambda i: (cands[i][0], i)):
+        for u in cands[i][1]:
+            covers.setdefault(u, []).append(i)
+
+    # spreading each file's cost over its units gives a lower bound for
+    # covering any set of units
+    lb = {u: min(cands[i][0] / len(cands[i][1]) for i in c)
+          for u, c in covers.items()}
+
+    state = [sum(cands[i][0] for i in best), list(best), 0]
+
+    def search(left, cost, chosen):
+        state[2] += 1
+
+        if state[2] > EXACT_MAX_NODES:
+            raise _Budget
+
+        if not left:
+            if cost < state[0]:
+                state[0] = cost
+                state[1] = list(chosen)
+            return None
+
+        if cost + sum(lb[u] for u in left) >= state[0]:
+            return None
+
+        u = min(left, key=lambda u: len(covers[u]))
+
+        for i in covers[u]:
+            chosen.append(i)
+            search(left - cands[i][1], cost + cands[i][0], chosen)
+            chosen.pop()
+
+        return None
+
+    try:
+        search(frozenset(covers), 0, [])
+    except _Budget:
+        _g.log.info('kept greedy selection for a group of {} files'
+                    .format(len(ids)))
+
+    return state[1]
+
+def select(req, ents):
+    '''Pick the set of files that covers the requested volumes and
+       chapters with the least total size.
+
+       Tag preferences weigh in on the size: a preferred file costs
+       PREF_WEIGHT times its size, a nonpreferred one NPREF_WEIGHT times.
+       Files without a known size are costed at the median size per
+       volume/chapter of the others.
+
+       When everything is requested, files without any volume/chapter
+       numbers (extras, omake, ...) have nothing to cover but are always
+       picked. Other files that can't be used are logged.
+
+       The files are split into groups that don't overlap. Each group is
+       solved exactly if it is small enough, otherwise greedily.
+
+       Parameters:
+       req - the ParseRequest.
+       ents - list of (listing entry, ParseFile) tuples that passed the
+              tag filters, in listing order.
+
+       Returns a list of (listing entry, volumes, chapters) tuples in
+       listing order, like walk_thru_listing().
+    '''
+    cands = []
+    used  = []
+    extra = []
+
+    for i, (f, fo) in enumerate(ents):
+        units = file_units(req, fo)
+
+        if units:
+            cands.append(units)
+            used.append((i, f, fo))
+        elif req._all and not any((fo._all, fo._vols, fo._chps)):
+            extra.append((i, f, [], []))
+        else:
+            _g.log.info("minsize: can't use {}".format(f.name))
+
+    if not cands:
+        return [e[1:] for e in extra]
+
+    rates = sorted(f.size / len(u) for (j, f, fo), u in zip(used, cands)
+                   if getattr(f, 'size', None) is not None)
+    rate  = rates[len(rates)//2] if rates else 1
+
+    for i, ((j, f, fo), units) in enumerate(zip(used, cands)):
+        size = getattr(f, 'size', None)
+        cost = size if size is not None else rate * len(units)
+
+        if fo._preftag:
+            cost *= PREF_WEIGHT
+        elif fo._npreftag:
+            cost *= NPREF_WEIGHT
+
+        cands[i] = (cost, frozenset(units))
+
+    pick = []
+
+    for ids in _components(cands):
+        sol = _greedy(cands, ids)
+
+        if 1 < len(ids) <= EXACT_MAX_FILES:
+            sol = _exact(cands, ids, sol)
+        elif len(ids) > 1:
+            sol = _improve(cands, ids, sol)
+
+        pick.extend(sol)
+
+    ret = extra
+
+    for i in pick:
+        j, f, fo = used[i]
+        units    = cands[i][1]
+        ret.append((j, f, sorted(n for t, n in units if t == 'v'),
+                          sorted(n for t, n in units if t == 'c')))
+
+    return [e[1:] for e in sorted(ret, key=lambda e: e[0])]
@@ -9,19 +9,22 @@ from io import BytesIO
 import re
 import urllib.parse
 import time
+import threading
 import pycurl
 import unicurses
 
 import madodl.util  as _util
+import madodl.out   as _out
+import madodl.cache as _cache
 import madodl.gvars as _g
 from madodl.exceptions import *
 
 hdrs = {}
-def curl_hdr(hdr_line):
+def parse_hdr(hdict, hdr_line):
     hdr_line = hdr_line.decode('iso-8859-1')
 
     if hdr_line[:5] == 'HTTP/':
-        hdrs['retstr'] = re.sub('^[^ ]+ ', '', hdr_line)
+        hdict['retstr'] = re.sub('^[^ ]+ ', '', hdr_line)
         return
 
     if ':' not in hdr_line:
@@ -32,20 +35,112 @@ def curl_hdr(hdr_line):
     name = name.strip()
     val  = val.strip()
 
-    hdrs[name.lower()] = val
+    hdict[name.lower()] = val
 
     return None
 
+def curl_hdr(hdr_line):
+    return parse_hdr(hdrs, hdr_line)
+
+def curl_hdr_func(hdict):
+    '''Return a header callback that stores headers in `hdict`.
+
+       Concurrent transfers can't share the global `hdrs` dict, so each
+       one gets its own.
+    '''
+    return lambda hdr_line: parse_hdr(hdict, hdr_line)
+
 def curl_debug(dbg_type, dbg_msg):
     _g.log.debug("{}: {}".format(dbg_type, dbg_msg.decode('iso-8859-1')))
 
     return None
 
-def curl_common_init(buf):
-    handle = pycurl.Curl()
+class HandlePool:
+    '''Curl easy handles that are reused for the whole run.
+
+       All handles are attached to one pycurl.CurlShare, so the DNS cache,
+       the TLS session cache and open connections are shared by every
+       request instead of being set up again for each one.
+    '''
+    def __init__(self):
+        self._free  = []
+        self._lock  = threading.Lock()
+        self._share = pycurl.CurlShare()
+
+        self._share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_DNS)
+        self._share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_SSL_SESSION)
+        # connection sharing needs libcurl >= 7.57
+        if hasattr(pycurl, 'LOCK_DATA_CONNECT'):
+            try:
+                self._share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_CONNECT)
+            except pycurl.error:
+                _g.log.debug("libcurl can't share connections")
+
+    def get(self):
+        with self._lock:
+            handle = self._free.pop() if self._free else None
+
+        if handle is None:
+            handle = pycurl.Curl()
+            handle.setopt(pycurl.SHARE, self._share)
+        else:
+            # drops all options, but keeps the caches and the share.
+            handle.reset()
+
+        return handle
+
+    def put(self, handle):
+        with self._lock:
+            self._free.append(handle)
+
+        return None
+
+    def close(self):
+        with self._lock:
+            for handle in self._free:
+                handle.close()
+
+            self._free = []
+
+        self._share.close()
+
+        return None
+
+pool      = None
+# the JSON tree refresh thread gets handles too
+pool_lock = threading.Lock()
+
+def curl_release(handle):
+    '''Give a handle from curl_common_init() back to the pool.'''
+    if pool is None:
+        handle.close()
+    else:
+        pool.put(handle)
+
+    return None
+
+def curl_pool_close():
+    global pool
+
+    with pool_lock:
+        if pool is not None:
+            pool.close()
+            pool = None
+
+    return None
+
+def curl_common_init(buf, hdict=None):
+    global pool
+
+    with pool_lock:
+        if pool is None:
+            pool = HandlePool()
+
+        handle = pool.get()
 
     handle.setopt(pycurl.WRITEDATA, buf)
-    handle.setopt(pycurl.HEADERFUNCTION, curl_hdr)
+    handle.setopt(pycurl.HEADERFUNCTION,
+                  curl_hdr if hdict is None else curl_hdr_func(hdict))
     handle.setopt(pycurl.DEBUGFUNCTION, curl_debug)
 
     handle.setopt(pycurl.USERPWD, '{}:{}'.format(_g.conf._user,_g.conf._pass))
@@ -82,7 +177,7 @@ def curl_json_list(fname, isf=False):
             f = open(fname, 'wb')
             c = curl_common_init(f)
         except OSError:
-            die("couldn't open file for writing")
+            _out.die("couldn't open file for writing")
     else:
         c = curl_common_init(fname)
 
@@ -91,55 +186,90 @@ def curl_json_list(fname, isf=False):
 
     _g.log.info('curling JSON tree...')
 
-    c.perform()
-    c.close()
+    try:
+        c.perform()
+    finally:
+        curl_release(c)
+
+        if isf:
+            f.close()
 
     return None
 
-def curl_progress(ttdl, tdl, ttul, tul):
-    _time = time.time()
-    # ensure we are printing every 2 sec
-    tdiff = _time - _g.conf._time
+def curl_json_refresh(jsonloc):
+    '''Bring the local copy of the stupidapi tree up to date.
 
-    if tdiff < 2:
-        return
+       The request is conditional on the ETag and Last-Modified of the
+       copy we have, and is gzip encoded. A new tree is downloaded to a
+       temporary file that is renamed over `jsonloc`, so readers never
+       see a partial file.
 
-    if not _g.conf._fsz and ttdl:
-        _g.conf._fsz = _util.conv_bytes(ttdl)
+       Returns True if the tree changed.
+    '''
+    meta   = _cache.tree_meta(jsonloc)
+    hdict  = {}
+    tmploc = '{}.{}.tmp'.format(jsonloc, os.getpid())
+    reqhdr = []
 
-    _g.conf._time = _time
+    if os.path.exists(jsonloc):
+        if meta.get('etag'):
+            reqhdr.append('If-None-Match: {}'.format(meta['etag']))
+        if meta.get('last-modified'):
+            reqhdr.append('If-Modified-Since: {}'
+                          .format(meta['last-modified']))
 
-    dlspeed = (tdl - _g.conf._lastdl) / tdiff
+    with open(tmploc, 'wb') as f:
+        c = curl_common_init(f, hdict)
 
-    dls_conv = _util.conv_bytes(dlspeed) + '/s'
-    tdl_conv = _util.conv_bytes(tdl)
+        c.setopt(c.URL, 'https://{}{}dumbtree'.format(_g.loc['DOMAIN'],
+                                                      _g.loc['API']))
+        c.setopt(c.ENCODING, 'gzip')
+        c.setopt(c.HTTPHEADER, reqhdr)
 
-    # clear line manually since redrawln() isn't
-    # working for me
-    _g.conf._stdscr.addstr(2, 0, ' '*_g.conf._COLS)
+        _g.log.info('refreshing JSON tree...')
 
-    _g.conf._stdscr.refresh()
+        try:
+            try:
+                c.perform()
+            except pycurl.error:
+                check_curl_error(c, None, 'HTTP', True, hdict)
+
+            res = c.getinfo(c.RESPONSE_CODE)
+
+            if res != 304:
+                check_curl_error(c, None, 'HTTP', hdict=hdict)
+        except:
+            f.close()
+            os.remove(tmploc)
+            raise
+        finally:
+            curl_release(c)
 
-    _g.conf._stdscr.addstr(2, 0,
-        'size {} | downloaded {} | speed {}'.format(_g.conf._fsz, tdl_conv,
-                                                    dls_conv))
+    meta['fetched'] = time.time()
 
-    _g.conf._stdscr.refresh()
+    if res == 304:
+        _g.log.info('JSON tree is up to date')
+        os.remove(tmploc)
+    else:
+        os.replace(tmploc, jsonloc)
+        meta['etag']          = hdict.get('etag')
+        meta['last-modified'] = hdict.get('last-modified')
 
-    _g.conf._lastdl = tdl
+    _cache.tree_meta_save(jsonloc, meta)
 
-    return None
+    return res != 304
 
-def check_curl_error(h, fh, proto, exp=False):
+def check_curl_error(h, fh, proto, exp=False, hdict=hdrs):
     res = h.getinfo(h.RESPONSE_CODE)
 
     if proto == 'HTTP':
-        okres = {0, 200} # OK
+        okres = {0, 200, 206} # OK, partial content (resumed)
     elif proto == 'FTP':
         okres = {0, 226} # transfer complete
 
     if exp:
-        fh.truncate()
+        if fh is not None:
+            fh.truncate()
 
         if res in okres:
             raise
@@ -153,46 +283,167 @@ def check_curl_error(h, fh, proto, exp=False):
     if res not in okres:
         # XXX
         #raise CurlError(str(res))
-        fh.truncate()
+        if fh is not None:
+            fh.truncate()
 
         if res == 401:
             msg = 'Bad user/password.'                     \
                 if '' not in {_g.conf._user,_g.conf._pass} \
                 else 'Insufficient authentication information given.'
         else:
-            msg = hdrs['retstr']
+            msg = hdict.get('retstr', 'retcode: {}'.format(res))
 
         raise CurlError(msg)
 
     return None
 
-def curl_to_file(url, fname, proto, port=None):
-    _g.conf._fsz    = 0
-    _g.conf._time   = 0
-    _g.conf._lastdl = 0
+def curl_head(url, proto, port=None):
+    '''Fetch the size of a remote file without downloading it.
+
+       Returns a 2-tuple of the size in bytes (-1 if unknown) and whether
+       the server says it accepts byte ranges.
+    '''
+    hdict = {}
+    buf   = BytesIO()
+    c     = curl_common_init(buf, hdict)
+
+    c.setopt(c.URL, url)
+    c.setopt(c.NOBODY, True)
+    if port:
+        c.setopt(c.PORT, port)
+
+    try:
+        try:
+            c.perform()
+        except pycurl.error:
+            check_curl_error(c, None, proto, True, hdict)
+        check_curl_error(c, None, proto, hdict=hdict)
+
+        size = int(c.getinfo(c.CONTENT_LENGTH_DOWNLOAD))
+    finally:
+        curl_release(c)
+
+    if proto == 'FTP':
+        # FTP ranges are done with REST, which every sane server has.
+        ranges = True
+    else:
+        ranges = hdict.get('accept-ranges', '').lower() == 'bytes'
+
+    return (size, ranges)
+
+def curl_segmented_to_file(url, fname, proto, nsegs, port=None):
+    '''Download a file over `nsegs` connections, one byte range each.
+
+       The file is preallocated and each segment writes at its own
+       offset. Segmented downloads aren't resumable, so a leftover
+       .segpart file is always started over.
+
+       Returns False without downloading anything if the file is too
+       small or the server doesn't support ranges, in which case the
+       caller should fall back to a normal download.
+    '''
+    size, ranges = curl_head(url, proto, port)
+
+    if size < _g.conf._segment_min or not ranges:
+        _g.log.info('not segmenting {} (size {}, ranges {})'
+                    .format(fname, size, ranges))
+        return False
+
+    path = os.path.join(_g.conf._outdir, fname)
+    part = path + Segment.PART_EXT
+
+    with open(part, 'wb') as fh:
+        fh.truncate(size)
+
+    seglen = -(-size // nsegs) # ceil
+    segs   = []
+
+    for i, st in enumerate(range(0, size, seglen)):
+        seg       = Segment(url, fname, proto, st, min(st+seglen, size)-1,
+                            port)
+        seg.label = '{} [{}/{}]'.format(fname, i+1, nsegs)
+        segs.append(seg)
+
+    try:
+        curl_multi_to_files(segs, len(segs))
+    except (CurlError, pycurl.error):
+        if any(seg.badrange for seg in segs):
+            _g.log.warning('server ignored range requests for {}. '
+                           'falling back to one connection.'.format(fname))
+            os.remove(part)
+            return False
+        raise
 
+    got = sum(seg.got for seg in segs)
+
+    if got != size or os.path.getsize(part) != size:
+        raise CurlError('segmented download of {} is {} bytes, expected {}'
+                        .format(fname, got, size))
+
+    os.replace(part, path)
+
+    return True
+
+def curl_to_file(url, fname, proto, port=None, size=None):
     # unicurses doesn't seem to add these manually...
     _g.conf._LINES,_g.conf._COLS = unicurses.getmaxyx(_g.conf._stdscr)
 
-    with open(os.path.join(_g.conf._outdir, fname), 'wb') as fh:
-        c = curl_common_init(fh)
+    t     = Transfer(url, fname, proto, port, size)
+    host  = urllib.parse.urlsplit(url).hostname
+    nsegs = _g.conf._segments.get(host, 1)
+
+    # a leftover .part file is cheaper to resume than to start over.
+    if (nsegs > 1 and not os.path.exists(t.part) and
+        curl_segmented_to_file(url, fname, proto, nsegs, port)):
+        return None
 
-        c.setopt(c.URL, url) #'/'.join(rempath, urllib.parse.quote(fname)))
-        c.setopt(c.NOPROGRESS, False)
-        c.setopt(c.XFERINFOFUNCTION, curl_progress)
-        if port:
-            c.setopt(c.PORT, port)
+    while True:
+        c     = t.start(1)
+        errno = errmsg = None
 
         try:
             c.perform()
-        except pycurl.error:
-            check_curl_error(c, fh, proto, True)
-        check_curl_error(c, fh, proto)
+        except pycurl.error as e:
+            errno, errmsg = e.args
 
-        c.close()
+        if t.finish(errno, errmsg):
+            break
 
     return None
 
+def curl_ftp_feat(url, init=None):
+    '''Ask the FTP server at `url` which extensions it supports.
+
+       Parameters:
+       url - URL of any directory on the server.
+       init - optional function that sets extra options on the handle.
+
+       Returns the raw FEAT reply.
+    '''
+    buf   = BytesIO()
+    reply = []
+    c     = curl_common_init(buf)
+
+    if init:
+        init(c)
+
+    c.setopt(c.URL, url)
+    # log in and send FEAT, but don't transfer anything
+    c.setopt(c.NOBODY, True)
+    c.setopt(c.QUOTE, ['FEAT'])
+    # FTP server replies go to the header callback
+    c.setopt(c.HEADERFUNCTION, reply.append)
+
+    try:
+        try:
+            c.perform()
+        except pycurl.error:
+            check_curl_error(c, buf, 'FTP', True)
+    finally:
+        curl_release(c)
+
+    return b''.join(reply)
+
 def curl_to_buf(url, proto, c=None, buf=None):
     if ((c   and buf is None) or
         (buf and c   is None)):
@@ -205,11 +456,466 @@ def curl_to_buf(url, proto, c=None, buf=None):
     c.setopt(c.URL, url)
 
     try:
-        c.perform()
-    except pycurl.error:
-        check_curl_error(c, buf, proto, True)
-    check_curl_error(c, buf, proto)
-
-    c.close()
+        try:
+            c.perform()
+        except pycurl.error:
+            check_curl_error(c, buf, proto, True)
+        check_curl_error(c, buf, proto)
+    finally:
+        curl_release(c)
 
     return buf
+
+class Transfer:
+    '''Per-transfer state for curl_to_file() and curl_multi_to_files().
+
+       Data is written to `fname`.part and the file is renamed to `fname`
+       once the transfer completes. If a .part file is left over from an
+       interrupted run, the transfer resumes from its size. `ondone` can
+       be set to a function that is called right after the rename.
+
+       Parameters:
+       url - URL to download.
+       fname - name of the file to save to, relative to the output dir.
+       proto - protocol used for error checking (HTTP or FTP).
+       port - optional port to connect to.
+       size - optional size of the remote file, from the listing.
+    '''
+    PART_EXT = '.part'
+
+    # bytes written by all transfers so far, for the throughput stats
+    total = 0
+
+    # errors that mean the server can't resume from our offset
+    RESUME_ERRS = {
+        pycurl.E_RANGE_ERROR ,
+        pycurl.E_FTP_COULDNT_USE_REST ,
+        pycurl.E_BAD_DOWNLOAD_RESUME ,
+    }
+
+    def __init__(self, url, fname, proto, port=None, size=None):
+        self.url       = url
+        self.fname     = fname
+        self.label     = fname
+        self.proto     = proto
+        self.port      = port
+        self.size      = size
+        self.path      = os.path.join(_g.conf._outdir, fname)
+        self.part      = self.path + self.PART_EXT
+        self.hdrs      = {}
+        self.fh        = None
+        self.c         = None
+        self.slot      = None
+        self.offset    = 0
+        self.restarted = False
+        self.ondone    = None
+        self._fsz      = 0
+        self._time     = 0
+        self._lastdl   = 0
+        self._written  = False
+        self._badrange = False
+
+    def start(self, slot):
+        self.slot      = slot
+        self.hdrs      = {}
+        self._fsz      = 0
+        self._lastdl   = 0
+        self._written  = False
+        self._badrange = False
+
+        if os.path.exists(self.part):
+            self.fh     = open(self.part, 'r+b')
+            self.offset = self.fh.seek(0, os.SEEK_END)
+        else:
+            self.fh     = open(self.part, 'wb')
+            self.offset = 0
+
+        self.c = curl_common_init(self.fh, self.hdrs)
+
+        self.c.setopt(self.c.URL, self.url)
+        self.c.setopt(self.c.WRITEFUNCTION, self.write)
+        self.c.setopt(self.c.NOPROGRESS, False)
+        self.c.setopt(self.c.XFERINFOFUNCTION, self.progress)
+        if self.port:
+            self.c.setopt(self.c.PORT, self.port)
+
+        if self.offset:
+            _g.log.info('resuming {} from byte {}'.format(self.fname,
+                                                          self.offset))
+            self.c.setopt(self.c.RESUME_FROM_LARGE, self.offset)
+
+        return self.c
+
+    def range_ok(self, start):
+        '''Check that the server started sending data at `start`.'''
+        if self.proto != 'HTTP':
+            # cURL checks the REST reply itself.
+            return True
+
+        crange = self.hdrs.get('content-range', '')
+        m      = re.match(r'bytes\s+(\d+)-', crange)
+
+        return m is not None and int(m.group(1)) == start
+
+    def status_ok(self):
+        '''Check that the server isn't sending an error page.
+
+           The status line is taken from the headers, since getinfo()
+           can't be called from the write callback.
+        '''
+        m = re.match(r'\d+', self.hdrs.get('retstr', ''))
+
+        return self.proto != 'HTTP' or m is None or \
+               int(m.group()) in {200, 206}
+
+    def write(self, data):
+        if not self._written:
+            self._written = True
+
+            # keep error pages out of the .part file. aborting makes
+            # finish() report the response code.
+            if not self.status_ok():
+                return 0
+
+            if self.offset and not self.range_ok(self.offset):
+                _g.log.warning("server didn't honour range request for "
+                               '{}'.format(self.fname))
+                self._badrange = True
+                # abort the transfer with a write error
+                return 0
+
+        self.fh.write(data)
+        Transfer.total += len(data)
+
+        return None
+
+    def progress(self, ttdl, tdl, ttul, tul):
+        _time = time.time()
+        # ensure we are printing every 2 sec
+        tdiff = _time - self._time
+
+        if tdiff < 2:
+            return
+
+        if not self._fsz and ttdl:
+            self._fsz = _util.conv_bytes(self.offset + ttdl)
+
+        self._time = _time
+
+        dlspeed = (tdl - self._lastdl) / tdiff
+
+        # title is on the first line, so each slot gets the line after it.
+        line = self.slot + 1
+
+        if line < _g.conf._LINES:
+            msg = '{} | size {} | downloaded {} | speed {}'.format(
+                    self.label, self._fsz, _util.conv_bytes(self.offset+tdl),
+                    _util.conv_bytes(dlspeed) + '/s')
+
+            _g.conf._stdscr.addstr(line, 0, ' '*(_g.conf._COLS-1))
+            _g.conf._stdscr.addstr(line, 0, msg[:_g.conf._COLS-1])
+            _g.conf._stdscr.refresh()
+
+        self._lastdl = tdl
+
+        return None
+
+    def part_done(self):
+        '''Check if the server refused to resume because the .part file
+           is already complete, i.e. the last run stopped right before
+           renaming it.
+
+           The remote size is taken from the listing, or from the
+           Content-Range of the 416 reply.
+        '''
+        if (self.proto != 'HTTP' or not self.offset or
+            self.c.getinfo(self.c.RESPONSE_CODE) != 416):
+            return False
+
+        size = self.size
+
+        if size is None:
+            m    = re.match(r'bytes\s+\*/(\d+)',
+                            self.hdrs.get('content-range', ''))
+            size = int(m.group(1)) if m else None
+
+        return size == self.offset
+
+    def can_restart(self, errno):
+        if self.restarted or not self.offset:
+            return False
+
+        if self.proto == 'HTTP':
+            # range not satisfiable. most likely the remote file changed.
+            if self.c.getinfo(self.c.RESPONSE_CODE) == 416:
+                return True
+
+            # an error page says nothing about our offset
+            if not self.status_ok():
+                return False
+
+        return self._badrange or errno in self.RESUME_ERRS
+
+    def finish(self, errno=None, errmsg=None):
+        '''Check the transfer for errors and release its resources.
+
+           `errno` and `errmsg` are set when the transfer failed.
+
+           Returns True when the transfer is done and False when it
+           needs to be started again from scratch, which happens when
+           the server couldn't resume it.
+
+           On any other error the .part file is kept so the next run
+           can resume it.
+        '''
+        try:
+            if self.part_done():
+                _g.log.info('{} was already downloaded'.format(self.fname))
+            elif self.can_restart(errno):
+                _g.log.warning("couldn't resume {}. restarting from "
+                               'scratch.'.format(self.fname))
+                self.fh.seek(0)
+                self.fh.truncate()
+                self.restarted = True
+                return False
+            else:
+                if not self.status_ok():
+                    # drop anything this attempt wrote, so the next run
+                    # resumes from the data we had
+                    self.fh.truncate(self.offset)
+
+                if errno is not None:
+                    try:
+                        raise pycurl.error(errno, errmsg)
+                    except pycurl.error:
+                        check_curl_error(self.c, None, self.proto, True,
+                                         self.hdrs)
+                check_curl_error(self.c, None, self.proto, hdict=self.hdrs)
+        finally:
+            self.fh.close()
+            curl_release(self.c)
+
+        os.replace(self.part, self.path)
+
+        if self.ondone:
+            self.ondone()
+
+        return True
+
+class Segment(Transfer):
+    '''One byte range of a segmented download.
+
+       Parameters:
+       st, end - first and last byte (inclusive) of the range.
+       The rest are the same as Transfer.
+    '''
+    PART_EXT = '.segpart'
+
+    def __init__(self, url, fname, proto, st, end, port=None):
+        Transfer.__init__(self, url, fname, proto, port)
+        self.part     = self.path + self.PART_EXT
+        self.st       = st
+        self.end      = end
+        self.got      = 0
+        self.badrange = False
+
+    def start(self, slot):
+        self.slot     = slot
+        self.hdrs     = {}
+        self._written = False
+        self.got      = 0
+
+        self.fh = open(self.part, 'r+b')
+        self.fh.seek(self.st)
+        self.c  = curl_common_init(self.fh, self.hdrs)
+
+        self.c.setopt(self.c.URL, self.url)
+        self.c.setopt(self.c.RANGE, '{}-{}'.format(self.st, self.end))
+        self.c.setopt(self.c.WRITEFUNCTION, self.write)
+        self.c.setopt(self.c.NOPROGRESS, False)
+        self.c.setopt(self.c.XFERINFOFUNCTION, self.progress)
+        if self.port:
+            self.c.setopt(self.c.PORT, self.port)
+
+        return self.c
+
+    def write(self, data):
+        if not self._written:
+            self._written = True
+
+            if not self.status_ok():
+                return 0
+
+            if self.st and not self.range_ok(self.st):
+                self.badrange = True
+                return 0
+
+        if self.got + len(data) > self.end - self.st + 1:
+            # server is sending more than we asked for
+            self.badrange = True
+            return 0
+
+        self.fh.write(data)
+        self.got += len(data)
+        Transfer.total += len(data)
+
+        return None
+
+    def finish(self, errno=None, errmsg=None):
+        try:
+            if self.badrange:
+                raise CurlError('bad range response for {}'
+                                .format(self.label))
+
+            if errno is not None:
+                try:
+                    raise pycurl.error(errno, errmsg)
+                except pycurl.error:
+                    check_curl_error(self.c, None, self.proto, True,
+                                     self.hdrs)
+            check_curl_error(self.c, None, self.proto, hdict=self.hdrs)
+
+            if self.got != self.end - self.st + 1:
+                raise CurlError('short read for {}: got {} of {} bytes'
+                                .format(self.label, self.got,
+                                        self.end - self.st + 1))
+        finally:
+            self.fh.close()
+            curl_release(self.c)
+
+        return True
+
+class BufTransfer:
+    '''Per-transfer state for curl_multi_to_bufs().'''
+    def __init__(self, url, proto, init=None):
+        self.url   = url
+        self.label = url
+        self.proto = proto
+        self.init  = init
+        self.buf   = BytesIO()
+        self.c     = None
+        self.slot  = None
+
+    def start(self, slot):
+        self.slot = slot
+        self.c    = curl_common_init(self.buf)
+
+        if self.init:
+            self.init(self.c)
+
+        self.c.setopt(self.c.URL, self.url)
+
+        return self.c
+
+    def finish(self, errno=None, errmsg=None):
+        try:
+            if errno is not None:
+                try:
+                    raise pycurl.error(errno, errmsg)
+                except pycurl.error:
+                    check_curl_error(self.c, self.buf, self.proto, True)
+            check_curl_error(self.c, self.buf, self.proto)
+        finally:
+            curl_release(self.c)
+
+        return True
+
+def curl_multi_to_bufs(urls, proto, init=None, maxconns=None):
+    '''Fetch several URLs into memory in parallel.
+
+       Parameters:
+       urls - list of URLs to fetch.
+       proto - protocol used for error checking (HTTP or FTP).
+       init - optional function that sets extra options on each handle.
+       maxconns - max number of simultaneous transfers.
+
+       Returns a list of BytesIO objects in the same order as `urls`.
+    '''
+    xfers = [BufTransfer(url, proto, init) for url in urls]
+
+    curl_multi_perform(xfers, maxconns)
+
+    return [t.buf for t in xfers]
+
+def curl_multi_to_files(xfers, maxconns=None):
+    '''Download several files in parallel with a pycurl.CurlMulti.
+
+       Parameters:
+       xfers - list of Transfer objects to perform.
+       maxconns - max number of simultaneous transfers. Defaults to the
+                  `maxconns` config option.
+
+       When a transfer fails, no new transfers are started and the
+       CurlError of the first failure is raised once the running ones
+       are done.
+    '''
+    # unicurses doesn't seem to add these manually...
+    _g.conf._LINES,_g.conf._COLS = unicurses.getmaxyx(_g.conf._stdscr)
+
+    return curl_multi_perform(xfers, maxconns)
+
+def curl_multi_perform(xfers, maxconns=None):
+    '''Run transfer objects through a pycurl.CurlMulti.
+
+       Every object needs a start(slot) method that returns a ready
+       handle and a finish(errno, errmsg) method that checks for errors
+       and returns False if the transfer should be queued again.
+    '''
+    if maxconns is None:
+        maxconns = _g.conf._maxconns
+
+    queue  = list(reversed(xfers))
+    active = {}
+    slots  = list(reversed(range(maxconns)))
+    err    = None
+    m      = pycurl.CurlMulti()
+
+    try:
+        while active or (queue and err is None):
+            while queue and slots and err is None:
+                t = queue.pop()
+                m.add_handle(t.start(slots.pop()))
+                active[t.c] = t
+
+            while True:
+                ret, nhandles = m.perform()
+                if ret != pycurl.E_CALL_MULTI_PERFORM:
+                    break
+
+            while True:
+                nq, ok, failed = m.info_read()
+                done = [(c, None, None) for c in ok] + failed
+
+                for c, errno, errmsg in done:
+                    m.remove_handle(c)
+                    t = active.pop(c)
+                    slots.append(t.slot)
+
+                    try:
+                        if not t.finish(errno, errmsg):
+                            queue.append(t)
+                            continue
+                    except (CurlError, pycurl.error) as e:
+                        _g.log.error('{}: {}'.format(t.label, e))
+                        if err is None:
+                            err = e
+                    else:
+                        _g.log.info('finished {}'.format(t.label))
+
+                if not nq:
+                    break
+
+            if active:
+                m.select(1.0)
+    finally:
+        for c, t in active.items():
+            m.remove_handle(c)
+            if getattr(t, 'fh', None):
+                t.fh.close()
+            curl_release(c)
+        m.close()
+
+    if err is not None:
+        raise err
+
+    return None
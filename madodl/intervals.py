@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+
+#
+# sets of volume/chapter numbers
+#
+
+from bisect import bisect_left, bisect_right
+from heapq  import merge
+
+class IntervalSet:
+    '''A set of volume or chapter numbers.
+
+       Whole numbers are kept as sorted, disjoint runs of integers, so
+       `c1-5000` is one run instead of 5000 floats. Fractional numbers
+       (half volumes, chapter 10.5, ...) are kept as single points.
+
+       An open-ended range such as `c10-` is kept as a lower bound, the
+       tail. Every number from the tail on, fractional or not, is in the
+       set. Finite members at or past the tail are folded into it, so
+       iterating over the set only yields the numbers before the tail.
+
+       Membership is a binary search over the runs and points.
+
+       Parameters:
+       nums - optional iterable of numbers to add.
+    '''
+    __slots__ = ('_st', '_end', '_pts', '_from')
+
+    def __init__(self, nums=()):
+        self._st   = [] # run starts
+        self._end  = [] # inclusive run ends
+        self._pts  = [] # fractional numbers
+        self._from = None
+
+        for n in nums:
+            self.add(n)
+
+    @classmethod
+    def from_spec(cls, spec):
+        '''Build a set from the output of to_spec().'''
+        s = cls()
+
+        for part in spec.split(','):
+            part = part.strip()
+
+            if not part:
+                continue
+
+            if part.endswith('-'):
+                s.add_from(float(part[:-1]))
+            elif '-' in part[1:]:
+                st, end = part.split('-', 1)
+                s.add_range(float(st), float(end))
+            else:
+                s.add(float(part))
+
+        return s
+
+    def copy(self):
+        s       = IntervalSet()
+        s._st   = self._st[:]
+        s._end  = self._end[:]
+        s._pts  = self._pts[:]
+        s._from = self._from
+
+        return s
+
+    def closed(self):
+        '''Returns a copy without the tail.'''
+        s       = self.copy()
+        s._from = None
+
+        return s
+
+    @property
+    def tail(self):
+        '''Lower bound of the open-ended range or None.'''
+        return self._from
+
+    def _add_run(self, a, b):
+        if self._from is not None:
+            # anything from the tail on is already in
+            b = min(b, -int(-self._from // 1) - 1)
+
+            if a > b:
+                return None
+
+        # runs that overlap or touch [a, b] are merged with it
+        i = bisect_left(self._end, a - 1)
+        j = bisect_right(self._st, b + 1)
+
+        if i < j:
+            a = min(a, self._st[i])
+            b = max(b, self._end[j-1])
+
+        self._st[i:j]  = [a]
+        self._end[i:j] = [b]
+
+        return None
+
+    def add(self, n):
+        if n % 1:
+            if self._from is not None and n >= self._from:
+                return None
+
+            i = bisect_left(self._pts, n)
+
+            if i == len(self._pts) or self._pts[i] != n:
+                self._pts.insert(i, n)
+        else:
+            self._add_run(int(n), int(n))
+
+        return None
+
+    def add_range(self, st, end):
+        '''Add a range the way it is written in a request or filename.
+
+           `st` and every whole number after it up to and including
+           `end` are added. `end` itself is added too if it is
+           fractional, e.g. 1.5-3.5 is {1.5, 2, 3, 3.5}.
+        '''
+        self.add(st)
+
+        if int(st) + 1 <= int(end):
+            self._add_run(int(st) + 1, int(end))
+
+        if end % 1:
+            self.add(end)
+
+        return None
+
+    def add_from(self, n):
+        '''Add every number from `n` on.'''
+        if self._from is not None and self._from <= n:
+            return None
+
+        self._from = n
+        self._cut_from(n)
+
+        return None
+
+    def _cut_from(self, n):
+        '''Drop the finite members from `n` on.'''
+        i = bisect_left(self._pts, n)
+        del self._pts[i:]
+
+        last = -int(-n // 1) - 1
+        i    = bisect_right(self._st, last)
+        del self._st[i:]
+        del self._end[i:]
+
+        if self._end and self._end[-1] > last:
+            self._end[-1] = last
+
+        return None
+
+    def update(self, nums):
+        for n in nums:
+            self.add(n)
+
+        return None
+
+    def __contains__(self, n):
+        if self._from is not None and n >= self._from:
+            return True
+
+        if n % 1:
+            i = bisect_left(self._pts, n)
+
+            return i < len(self._pts) and self._pts[i] == n
+
+        i = bisect_right(self._st, n) - 1
+
+        return i >= 0 and n <= self._end[i]
+
+    def _iter_runs(self):
+        for a, b in zip(self._st, self._end):
+            for n in range(a, b+1):
+                yield float(n)
+
+    def __iter__(self):
+        '''Yields the finite members in ascending order as floats.'''
+        return merge(self._iter_runs(), self._pts)
+
+    def __len__(self):
+        '''Number of finite members.'''
+        return (sum(b - a + 1 for a, b in zip(self._st, self._end)) +
+                len(self._pts))
+
+    def __bool__(self):
+        return bool(self._st or self._pts or self._from is not None)
+
+    def __eq__(self, other):
+        if not isinstance(other, IntervalSet):
+            return NotImplemented
+
+        return (self._st, self._end, self._pts, self._from) == \
+               (other._st, other._end, other._pts, other._from)
+
+    def min(self):
+        '''Returns the smallest member or None if the set is empty.'''
+        cands = self._st[:1] + self._pts[:1]
+
+        if cands:
+            return float(min(cands))
+
+        return self._from
+
+    def max(self):
+        '''Returns the largest member, inf if the set is open-ended or
+           None if it is empty.'''
+        if self._from is not None:
+            return float('inf')
+
+        cands = self._end[-1:] + self._pts[-1:]
+
+        return float(max(cands)) if cands else None
+
+    def intersects(self, other):
+        '''Check if this set and `other` have a member in common.'''
+        if self._from is not None and other._from is not None:
+            return True
+
+        for a, b in ((self, other), (other, self)):
+            if a._from is not None and b and b.max() >= a._from:
+                return True
+
+            for p in a._pts:
+                if p in b:
+                    return True
+
+        i = j = 0
+
+        while i < len(self._st) and j < len(other._st):
+            if self._end[i] < other._st[j]:
+                i += 1
+            elif other._end[j] < self._st[i]:
+                j += 1
+            else:
+                return True
+
+        return False
+
+    def union(self, other):
+        s = self.copy()
+
+        for a, b in zip(other._st, other._end):
+            s._add_run(a, b)
+
+        s.update(other._pts)
+
+        if other._from is not None:
+            s.add_from(other._from)
+
+        return s
+
+    def difference(self, other):
+        '''Returns the members of this set that aren't in `other`.
+
+           The tail can't have holes cut into it, so it is kept as it
+           is unless `other` has a tail that covers it. If `other`'s
+           tail starts later, the whole numbers in between are kept.
+        '''
+        s      = IntervalSet()
+        st     = self._st[:]
+        end    = self._end[:]
+        s._pts = [p for p in self._pts if p not in other]
+
+        if self._from is not None:
+            if other._from is None:
+                s._from = self._from
+            elif other._from > self._from:
+                lo = -int(-self._from // 1)
+                hi = -int(-other._from // 1) - 1
+
+                if lo <= hi:
+                    st.append(lo)
+                    end.append(hi)
+
+        # cut the runs of `other` out of our runs
+        for a, b in zip(st, end):
+            i = bisect_right(other._end, a - 1)
+
+            while a <= b:
+                if i < len(other._st) and other._st[i] <= b:
+                    if other._st[i] > a:
+                        s._add_run(a, other._st[i] - 1)
+
+                    a = other._end[i] + 1
+                    i += 1
+                else:
+                    s._add_run(a, b)
+                    break
+
+        if other._from is not None:
+            s._cut_from(other._from)
+
+        return s
+
+    __or__  = union
+    __sub__ = difference
+
+    def to_spec(self):
+        '''Returns the set written like a request, e.g. `1-3,4.5,10-`.'''
+        def num(n):
+            return str(int(n)) if not n % 1 else repr(n)
+
+        parts = merge(((a, num(a) if a == b else '{}-{}'.format(a, b))
+                       for a, b in zip(self._st, self._end)),
+                      ((p, num(p)) for p in self._pts))
+        spec  = [p for _, p in parts]
+
+        if self._from is not None:
+            spec.append('{}-'.format(num(self._from)))
+
+        return ','.join(spec)
+
+    def __repr__(self):
+        return 'IntervalSet({!r})'.format(self.to_spec())
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+#
+# download journal for --resume
+#
+
+import os
+import json
+
+class Journal:
+    '''An append-only record of a download run.
+
+       The journal is a file of JSON lines: one `start` record, one
+       `plan` record per title with the files it is going to download,
+       a `done` record for every file that finished and an `end` record
+       once everything is downloaded. Each record is flushed and synced
+       to disk before the run goes on, so after a crash or ^C the
+       journal has every plan and every finished file. A record cut
+       short by a crash is ignored.
+
+       Parameters:
+       path - location of the journal file.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self._fh  = None
+
+    def _write(self, rec):
+        self._fh.write(json.dumps(rec) + '\n')
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+
+        return None
+
+    def start(self, outdir, plans):
+        '''Start a new journal, replacing the old one.
+
+           Parameters:
+           outdir - the output directory of the run.
+           plans - list of plan records, see the `plans` of load().
+        '''
+        os.makedirs(os.path.dirname(self.path), 0o770, True)
+
+        tmploc = '{}.{}.tmp'.format(self.path, os.getpid())
+
+        with open(tmploc, 'w') as fh:
+            self._fh = fh
+            self._write({'op': 'start', 'outdir': outdir})
+
+            for plan in plans:
+                rec = dict(plan)
+                rec['op'] = 'plan'
+                self._write(rec)
+
+        os.replace(tmploc, self.path)
+        self._fh = open(self.path, 'a')
+
+        return None
+
+    def resume(self):
+        '''Keep appending to the existing journal.'''
+        with open(self.path, 'rb+') as fh:
+            # drop a record cut short by a crash so that the
+            # next one doesn't get glued onto it
+            data = fh.read()
+            fh.truncate(data.rfind(b'\n') + 1)
+
+        self._fh = open(self.path, 'a')
+
+        return None
+
+    def done(self, plan, name):
+        '''Record that file `name` of the plan with index `plan` is
+           downloaded.'''
+        self._write({'op': 'done', 'plan': plan, 'name': name})
+
+        return None
+
+    def end(self):
+        '''Record that the run finished.'''
+        self._write({'op': 'end'})
+        self.close()
+
+        return None
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+        return None
+
+    def load(self):
+        '''Read the journal of an unfinished run.
+
+           Returns a 2-tuple of the output directory and the list of
+           plan records, each without the files that are already done.
+           Returns None if there is no journal or its run finished.
+        '''
+        try:
+            fh = open(self.path)
+        except FileNotFoundError:
+            return None
+
+        outdir = None
+        plans  = []
+
+        with fh:
+            for line in fh:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    # cut short by a crash
+                    continue
+
+                op = rec.pop('op')
+
+                if op == 'start':
+                    outdir = rec['outdir']
+                elif op == 'plan':
+                    plans.append(rec)
+                elif op == 'done':
+                    plan          = plans[rec['plan']]
+                    plan['files'] = [f for f in plan['files']
+                                     if f['name'] != rec['name']]
+                elif op == 'end':
+                    return None
+
+        if outdir is None:
+            return None
+
+        return (outdir, plans)
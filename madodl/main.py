@@ -10,18 +10,27 @@
 import os, sys
 from io        import BytesIO
 from itertools import chain
+import re
+import shlex
 import urllib.parse
 import argparse
+import threading
+import time
+import random
 import logging
 import logging.handlers
 import pkg_resources
-import json
 
 def local_import():
-    global _curl, _parsers, _util, _out
-
-    import madodl.curl    as _curl
-    import madodl.parsers as _parsers
+    global _curl, _parsers, _util, _out, _cache, _intervals, _cover, \
+           _journal
+
+    import madodl.curl      as _curl
+    import madodl.cache     as _cache
+    import madodl.parsers   as _parsers
+    import madodl.intervals as _intervals
+    import madodl.cover     as _cover
+    import madodl.journal   as _journal
     import madodl.util    as _util
     import madodl.out     as _out
 
@@ -67,143 +76,351 @@ _g.loc = loc
 class Struct:
     pass
 
+def ftp_init(c):
+    '''Set the options needed to LIST over madokami's FTP.'''
+    #c.setopt(c.DIRLISTONLY, True)
+    c.setopt(c.USE_SSL, True)
+    c.setopt(c.SSL_VERIFYPEER, False)
+    c.setopt(c.USERPWD, '{}:{}'.format(loc['USER'], loc['PASS']))
+    c.setopt(c.PORT, loc['FTPPORT'])
+
+    return None
+
+def ftp_has_mlsd():
+    '''Check if madokami's FTP server supports MLSD listings with the
+       facts we need. The FEAT reply is cached with the LISTings.'''
+    url  = 'ftp://{}/'.format(loc['DOMAIN'])
+    lc   = _g.conf._listcache
+    feat = lc.get(url + '#FEAT') if lc else None
+
+    if feat is None:
+        try:
+            feat = _curl.curl_ftp_feat(url, ftp_init)
+        except (CurlError, pycurl.error) as e:
+            _g.log.warning("couldn't get FTP features ({}). using LIST."
+                           .format(e))
+            return False
+
+        if lc:
+            lc.put(url + '#FEAT', feat)
+
+    # e.g. ` MLST type*;size*;modify*;`
+    m = re.search(br'^\s*MLST\s+(\S*)', feat, re.M | re.I)
+
+    if m is None:
+        return False
+
+    facts = {f.rstrip(b'*').lower() for f in m.group(1).split(b';')}
+
+    return {b'type', b'size', b'modify'} <= facts
+
+def ftp_listcmd():
+    '''Returns the FTP command that directories are listed with, MLSD
+       or LIST, depending on the `listformat` option and the server.'''
+    if _g.conf._listcmd is None:
+        if _g.conf._listformat == 'auto':
+            _g.conf._listcmd = 'MLSD' if ftp_has_mlsd() else 'LIST'
+        else:
+            _g.conf._listcmd = _g.conf._listformat.upper()
+
+        _g.log.info('listing directories with {}'.format(_g.conf._listcmd))
+
+    return _g.conf._listcmd
+
+def ftp_list_init(c):
+    '''Like ftp_init(), and list with ftp_listcmd().'''
+    ftp_init(c)
+
+    if ftp_listcmd() == 'MLSD':
+        c.setopt(c.CUSTOMREQUEST, 'MLSD')
+
+    return None
+
+def list_cache_key(url):
+    '''LISTings are cached by URL. MLSD listings get a different key so
+       they are never parsed as LIST output or the other way around.'''
+    if ftp_listcmd() == 'MLSD':
+        return url + '#MLSD'
+
+    return url
+
+def search_exact_url(name='', have_path=False):
+    # need to unquote for LIST to work properly with nocwd
+    name = urllib.parse.unquote(name)
+    path = _util.create_nwo_path(name) if not have_path else ''
+
+    ml = loc['MLOC'] if not have_path else ''
+
+    path_noscheme = '{}{}{}/{}/'.format(loc['DOMAIN'], ml, path, name)
+
+    return 'ftp://' + path_noscheme
+
 #
 # returns an FTP LISTing
 #
 def search_exact(name='', have_path=False):
     buf = BytesIO()
+    url = search_exact_url(name, have_path)
 
-    # need to unquote for LIST to work properly with nocwd
-    name = urllib.parse.unquote(name)
-    path = _util.create_nwo_path(name) if not have_path else ''
+    lc  = _g.conf._listcache
+    key = list_cache_key(url)
 
-    c = _curl.curl_common_init(buf)
+    if lc:
+        data = lc.get(key)
 
-    #c.setopt(c.DIRLISTONLY, True)
-    c.setopt(c.USE_SSL, True)
-    c.setopt(c.SSL_VERIFYPEER, False)
-    c.setopt(c.USERPWD, '{}:{}'.format(loc['USER'], loc['PASS']))
-    c.setopt(c.PORT, loc['FTPPORT'])
+        if data is not None:
+            return BytesIO(data)
 
-    ml = loc['MLOC'] if not have_path else ''
+    c = _curl.curl_common_init(buf)
+    ftp_list_init(c)
 
-    path_noscheme = '{}{}{}/{}/'.format(loc['DOMAIN'], ml, path, name)
+    _g.log.info(url)
 
-    _g.log.info('ftp://' + path_noscheme)
+    _curl.curl_to_buf(url, 'FTP', c, buf)
 
-    return _curl.curl_to_buf('ftp://' + path_noscheme, 'FTP', c, buf)
+    if lc:
+        lc.put(key, buf.getvalue())
+
+    return buf
 
 def search_query(name=''):
     return _curl.curl_to_buf('https://{}{}{}'.format(loc['DOMAIN'],
                                                      loc['SEARCH'], name),
                              'HTTP')
 
-def apply_tag_filters(f, title):
-    f._preftag  = False
-    f._npreftag = False
+class TagRules:
+    '''The tag filters of the config file, compiled for
+       apply_tag_filters().
 
-    if not f._tag or not _g.conf._alltags:
-        return True
+       The filters are still applied in the order they were configured,
+       but only the ones that can have an effect on a file are looked
+       at: the filters named by one of its tags, found by a hash lookup,
+       and the first `only` filter it doesn't have a tag for. The `for`
+       list of each filter is turned into a dict of lowercased titles.
+
+       Parameters:
+       tags - list of TagFilters.
+    '''
+    def __init__(self, tags):
+        self.src     = tags
+        self._rules  = []
+        # lowercased tag name -> ids of the rules for it
+        self._byname = {}
+        self._only   = []
+
+        for i, t in enumerate(tags):
+            low = t._name.lower()
+            self._byname.setdefault(low, []).append(i)
 
-    taglow = [t.lower() for t in f._tag]
-    titlelow = title.lower()
-
-    for t in _g.conf._alltags:
-        _g.log.info('apply_tag_filters(): {} {} {} {}'.format(t._name,
-                                                        t._filter, t._case,
-                                                        taglow))
-        _g.log.info('apply_tag_filters(): {}'.format(t._name.lower() in
-                                                        taglow))
-        if t._name.lower() in taglow:
-            if ((t._case == 'exact' and t._name not in f._tag) or
-                (t._case == 'upper' and t._name not in
-                                       [t.upper() for t in f._tag])):
+            if t._filter == 'only':
+                self._only.append((i, low))
+
+            if t._for == 'all':
+                scope = None
+            else:
+                # first come, first serve
+                scope = {}
+
+                for d in t._for:
+                    for ft, req in d.items():
+                        scope.setdefault(ft.lower(), req)
+
+            self._rules.append((t._name, t._case, t._filter, scope))
+
+    def apply(self, f, title):
+        taglow = {t.lower() for t in f._tag}
+        hits   = sorted(i for t in taglow for i in self._byname.get(t, ()))
+        upper  = None
+        stop   = None
+
+        for i, low in self._only:
+            if low not in taglow:
+                stop = i
+                break
+
+        for i in hits:
+            if stop is not None and i > stop:
+                break
+
+            name, case, filt, scope = self._rules[i]
+
+            if case == 'exact' and name not in f._tag:
                 return True
 
-            curtag = t._name.lower()
+            if case == 'upper':
+                if upper is None:
+                    upper = {t.upper() for t in f._tag}
+
+                if name not in upper:
+                    return True
+
             # we need to check the `for` sub-opt before actually checking
             # the filter to make sure we don't apply the filters to titles
             # not in the `for` listing.
-            if t._for != 'all':
-                for d in t._for:
-                    for ft in d.keys():
-                        if ft.lower() == titlelow:
-                            mreq = d[titlelow]
-                            break # first come, first serve
-                    else:
-                        continue
-                    break # need this too
-                else:
+            if scope is not None:
+                mreq = scope.get(title.lower())
+
+                if mreq is None:
                     return True
 
-                if mreq != 'all':
-                    if (_util.common_elem(f._vols, mreq._vols) or
-                        _util.common_elem(f._chps, mreq._chps)):
-                        pass
-                    else:
-                        return True
+                if mreq != 'all' and not (f._vols.intersects(mreq._vols) or
+                                          f._chps.intersects(mreq._chps)):
+                    return True
 
-            if t._filter == 'out':
-                del f
+            if filt == 'out':
                 return False
-            if t._filter == 'prefer':
+            if filt == 'prefer':
                 f._preftag = True
-            elif t._filter == 'not prefer':
+            elif filt == 'not prefer':
                 f._npreftag = True
-        else:
-            if t._filter == 'only':
-                del f
-                return False
 
-    return True
+        return stop is None
+
+def apply_tag_filters(f, title):
+    f._preftag  = False
+    f._npreftag = False
+
+    if not f._tag or not _g.conf._alltags:
+        return True
+
+    rules = getattr(_g.conf, '_tagrules', None)
+
+    if rules is None or rules.src is not _g.conf._alltags:
+        rules = _g.conf._tagrules = TagRules(_g.conf._alltags)
+
+    return rules.apply(f, title)
+
+class MatchIndex:
+    '''The files matched by walk_thru_listing(), indexed by the volumes
+       and chapters they were matched for.
+
+       Each entry is a 3-tuple of the listing entry and the lists of
+       matched volumes and chapters. Entries that get replaced by a
+       better tagged file are only marked as dropped, so neither
+       looking up the first file with a volume/chapter nor dropping it
+       has to scan the whole list.
+    '''
+    def __init__(self):
+        self._ents     = []
+        self._alive    = []
+        # indexed with v_or_c: [chp, vol] -> {num : [entry ids]}
+        self._byvc     = [{}, {}]
+        self._npbyvc   = [{}, {}]
+        self._npdead   = set()
+        self.npref     = 0
+
+    def add(self, f, vq, cq, npref=False):
+        i = len(self._ents)
+        self._ents.append((f, vq, cq))
+        self._alive.append(True)
+
+        idxs = [self._byvc]
+
+        if npref:
+            idxs.append(self._npbyvc)
+            self.npref += 1
+
+        for idx in idxs:
+            for what, nums in ((1, vq), (0, cq)):
+                for n in nums:
+                    ids = idx[what].setdefault(n, [])
+
+                    if not ids or ids[-1] != i:
+                        ids.append(i)
 
-def check_preftags(vc, vcq, fo, allf, npref, v_or_c):
+        return None
+
+    @staticmethod
+    def _first(ids, dead):
+        # entry ids are in the order the files were matched in
+        while ids and dead(ids[0]):
+            del ids[0]
+
+        return ids[0] if ids else None
+
+    def first(self, vc, v_or_c):
+        '''Returns the id of the first file still matched for `vc`.'''
+        return self._first(self._byvc[v_or_c].get(vc),
+                           lambda i: not self._alive[i])
+
+    def first_npref(self, vc, v_or_c):
+        '''Returns the id of the first nonpreferred file matched for
+           `vc`, whether or not it has been dropped since.'''
+        return self._first(self._npbyvc[v_or_c].get(vc),
+                           lambda i: i in self._npdead)
+
+    def name(self, i):
+        return self._ents[i][0]
+
+    def drop(self, i):
+        self._alive[i] = False
+
+        return None
+
+    def drop_npref(self, i):
+        self._npdead.add(i)
+        self.npref -= 1
+
+        return None
+
+    def files(self):
+        return [e for e, alive in zip(self._ents, self._alive) if alive]
+
+def check_preftags(vc, vcq, fo, found, v_or_c):
     # v_or_c: True -> vol, False -> chp
     if v_or_c:
-        ftupidx = 1
         what = 'vol'
         whatls = fo._vols
     else:
-        ftupidx = 2
         what = 'chp'
         whatls = fo._chps
 
     if fo._preftag:
-            for ftup in allf:
-                if vc in ftup[ftupidx]:
-                    _g.log.info('replacing {} with preferred'
-                             ' tag {}'.format(ftup[0], fo._f))
-                    allf.remove(ftup)
-                    vcq.extend(whatls)
-                    return 'break'
-            else:
-                _out.die("BUG: couldn't find any dup {} in {} "
-                    "when replacing with pref tag".format(what, whatls),
-                    lvl='critical')
-    elif not fo._npreftag and npref:
-        for t in npref:
-            if vc in t[ftupidx]:
-                tup = t
-                break
-        else:
+        i = found.first(vc, v_or_c)
+
+        if i is None and vc in vcq:
+            # queued by an earlier replacement for this file
+            return 'break'
+        elif i is None:
+            _out.die("BUG: couldn't find any dup {} in {} "
+                "when replacing with pref tag".format(what, whatls),
+                lvl='critical')
+
+        _g.log.info('replacing {} with preferred'
+                    ' tag {}'.format(found.name(i), fo._f))
+        found.drop(i)
+        vcq.extend(whatls)
+        return 'break'
+    elif not fo._npreftag and found.npref:
+        i = found.first_npref(vc, v_or_c)
+
+        if i is None:
             _g.log.warning('dup vol and chps seen')
             return 'break'
 
         _g.log.info('replacing nonpreferred {} '
-                 'with {}'.format(tup[0], fo._f))
-        allf.remove(tup)
-        npref.remove(tup)
+                    'with {}'.format(found.name(i), fo._f))
+        found.drop(i)
+        found.drop_npref(i)
         return 'continue'
 
     return None
 
-def walk_thru_listing(req, title, dir_ls):
+def parse_listing(title, dir_ls):
+    '''Parse the filenames of a listing, going through the parse cache
+       and worker pool if they're enabled.'''
+    return _parsers.ParseFile.parse_many((f.name for f in dir_ls), title,
+                                         _g.conf._parsecache,
+                                         _g.conf._parsepool)
+
+def walk_thru_listing(req, title, dir_ls, parsed=None):
     '''Walk through FTP directory listing and extract requested data.
 
        Parameters:
        req - User requested files.
        title - Title of the series requested.
        dir_ls - FTP directory listing.
+       parsed - the ParseFiles of `dir_ls`, if already parsed.
 
        Returns a 4-tuple of three lists and one str.
 
@@ -211,31 +428,22 @@ def walk_thru_listing(req, title, dir_ls):
        matched (volumes, chapters, filenames), and the complete archive
        filename (if matched) in the case that all volumes are requested.
     '''
-    compv    = []
-    compc    = []
-    allf     = []
-    npref    = []
+    compv    = set()
+    compc    = set()
+    found    = MatchIndex()
     compfile = None
 
-    if req._vols and req._vols[-1] == req.ALL:
-        oerng_v = True
-        oest_v = req._vols[-2]
-    else:
-        oerng_v = False
-
-    if req._chps and req._chps[-1] == req.ALL:
-        oerng_c = True
-        oest_c = req._chps[-2]
-    else:
-        oerng_c = False
-
-    reqv_cpy = req._vols[:]
-    reqc_cpy = req._chps[:]
+    # open-ended ranges, e.g. `v5-`
+    oerng_v = req._vols.tail is not None
+    oest_c  = req._chps.tail
+    oerng_c = oest_c is not None
 
     only_file = len(dir_ls) == 1
 
-    for f in dir_ls:
-        fo = _parsers.ParseFile(f.name, title)
+    if parsed is None:
+        parsed = parse_listing(title, dir_ls)
+
+    for f, fo in zip(dir_ls, parsed):
 
         if not apply_tag_filters(fo, title):
             _g.log.info('** filtered out {}'.format(fo._f))
@@ -261,7 +469,7 @@ def walk_thru_listing(req, title, dir_ls):
                 if c not in cq and c not in compc:
                     cq.append(c)
                 else:
-                    act = check_preftags(fov, vq, fo, allf, npref, True)
+                    act = check_preftags(c, cq, fo, found, False)
                     if isinstance(act, str):
                         if fo._preftag:
                             continue
@@ -273,24 +481,18 @@ def walk_thru_listing(req, title, dir_ls):
 
         # TODO: add vol greedy match here
         if req._vols and not any({oerng_v, req._all}):
-            too_many_vols = False
-
-            for v in fo._vols:
-                if v not in req._vols:
-                    too_many_vols = True
-                    break
-
-            if too_many_vols:
+            if any(v not in req._vols for v in fo._vols):
+                # too many vols
                 continue
 
         for fov in fo._vols:
-            if (oerng_v and fov >= oest_v) or req._all or fov in req._vols:
+            if req._all or fov in req._vols:
                 if fov in compv: # already seen this vol
                     for foc in fo._chps: # then check if vol is split
                         if compc and foc not in compc: # with all new chps
                             continue # is new
                         else:
-                            act = check_preftags(fov, vq, fo, allf, npref, True)
+                            act = check_preftags(fov, vq, fo, found, True)
                             if isinstance(act, str):
                                 if fo._preftag:
                                     apnd = True
@@ -312,65 +514,69 @@ def walk_thru_listing(req, title, dir_ls):
 
         # XXX the chapter logic is really hackish and probably
         # needs to be completely rewritten.
-        if (len(req._chps) > 1 and len(fo._chps) == len(req._chps)
-           and req._chps[0] == fo._chps[0]):
+        if (not oerng_c and len(req._chps) > 1 and
+            len(fo._chps) == len(req._chps) and
+            req._chps.min() == fo._chps.min()):
             rmax  = None
             fomax = None
-            last  = req._chps[0]
+            reqc  = list(req._chps)
+            foc   = list(fo._chps)
+            last  = reqc[0]
 
-            for i in range(1, len(req._chps)):
-                if req._chps[i] == last+1:
-                    rmax = req._chps[i]
+            for i in range(1, len(reqc)):
+                if reqc[i] == last+1:
+                    rmax = reqc[i]
                 else:
                     break
-                last = req._chps[i]
+                last = reqc[i]
 
-            last = fo._chps[0]
+            last = foc[0]
 
-            for i in range(1, len(fo._chps)):
-                if fo._chps[i] == last+1:
-                    fomax = fo._chps[i]
+            for i in range(1, len(foc)):
+                if foc[i] == last+1:
+                    fomax = foc[i]
                 else:
                     break
-                last = fo._chps[i]
+                last = foc[i]
 
             if None in {rmax, fomax} or rmax != fomax:
                 pass
             else:
-                iter_celems = _util.common_elem_gen(req._chps, (cq, compc),
-                                                    flat=False)
+                cclash = [c for c in reqc if c in compc or c in cq]
 
-                for cclash in iter_celems:
-                    check_preftags(cclash, cq, fo, allf, npref, False)
+                for c in cclash:
+                    check_preftags(c, cq, fo, found, False)
 
-                for i in req._chps:
+                for i in reqc:
                     if i <= rmax:
                         cq.append(float(i))
                     else:
                         break
 
         if req._chps:
-            if oerng_c and fo._chps and min(fo._chps) >= oest_c:
+            if oerng_c and fo._chps and fo._chps.min() >= oest_c:
                 for c in fo._chps:
-                    if c in set(chain(cq, compc)): # in queue, check preftags
-                        act = check_preftags(c, cq, fo, allf, npref, False)
+                    if c in compc or c in cq: # in queue, check preftags
+                        act = check_preftags(c, cq, fo, found, False)
                         if act == 'break'   : break
                         if act == 'continue': continue
                         break
                 else:
                     # XXX do we need to check min() again?
-                    if fo._chps and min(fo._chps) >= oest_c:
+                    if fo._chps and fo._chps.min() >= oest_c:
                         cq.extend(fo._chps)
             else:
                 # TODO: add chp greedy match here
-                # NOTE: the list-comprehension is non-greedy check
-                if req._all or not [c for c in fo._chps if c not in
-                                         req._chps]:
-                    for c in _util.common_elem_gen(fo._chps, req._chps):
-                        if c not in set(chain(cq, compc)):
+                # NOTE: the all() is the non-greedy check
+                if req._all or all(c in req._chps for c in fo._chps):
+                    for c in fo._chps:
+                        if c not in req._chps:
+                            continue
+
+                        if c not in compc and c not in cq:
                             cq.append(c)
                         else: # in queue, check preftags
-                            act = check_preftags(c, cq, fo, allf, npref, False)
+                            act = check_preftags(c, cq, fo, found, False)
 
                             if act == 'break'   : break
                             if act == 'continue':
@@ -385,26 +591,14 @@ def walk_thru_listing(req, title, dir_ls):
             _g.log.info('found chp {}'.format(cq))
 
         if vq or cq:
-            if fo._npreftag:
-                npref.append((f, vq, cq))
-
-            allf.append((f, vq, cq))
+            found.add(f, vq, cq, fo._npreftag)
 
             _g.log.info('file - {}'.format(f.name))
 
-        compv.extend(vq)
-        compc.extend(cq)
-
-        _util.rm_req_elems(reqv_cpy, vq)
-        _util.rm_req_elems(reqc_cpy, cq)
+        compv.update(vq)
+        compc.update(cq)
 
-        compv = list(set(compv))
-        compc = list(set(compc))
-
-    compv = sorted(compv)
-    compc = sorted(compc)
-
-    return (compv, compc, allf, compfile)
+    return (sorted(compv), sorted(compc), found.files(), compfile)
 
 def init_args():
 
@@ -430,6 +624,17 @@ def init_args():
 
         return f
 
+    def positive_int(n):
+        try:
+            n = int(n)
+        except ValueError:
+            raise argparse.ArgumentTypeError('{} is not a number.'.format(n))
+
+        if n < 1:
+            raise argparse.ArgumentTypeError('{} is not positive.'.format(n))
+
+        return n
+
     try:
          _version = pkg_resources.get_distribution('madodl').version
     except pkg_resources.DistributionNotFound:
@@ -437,7 +642,7 @@ def init_args():
 
     args_parser = argparse.ArgumentParser(
                             description='Download manga from madokami.',
-                            usage='%(prog)s [-dhsv] '
+                            usage='%(prog)s [-dhnsv] [-j N] '
                                             '-m manga '
                                             '[volume(s)] [chapter(s)] ... '
                                             '[-o out-dir]')
@@ -450,7 +655,6 @@ def init_args():
     args_parser.add_argument('-V', '--version', action='version',
                              version='madodl ' + _version)
     args_parser.add_argument('-m', nargs='+', action='append', dest='manga',
-                             required=True,
                              metavar=('manga', 'volume(s) chapter(s)'),
                              help='''
                                   The name of the manga to download.
@@ -464,9 +668,72 @@ def init_args():
                              help='directory to save files to')
     args_parser.add_argument('-a', dest='auth', metavar='user:pw',
                             help='madokami user and password')
+    args_parser.add_argument('-j', type=positive_int, dest='maxconns',
+                             metavar='N',
+                             help='number of files to download in parallel')
+    args_parser.add_argument('-n', '--dry-run', action='store_true',
+                             dest='dry_run',
+                             help='print what would be downloaded and exit')
+    args_parser.add_argument('--plan', action='store_true',
+                             help='like -n, with the size and date of each '
+                                  'file and an estimate of the download '
+                                  'time')
+    args_parser.add_argument('--select', choices=('first', 'minsize'),
+                             help='pick the first matching files in listing '
+                                  'order, or the ones with the least total '
+                                  'size')
+    args_parser.add_argument('--sync', nargs='?', const='', metavar='file',
+                             help='download what is new for every title in '
+                                  'the follow list (default: the `followfile` '
+                                  'config option)')
+    args_parser.add_argument('--watch', nargs='?', const='', metavar='file',
+                             help='keep running and download new files for '
+                                  'the titles in the follow list as they '
+                                  'come out')
+    args_parser.add_argument('--resume', action='store_true',
+                             help='finish the downloads of an interrupted '
+                                  'run')
+    args_parser.add_argument('--redownload', action='store_true',
+                             help='download files even if they are already '
+                                  'in the output directory')
+    args_parser.add_argument('--refresh', action='store_true',
+                             help='ignore cached FTP LISTings')
+    args_parser.add_argument('--search', metavar='title',
+                             help='search the local cache for a title and '
+                                  'exit')
+    args_parser.add_argument('--alias', nargs=2, metavar=('name', 'path'),
+                             help='always resolve name to the title at path '
+                                  '(e.g. /Manga/B/BE/BERS/Berserk)')
+    args_parser.add_argument('--unalias', metavar='name',
+                             help='forget the alias for name')
+    args_parser.add_argument('--aliases', action='store_true',
+                             help='list all aliases')
+    args_parser.add_argument('--prune-aliases', type=positive_int,
+                             metavar='days',
+                             help='forget aliases not used in this many days')
 
     args = args_parser.parse_args()
 
+    if args.sync is not None and args.manga:
+        args_parser.error('argument --sync: not allowed with argument -m')
+
+    if args.watch is not None and (args.manga or args.sync is not None or
+                                   args.dry_run or args.plan):
+        args_parser.error('argument --watch: not allowed with -m, --sync, '
+                          '-n or --plan')
+
+    if args.resume and (args.manga or args.sync is not None or
+                        args.watch is not None or args.dry_run or args.plan or
+                        args.outdir):
+        args_parser.error('argument --resume: not allowed with -m, --sync, '
+                          '--watch, -n, --plan or -o')
+
+    if not args.manga and not any((args.alias, args.unalias, args.aliases,
+                                   args.prune_aliases, args.search,
+                                   args.sync is not None,
+                                   args.watch is not None, args.resume)):
+        args_parser.error('the following arguments are required: -m')
+
     if args.silent:
         loglvl = logging.CRITICAL
     elif args.debug:
@@ -519,6 +786,26 @@ def init_config():
         'cachefile' ,
         'user'      ,
         'pass'      ,
+        'maxconns'    ,
+        'segments'      ,
+        'segment_min'   ,
+        'listcache'     ,
+        'listcache_ttl' ,
+        'listcache_max' ,
+        'cacheindex'    ,
+        'cachettl'      ,
+        'cacherefresh'  ,
+        'parsecache'     ,
+        'parsecache_max' ,
+        'parseprocs'     ,
+        'parseprocs_min' ,
+        'select'         ,
+        'listformat'     ,
+        'library'        ,
+        'library_hash'   ,
+        'followfile'     ,
+        'watch_min'      ,
+        'watch_max'      ,
     }
     # for valid option values
     # None = an option whose validity cannot be ascertained
@@ -536,6 +823,35 @@ def init_config():
     VALID_OPTVAL_DEFAULT_OUTDIR = None
     VALID_OPTVAL_USER           = None
     VALID_OPTVAL_PASS           = None
+    VALID_OPTVAL_MAXCONNS       = range(1, 33)
+    VALID_OPTVAL_SEGMENT_MIN    = range(1, 1024**2)
+    VALID_OPTVAL_LISTCACHE      = binopt
+    VALID_OPTVAL_LISTCACHE_TTL  = range(1, 24*365)
+    VALID_OPTVAL_LISTCACHE_MAX  = range(1, 1024**2)
+    VALID_OPTVAL_CACHEINDEX     = binopt
+    VALID_OPTVAL_CACHETTL       = range(1, 24*365)
+    VALID_OPTVAL_CACHEREFRESH   = {
+        'sync'       ,
+        'background' ,
+    }
+    VALID_OPTVAL_PARSECACHE     = binopt
+    VALID_OPTVAL_PARSECACHE_MAX = range(1, 10**8)
+    VALID_OPTVAL_PARSEPROCS     = range(0, 65)
+    VALID_OPTVAL_PARSEPROCS_MIN = range(1, 10**7)
+    VALID_OPTVAL_SELECT         = {
+        'first'   ,
+        'minsize' ,
+    }
+    VALID_OPTVAL_LISTFORMAT     = {
+        'auto' ,
+        'mlsd' ,
+        'list' ,
+    }
+    VALID_OPTVAL_LIBRARY        = binopt
+    VALID_OPTVAL_LIBRARY_HASH   = binopt
+    VALID_OPTVAL_FOLLOWFILE     = None
+    VALID_OPTVAL_WATCH_MIN      = range(1, 60*24*365)
+    VALID_OPTVAL_WATCH_MAX      = range(1, 60*24*365)
 
     DEFAULT_OPTVAL_NO_OUTPUT      = False
     DEFAULT_OPTVAL_LOGFILE        = None
@@ -547,6 +863,35 @@ def init_config():
     DEFAULT_OPTVAL_DEFAULT_OUTDIR = os.getcwd()
     DEFAULT_OPTVAL_USER           = None
     DEFAULT_OPTVAL_PASS           = None
+    DEFAULT_OPTVAL_MAXCONNS       = 4
+    DEFAULT_OPTVAL_SEGMENTS       = {}
+    # in MB
+    DEFAULT_OPTVAL_SEGMENT_MIN    = 64
+    DEFAULT_OPTVAL_LISTCACHE      = True
+    # in hours
+    DEFAULT_OPTVAL_LISTCACHE_TTL  = 24
+    # in MB
+    DEFAULT_OPTVAL_LISTCACHE_MAX  = 32
+    DEFAULT_OPTVAL_CACHEINDEX     = True
+    # in hours
+    DEFAULT_OPTVAL_CACHETTL       = 24*7
+    DEFAULT_OPTVAL_CACHEREFRESH   = 'background'
+    DEFAULT_OPTVAL_PARSECACHE     = True
+    # in filenames
+    DEFAULT_OPTVAL_PARSECACHE_MAX = 200000
+    # 0 = parse in-process
+    DEFAULT_OPTVAL_PARSEPROCS     = 0
+    # in filenames
+    DEFAULT_OPTVAL_PARSEPROCS_MIN = 2000
+    DEFAULT_OPTVAL_SELECT         = 'first'
+    DEFAULT_OPTVAL_LISTFORMAT     = 'auto'
+    DEFAULT_OPTVAL_LIBRARY        = True
+    DEFAULT_OPTVAL_LIBRARY_HASH   = False
+    # $HOME/.config/madodl/follow, see follow_loc()
+    DEFAULT_OPTVAL_FOLLOWFILE     = None
+    # in minutes
+    DEFAULT_OPTVAL_WATCH_MIN      = 30
+    DEFAULT_OPTVAL_WATCH_MAX      = 60*24*7
 
     class TagFilter:
         VALID_CASE = {
@@ -616,9 +961,9 @@ def init_config():
 
     def set_simple_opt(yh, opt, vals, default):
         if opt in yh:
-            if not yh[opt]:
+            if yh[opt] is None or yh[opt] == '':
                setattr(_g.conf, '_{}'.format(opt), default)
-            elif default is None and not vals:
+            elif vals is None:
                 setattr(_g.conf, '_{}'.format(opt), yh[opt])
             elif yh[opt] in vals:
                 setattr(_g.conf, '_{}'.format(opt), yh[opt])
@@ -657,7 +1002,27 @@ def init_config():
         _g.conf._default_outdir = DEFAULT_OPTVAL_DEFAULT_OUTDIR
         _g.conf._no_output      = DEFAULT_OPTVAL_NO_OUTPUT
         _g.conf._usecache       = DEFAULT_OPTVAL_USECACHE
-        _g.conf._cachefile      = DEFAULT_OPTVAL_CACHEFILE
+        _g.conf._cachefile      = DEFAULT_OPTVAL_CACHEFILE(h)
+        _g.conf._maxconns       = DEFAULT_OPTVAL_MAXCONNS
+        _g.conf._segments       = DEFAULT_OPTVAL_SEGMENTS
+        _g.conf._segment_min    = DEFAULT_OPTVAL_SEGMENT_MIN * 1024**2
+        _g.conf._listcache      = DEFAULT_OPTVAL_LISTCACHE
+        _g.conf._listcache_ttl  = DEFAULT_OPTVAL_LISTCACHE_TTL
+        _g.conf._listcache_max  = DEFAULT_OPTVAL_LISTCACHE_MAX
+        _g.conf._cacheindex     = DEFAULT_OPTVAL_CACHEINDEX
+        _g.conf._cachettl       = DEFAULT_OPTVAL_CACHETTL
+        _g.conf._cacherefresh   = DEFAULT_OPTVAL_CACHEREFRESH
+        _g.conf._parsecache     = DEFAULT_OPTVAL_PARSECACHE
+        _g.conf._parsecache_max = DEFAULT_OPTVAL_PARSECACHE_MAX
+        _g.conf._parseprocs     = DEFAULT_OPTVAL_PARSEPROCS
+        _g.conf._parseprocs_min = DEFAULT_OPTVAL_PARSEPROCS_MIN
+        _g.conf._select         = DEFAULT_OPTVAL_SELECT
+        _g.conf._listformat     = DEFAULT_OPTVAL_LISTFORMAT
+        _g.conf._library        = DEFAULT_OPTVAL_LIBRARY
+        _g.conf._library_hash   = DEFAULT_OPTVAL_LIBRARY_HASH
+        _g.conf._followfile     = DEFAULT_OPTVAL_FOLLOWFILE
+        _g.conf._watch_min      = DEFAULT_OPTVAL_WATCH_MIN
+        _g.conf._watch_max      = DEFAULT_OPTVAL_WATCH_MAX
         return
 
     with open(c) as cf:
@@ -705,7 +1070,14 @@ def init_config():
                 set_simple_opt(yh, 'cachefile', VALID_OPTVAL_CACHEFILE,
                                DEFAULT_OPTVAL_CACHEFILE(h))
             else:
-                _g.conf._cachefile = DEFAULT_OPTVAL_CACHEFILE
+                _g.conf._cachefile = DEFAULT_OPTVAL_CACHEFILE(h)
+
+            set_simple_opt(yh, 'cacheindex', VALID_OPTVAL_CACHEINDEX,
+                           DEFAULT_OPTVAL_CACHEINDEX)
+            set_simple_opt(yh, 'cachettl', VALID_OPTVAL_CACHETTL,
+                           DEFAULT_OPTVAL_CACHETTL)
+            set_simple_opt(yh, 'cacherefresh', VALID_OPTVAL_CACHEREFRESH,
+                           DEFAULT_OPTVAL_CACHEREFRESH)
 
             set_simple_opt(yh, 'default_outdir', VALID_OPTVAL_DEFAULT_OUTDIR,
                            DEFAULT_OPTVAL_DEFAULT_OUTDIR)
@@ -716,93 +1088,308 @@ def init_config():
                                DEFAULT_OPTVAL_PASS)
             else:
                 _g.conf._pass = DEFAULT_OPTVAL_PASS
+
+            set_simple_opt(yh, 'maxconns', VALID_OPTVAL_MAXCONNS,
+                           DEFAULT_OPTVAL_MAXCONNS)
+
+            _g.conf._segments = {}
+
+            if 'segments' in yh and yh['segments']:
+                if not isinstance(yh['segments'], dict):
+                    raise ConfigError('`segments` must be a mapping of '
+                                      'host to number of connections')
+
+                for host, n in yh['segments'].items():
+                    if not isinstance(n, int) or n not in range(1, 33):
+                        _g.log.error('bad segment count for {}'.format(host))
+                        continue
+
+                    _g.conf._segments[host] = n
+
+            set_simple_opt(yh, 'segment_min', VALID_OPTVAL_SEGMENT_MIN,
+                           DEFAULT_OPTVAL_SEGMENT_MIN)
+
+            _g.conf._segment_min *= 1024**2
+
+            set_simple_opt(yh, 'listcache', VALID_OPTVAL_LISTCACHE,
+                           DEFAULT_OPTVAL_LISTCACHE)
+            set_simple_opt(yh, 'listcache_ttl', VALID_OPTVAL_LISTCACHE_TTL,
+                           DEFAULT_OPTVAL_LISTCACHE_TTL)
+            set_simple_opt(yh, 'listcache_max', VALID_OPTVAL_LISTCACHE_MAX,
+                           DEFAULT_OPTVAL_LISTCACHE_MAX)
+            set_simple_opt(yh, 'parsecache', VALID_OPTVAL_PARSECACHE,
+                           DEFAULT_OPTVAL_PARSECACHE)
+            set_simple_opt(yh, 'parsecache_max', VALID_OPTVAL_PARSECACHE_MAX,
+                           DEFAULT_OPTVAL_PARSECACHE_MAX)
+            set_simple_opt(yh, 'parseprocs', VALID_OPTVAL_PARSEPROCS,
+                           DEFAULT_OPTVAL_PARSEPROCS)
+            set_simple_opt(yh, 'parseprocs_min', VALID_OPTVAL_PARSEPROCS_MIN,
+                           DEFAULT_OPTVAL_PARSEPROCS_MIN)
+            set_simple_opt(yh, 'select', VALID_OPTVAL_SELECT,
+                           DEFAULT_OPTVAL_SELECT)
+            set_simple_opt(yh, 'listformat', VALID_OPTVAL_LISTFORMAT,
+                           DEFAULT_OPTVAL_LISTFORMAT)
+            set_simple_opt(yh, 'library', VALID_OPTVAL_LIBRARY,
+                           DEFAULT_OPTVAL_LIBRARY)
+            set_simple_opt(yh, 'library_hash', VALID_OPTVAL_LIBRARY_HASH,
+                           DEFAULT_OPTVAL_LIBRARY_HASH)
+            set_simple_opt(yh, 'followfile', VALID_OPTVAL_FOLLOWFILE,
+                           DEFAULT_OPTVAL_FOLLOWFILE)
+            set_simple_opt(yh, 'watch_min', VALID_OPTVAL_WATCH_MIN,
+                           DEFAULT_OPTVAL_WATCH_MIN)
+            set_simple_opt(yh, 'watch_max', VALID_OPTVAL_WATCH_MAX,
+                           DEFAULT_OPTVAL_WATCH_MAX)
+
+            if _g.conf._watch_max < _g.conf._watch_min:
+                _g.log.error('watch_max is less than watch_min')
+                _g.conf._watch_max = _g.conf._watch_min
         except yaml.YAMLError as yerr:
             _g.log.error('config file error: {}'.format(yerr))
 
-class breaks(object):
-# Great idea from:
-# http://stackoverflow.com/a/23665658
-    class Break(Exception):
-      """Break out of the with statement"""
+def refresh_tree(jsonloc):
+    try:
+        _curl.curl_json_refresh(jsonloc)
+    except (CurlError, pycurl.error, OSError) as e:
+        _g.log.warning("couldn't refresh JSON tree: {}".format(e))
 
-    def __init__(self, value):
-        self.value = value
+    return None
 
-    def __enter__(self):
-        return self.value.__enter__()
+def cache_jsonloc():
+    '''Returns the location of the JSON tree, fetching or refreshing it
+       first if needed.'''
+    jsonloc = os.path.join(_g.conf._home, '.cache', 'madodl',
+                           'files.json') \
+        if not _g.conf._cachefile else _g.conf._cachefile
+
+    jsondirloc = os.path.dirname(jsonloc)
+
+    if not os.path.exists(jsonloc):
+        os.makedirs(jsondirloc, 0o770, True)
+        _curl.curl_json_refresh(jsonloc)
+    elif (_g.conf._refresh_thread is None and
+          _cache.tree_stale(jsonloc, _g.conf._cachettl * 3600)):
+        if _g.conf._cacherefresh == 'background':
+            # serve this run from the stale tree, the new one is
+            # swapped in when it's done.
+            # a daemon, so ^C doesn't have to wait for it
+            _g.conf._refresh_thread = threading.Thread(target=refresh_tree,
+                                                       args=(jsonloc,),
+                                                       daemon=True)
+            _g.conf._refresh_thread.start()
+        else:
+            _curl.curl_json_refresh(jsonloc)
 
-    def __exit__(self, etype, value, traceback):
-        error = self.value.__exit__(etype, value, traceback)
-        if etype == self.Break:
-            return True
+    assert os.path.exists(jsonloc)
 
-        return error
+    return jsonloc
 
-def get_listing(manga):
-    badret = ('', '')
+def cache_lookup(path, manga):
+    '''Find a title in the JSON tree.
+
+       Parameters:
+       path - NWO path of the title.
+       manga - name of the title (case insensitive).
+
+       Returns a 2-tuple of the title's contents and its exact name, or
+       a 2-tuple of empty strings if it isn't in the tree.
+    '''
+    badret  = ('', '')
+    jsonloc = cache_jsonloc()
+
+    if _g.conf._cacheindex:
+        tidx = _cache.TreeIndex(jsonloc)
+        ret  = tidx.lookup(path, manga) or badret
+        tidx.close()
+    else:
+        with open(jsonloc, errors='surrogateescape') as f:
+            ret = _parsers.dumbtree_find(f, path, manga) or badret
+
+    return ret
+
+def cache_lookup_many(wants):
+    '''Find several titles in the JSON tree at once, with one pass over
+       the file or one open index.
+
+       Parameters:
+       wants - iterable of (nwo path, title) tuples.
+
+       Returns a dict that maps (nwo path, lower-cased title) to a 2-tuple
+       of the title's contents and its exact name, for each title that
+       is in the tree.
+    '''
+    jsonloc = cache_jsonloc()
+
+    if _g.conf._cacheindex:
+        tidx = _cache.TreeIndex(jsonloc)
+        ret  = {}
+
+        for path, manga in wants:
+            hit = tidx.lookup(path, manga)
+
+            if hit:
+                ret[(path, manga.lower())] = hit
+
+        tidx.close()
+    else:
+        with open(jsonloc, errors='surrogateescape') as f:
+            ret = _parsers.dumbtree_find_many(f, wants)
+
+    return ret
+
+def cache_listing(path, mdir, title):
+    d1,d2,d3 = path.split('/')
+
+    _g.conf._found_in_cache = True
+    _g.conf._cururl = 'https://{}{}{}/{}/{}/{}'.format(loc['DOMAIN'],
+                                    loc['MLOC'], d1, d2, d3, title)
+
+    _g.log.info('\n-----\n{}-----'.format(mdir))
+
+    return (mdir, title, '/'.join((path, title)))
+
+def alias_listing(manga):
+    '''Get the listing of a title through the alias cache.
+
+       Returns the same as get_listing() or None if `manga` has no
+       usable alias.
+    '''
+    hit = _g.conf._aliases.get(manga)
+
+    if hit is None:
+        return None
+
+    rpath, title = hit
+
+    _g.log.info('alias {} -> {}'.format(manga, rpath))
 
     if _g.conf._usecache:
-        # XXX move this
-        def match_dir(diriter, ldict):
-            global mlow
+        # /Manga/d1/d2/d3/title
+        path = '/'.join(rpath.split('/')[2:5])
+        mdir, ctitle = cache_lookup(path, title)
 
-            try:
-                cdir = next(diriter)
-            except StopIteration:
-                for cdict in ldict:
-                    if cdict['name'].lower() == mlow:
-                        return (cdict['contents'], cdict['name'])
-                return None
-
-            for cdict in ldict:
-                if cdict['name'] == cdir:
-                    return match_dir(diriter, cdict['contents'])
-            else:
-                return None
+        if mdir:
+            return cache_listing(path, mdir, ctitle)
 
-        jsonloc = os.path.join(_g.conf._home, '.cache', 'madodl',
-                               'files.json') \
-            if not _g.conf._cachefile else _g.conf._cachefile
+    m = urllib.parse.quote(rpath)
 
-        jsondirloc = os.path.dirname(jsonloc)
+    try:
+        dirls = search_exact(m, True).getvalue().decode()
+    except (CurlError, pycurl.error) as e:
+        _g.log.warning('alias {} -> {} is stale ({}). removing it.'
+                       .format(manga, rpath, e))
+        _g.conf._aliases.remove(manga)
+        return None
 
-        if not os.path.exists(jsonloc):
-            os.makedirs(jsondirloc, 0o770, True)
-            _curl.curl_json_list(jsonloc, True)
+    _g.conf._found_in_cache = False
 
-        assert os.path.exists(jsonloc)
+    return (dirls, title, m)
 
-        path = _util.create_nwo_path(manga)
-        d1,d2,d3 = path.split('/')
-        mdir = None
+def choose_match(titles, none=False):
+    '''Ask the user to pick one of `titles`. Returns its index.
 
-        with breaks(open(jsonloc, errors='surrogateescape')) as f:
-            jobj = json.load(f)
+       Parameters:
+       titles - list of titles to pick from.
+       none - also offer to pick none of them, which returns None.
+    '''
+    if len(titles) > 1:
+        print('Multiple matches found. Please choose from the '
+              'selection below:\n')
+    else:
+        print('No exact match found. Please confirm the title '
+              'below:\n')
 
-            for o in jobj[0].get('contents'):
-                if o['name'] == 'Manga':
-                    jobj = o['contents']
-                    break
+    if none:
+        print('0: none of these')
+
+    i = 1
+    for f in titles:
+        print('{}: {}'.format(i, f))
+        i += 1
+
+    print()
+
+    while 1:
+        try:
+            ch = int(input('choice > '))
+            if ch in range(0 if none else 1, i):
+                break
+            print('Pick a number between {} and {}'.format(0 if none else 1,
+                                                          i-1))
+        except ValueError:
+            print('Invalid input.')
+
+    return ch-1 if ch else None
+
+def search_offline(manga, limit=10):
+    '''Fuzzy search the titles in the JSON tree.
 
-            global mlow
-            mlow = manga.lower()
-            mdir, title = match_dir(iter((d1,d2,d3)), jobj) or badret
+       Returns a list of (nwo path, title, score) tuples, best first.
+    '''
+    tidx = _cache.TreeIndex(cache_jsonloc())
+    hits = tidx.search(manga, limit)
+    tidx.close()
+
+    return hits
+
+def offline_listing(manga):
+    '''Resolve `manga` with an offline search of the JSON tree.
+
+       Only an exact match is taken as is, a fuzzy one has to be
+       confirmed by the user.
+
+       Returns the same as get_listing() or None if nothing matched.
+    '''
+    hits = search_offline(manga)
+
+    if not hits:
+        return None
+
+    # an exact match always has a score > 1
+    if hits[0][2] > 1:
+        ch = 0
+        _out._('one match found: {}'.format(hits[0][1]))
+    elif not sys.stdin.isatty():
+        # nobody to confirm a guess, leave it to the online search
+        return None
+    else:
+        ch = choose_match([title for path, title, score in hits], True)
+
+        if ch is None:
+            return None
 
-            if not mdir:
-                _g.log.warning("couldn't find title in JSON file. Trying "
-                               "online query.")
-                _g.conf._found_in_cache = False
-                raise breaks.Break
+    path, title = hits[ch][:2]
+    mdir, title = cache_lookup(path, title)
 
-            _g.conf._found_in_cache = True
-            _g.conf._cururl = 'https://{}{}{}/{}/{}/{}'.format(loc['DOMAIN'],
-                                            loc['MLOC'], d1, d2, d3, title)
+    _g.conf._aliases.put(manga, '{}{}/{}'.format(loc['MLOC'], path, title),
+                         title)
+
+    return cache_listing(path, mdir, title)
+
+def get_listing(manga):
+    ret = alias_listing(manga)
+
+    if ret:
+        return ret
+
+    if _g.conf._usecache:
+        path = _util.create_nwo_path(manga)
+        mdir, title = cache_lookup(path, manga)
 
-            _g.log.info('\n-----\n{}-----'.format(mdir))
+        if mdir:
+            return cache_listing(path, mdir, title)
 
-            path = '/'.join((path, title))
+        _g.log.info("couldn't find title at its NWO path in JSON file. "
+                    "Trying offline search.")
 
-            return (mdir, title, path)
+        ret = offline_listing(manga)
+
+        if ret:
+            return ret
+
+        _g.log.warning("couldn't find title in JSON file. Trying "
+                       "online query.")
+
+    _g.conf._found_in_cache = False
 
     qout = search_query(manga).getvalue().decode()
     qp   = _parsers.ParseQuery()
@@ -823,26 +1410,10 @@ def get_listing(manga):
         _out.die('manga not found')
 
     if qp.mresultnum > 1:
-        print('Multiple matches found. Please choose from the '
-              'selection below:\n')
-        i = 1
-        for url, f in qp.mresults:
-            print('{}: {}'.format(i, os.path.basename(f)))
-            i += 1
-
-        print()
+        ch = choose_match([os.path.basename(f) for url, f in qp.mresults])
 
-        while 1:
-            try:
-                ch = int(input('choice > '))
-                if ch in range(1, i):
-                    break
-                print('Pick a number between 1 and {}'.format(i-1))
-            except ValueError:
-                print('Invalid input.')
-
-        m = qp.mresults[ch-1][0]
-        title = os.path.basename(qp.mresults[ch-1][1])
+        m = qp.mresults[ch][0]
+        title = os.path.basename(qp.mresults[ch][1])
     else:
         m = qp.mresults[0][0]
         title = os.path.basename(qp.mresults[0][1])
@@ -852,6 +1423,9 @@ def get_listing(manga):
 
     _g.log.info('\n-----\n{}-----'.format(dirls))
 
+    # remember the choice so the next run can skip the search.
+    _g.conf._aliases.put(manga, urllib.parse.unquote(m), title)
+
     return (dirls, title, m)
 
 def subdir_recurse(listing, path, depth=1):
@@ -871,6 +1445,8 @@ def subdir_recurse(listing, path, depth=1):
             title.basename = path
             title.name     = fname
             title.path     = this_path
+            title.size     = listing[idx].get('size')
+            title.mtime    = _util.tree_mtime(listing[idx].get('time'))
             listing[idx]   = title
         else: # sanity check
             _out.die('BUG: unsupported file type `{}`'.format(d_or_f))
@@ -880,128 +1456,810 @@ def subdir_recurse(listing, path, depth=1):
 
     return _util.flatten_sublists(listing)
 
-def rem_subdir_recurse(listing, path, depth=1):
-    # XXX add a knob for this
-    if depth > 256:
-        _out.die('reached max recursion depth')
+def rem_subdir_recurse(listing, path):
+    '''Flatten an FTP LISTing and the LISTings of all its subdirectories.
 
-    for idx in range(len(listing)):
-        # madokami's FTP LIST format is long ls, [{}/ are meta tokens]:
-        # {d,-}rwxrwxrwx 1 u g sz mon day y/time fname
-        #  |                                     |
-        #  |=> directory or regular file         |=> filename
-        #
-        # XXX: while highly unlikely that whitespace gives any significant
-        # distinction beyond one space, the split() module splits by any amount         # of wspace; thus, when re-join()ed, any extra wspace is truncated to
-        # one space.
-        fields        = listing[idx].split()
-        d_or_f, fname = (fields[0][:1], ' '.join(fields[8:]))
-        this_path     = ''.join([path, '/', fname])
+       The tree is walked one level at a time so that all the sibling
+       directories of a level are LISTed in parallel. The lines are
+       parsed as LIST or MLSD output, depending on ftp_listcmd().
 
-        if d_or_f == 'd':
-            listing[idx] = rem_subdir_recurse(search_exact(this_path, True)
-                                                .getvalue()
-                                                .decode()
-                                                .splitlines(),
-                                              this_path, depth+1)
-        elif d_or_f == '-': # is reg file
-            title          = Struct()
-            title.basename = path
-            title.name     = fname
-            title.path     = this_path
-            listing[idx]   = title
-        else: # sanity check
-            _out.die('BUG: unsupported file type `{}`'.format(d_or_f))
+       Parameters:
+       listing - lines of the FTP LISTing of `path`.
+       path - remote path of the listing.
 
-    if depth != 1:
-        return listing
+       Returns a list of Structs, one per regular file, with its
+       basename, name, path, size and mtime. The size and mtime are
+       None if they couldn't be read from the LISTing.
+    '''
+    level = [(listing, path)]
+    depth = 1
+    parse = _parsers.mlsd_entry if ftp_listcmd() == 'MLSD' else \
+            _parsers.list_entry
+
+    while level:
+        # XXX add a knob for this
+        if depth > 256:
+            _out.die('reached max recursion depth')
+
+        subdirs = []
+
+        for ls, lpath in level:
+            for idx in range(len(ls)):
+                ent = parse(ls[idx])
+
+                if ent is None:
+                    # `total` line, or the directory itself in MLSD
+                    ls[idx] = []
+                    continue
+
+                d_or_f, fname, size, mtime = ent
+                this_path = ''.join([lpath, '/', fname])
+
+                if d_or_f == 'd':
+                    # filled in below, once the whole level is LISTed.
+                    ls[idx] = []
+                    subdirs.append((ls[idx], this_path))
+                elif d_or_f == '-': # is reg file
+                    title          = Struct()
+                    title.basename = lpath
+                    title.name     = fname
+                    title.path     = this_path
+                    title.size     = size
+                    title.mtime    = mtime
+                    ls[idx]        = title
+                else: # sanity check
+                    _out.die('BUG: unsupported file type `{}`'.format(d_or_f))
+
+        if subdirs:
+            lc    = _g.conf._listcache
+            urls  = [search_exact_url(p, True) for ls, p in subdirs]
+            data  = {}
+            fetch = []
+
+            for url in urls:
+                cached = lc.get(list_cache_key(url)) if lc else None
+
+                if cached is None:
+                    _g.log.info(url)
+                    fetch.append(url)
+                else:
+                    data[url] = cached
+
+            bufs = _curl.curl_multi_to_bufs(fetch, 'FTP', ftp_list_init)
+
+            for url, buf in zip(fetch, bufs):
+                data[url] = buf.getvalue()
+
+                if lc:
+                    lc.put(list_cache_key(url), data[url])
+
+            for (ls, p), url in zip(subdirs, urls):
+                ls.extend(data[url].decode().splitlines())
+
+        level  = subdirs
+        depth += 1
 
     return _util.flatten_sublists(listing)
 
-def main_loop(manga_list):
-    global compc, compv
+def find_missing(want, got):
+    '''Returns an IntervalSet of the requested numbers that weren't found.
 
-    for m in manga_list:
-            req               = _parsers.ParseRequest(m)
-            sout, title, path = get_listing(req._name)
+       An open-ended range is taken to go up to the last number found,
+       so the whole numbers from its start up to there that weren't
+       found are missing. If nothing past its start was found, the
+       range itself is missing.
 
-            if _g.conf._usecache and _g.conf._found_in_cache:
-                sout = subdir_recurse(sout, path)
-            else:
-                sout = sout.splitlines()
-                sout = rem_subdir_recurse(sout, path)
+       Parameters:
+       want - the requested IntervalSet.
+       got - sorted list of the numbers that were found.
+    '''
+    have = _intervals.IntervalSet(got)
+    miss = want.difference(have)
+
+    if miss.tail is not None and got and got[-1] >= miss.tail:
+        gaps = _intervals.IntervalSet()
+        lo   = -int(-miss.tail // 1)
+
+        if lo <= got[-1]:
+            gaps.add_range(lo, int(got[-1]))
+
+        miss = miss.closed().union(gaps.difference(have))
+
+    return miss
+
+def report_missing(what, want, got):
+    '''Tell the user which of the requested volumes or chapters weren't
+       found.
+
+       Parameters:
+       what - `vol` or `chp`.
+       want - the requested IntervalSet.
+       got - sorted list of the numbers that were found.
+    '''
+    miss = find_missing(want, got)
+
+    if miss:
+        _out._("couldn't find {}(s): {}".format(what, miss.to_spec()))
+
+    return None
+
+def plan_title(m, found=None):
+    '''Resolve one -m request to the files that should be downloaded.
+
+       Parameters:
+       m - the -m arguments, title first.
+       found - optional (nwo path, contents, title) of the title in the
+               JSON tree, from sync_lookup().
+
+       Returns a Struct with the request (`req`), the exact title
+       (`title`), the URL prefix of the files (`ppfx`), the complete
+       archive (`compfile`, or None), the matched volumes, chapters and
+       files (`compv`, `compc`, `files`) and the files the listing order
+       alone would've matched (`first`).
+
+       Of the files to download, the ones already in the library are
+       in `have` and the rest in `todo`. Every file is saved under its
+       name alone, so of the files that share a name (from different
+       subdirectories) only the first one is kept.
+    '''
+    req = _parsers.ParseRequest(list(m))
+
+    if found:
+        sout, title, path = cache_listing(*found)
+    else:
+        sout, title, path = get_listing(req._name)
+
+    if _g.conf._usecache and _g.conf._found_in_cache:
+        sout = subdir_recurse(sout, path)
+    else:
+        sout = sout.splitlines()
+        sout = rem_subdir_recurse(sout, path)
+
+    parsed = parse_listing(title, sout)
+
+    compv, compc, allf, compfile = walk_thru_listing(req, title, sout, parsed)
+
+    plan       = Struct()
+    plan.req   = req
+    plan.title = title
+    plan.first = allf
+
+    if _g.conf._select == 'minsize' and not compfile:
+        ents  = [(f, fo) for f, fo in zip(sout, parsed)
+                 if apply_tag_filters(fo, title)]
+        allf  = _cover.select(req, ents)
+        compv = sorted(set(chain.from_iterable(v for f, v, c in allf)))
+        compc = sorted(set(chain.from_iterable(c for f, v, c in allf)))
+
+    plan.compv    = compv
+    plan.compc    = compc
+    plan.files    = allf
+    plan.compfile = compfile
+
+    # XXX sigh...
+    # need to append MLOC when we get a cache match.
+    plan.ppfx = ''.join(['https://', loc['DOMAIN']])
+
+    if _g.conf._found_in_cache:
+        plan.ppfx = ''.join([plan.ppfx, loc['MLOC']])
+
+    report_missing('vol', req._vols, compv)
+    report_missing('chp', req._chps, compc)
+
+    plan.have = []
+    plan.todo = []
+    names     = set()
+
+    for ent in plan_files(plan):
+        if ent[0].name in names:
+            # it would end up in the same file (and .part file)
+            _g.log.warning('skipping {}/{}: another file has the same '
+                           'name'.format(ent[0].basename, ent[0].name))
+            continue
+
+        names.add(ent[0].name)
+
+        if _g.conf._library and _g.conf._library.have(ent[0]):
+            plan.have.append(ent)
+        else:
+            plan.todo.append(ent)
+
+    return plan
+
+def file_url(plan, f):
+    return '/'.join([plan.ppfx, _util.create_nwo_basename(f.basename),
+                     urllib.parse.quote(f.name)])
+
+def plan_files(plan):
+    if plan.compfile:
+        return [(plan.compfile, [], [])]
 
-            compv, compc, allf, compfile = walk_thru_listing(req, title, sout)
+    return plan.files
 
-            if req._vols and req._vols[-1] == req.ALL:
-                del req._vols[-1]
+def total_size(files):
+    '''Returns the total size of (listing entry, vols, chps) tuples and
+       the number of them whose size is unknown.'''
+    total   = 0
+    unknown = 0
 
-            if req._chps and req._chps[-1] == req.ALL:
-                del req._chps[-1]
+    for f, v, c in files:
+        if getattr(f, 'size', None) is None:
+            unknown += 1
+        else:
+            total += f.size
+
+    return (total, unknown)
+
+def have_size(files):
+    '''Returns the local size of library files.'''
+    return sum(_g.conf._library.size(f.name) for f, v, c in files)
+
+def part_size(f):
+    '''Returns the size of what an earlier run left of `f`.'''
+    try:
+        return os.path.getsize(os.path.join(_g.conf._outdir, f.name +
+                                            _curl.Transfer.PART_EXT))
+    except OSError:
+        return 0
+
+def eta(nbytes):
+    '''Estimate how long downloading `nbytes` will take from the
+       throughput of recent runs. Returns a printable string.'''
+    rate = _g.conf._throughput.rate()
+
+    if rate is None:
+        return 'ETA unknown, nothing downloaded yet'
+
+    secs = int(nbytes / rate)
+
+    return 'ETA {}:{:02}:{:02} at {}/s'.format(secs // 3600, secs // 60 % 60,
+                                              secs % 60,
+                                              _util.conv_bytes(int(rate)))
+
+def print_plan(plan, detail=False):
+    '''Print what would be downloaded for a title.
+
+       Parameters:
+       plan - a plan_title() plan.
+       detail - also print the size and date of each file, and how long
+                the download will take (--plan).
+
+       Returns a 2-tuple of the number of bytes left to download and
+       the number of files whose size is unknown.
+    '''
+    print('{}:'.format(plan.title))
+
+    files = plan.todo
+    left  = 0
+
+    for f, v, c in files:
+        if not detail:
+            print('  {}'.format(f.name))
+            continue
+
+        size  = getattr(f, 'size', None)
+        mtime = getattr(f, 'mtime', None)
+        have  = part_size(f)
+        note  = ''
+
+        if size is not None:
+            left += max(size - have, 0)
+
+            if have:
+                note = ' ({} left)'.format(_util.conv_bytes(max(size-have,
+                                                                 0)))
+
+        print('  {:>10}  {:10}  {}{}'.format(
+              _util.conv_bytes(size) if size is not None else '?',
+              time.strftime('%Y-%m-%d', time.gmtime(mtime))
+                if mtime is not None else '-',
+              f.name, note))
+
+    total, unknown = total_size(files)
+    print('  {} file(s), {}{}'.format(len(files), _util.conv_bytes(total),
+          ' ({} of unknown size)'.format(unknown) if unknown else ''))
+
+    if plan.have:
+        print('  {} file(s) already downloaded, {} skipped'
+              .format(len(plan.have), _util.conv_bytes(have_size(plan.have))))
+
+    if detail:
+        print('  {}'.format(eta(left)))
+
+    if _g.conf._select != 'first' and not plan.compfile:
+        ftotal, funknown = total_size(plan.first)
+        saved            = ftotal - total_size(plan.files)[0]
+
+        if saved >= 0:
+            diff = 'saved {}'.format(_util.conv_bytes(saved))
+        else:
+            diff = '{} more'.format(_util.conv_bytes(-saved))
+
+        print('  listing order: {} file(s), {}, {}'
+              .format(len(plan.first), _util.conv_bytes(ftotal), diff))
 
-            missv = str([v for v in req._vols if v not in compv]).strip('[]')
-            missc = str([c for c in req._chps if c not in compc]).strip('[]')
+    return (left, unknown)
 
-            if missv:
-                _out._("couldn't find vol(s): " + missv)
+def fetch_plan(plan, done=None):
+    '''Download the files of a plan_title() plan that aren't in the
+       library yet.
 
-            if missc:
-                _out._("couldn't find chp(s): " + missc)
+       Parameters:
+       plan - a plan_title() plan.
+       done - optional function that is called with the listing entry
+              of each file as soon as it is downloaded.
+    '''
+    nbytes = _curl.Transfer.total
+    st     = time.time()
+
+    def finished(f):
+        if _g.conf._library:
+            _g.conf._library.add(f)
+
+        if done:
+            done(f)
+
+        return None
+
+    try:
+        stdscr          = unicurses.initscr()
+        _g.conf._stdscr = stdscr
+        unicurses.noecho()
+
+        if plan.compfile:
+            _out._('downloading complete archive... ', end='')
+            _g.conf._stdscr.erase()
+            _g.conf._stdscr.addstr(0, 0, plan.compfile.name)
+            _g.conf._stdscr.refresh()
+            _curl.curl_to_file(file_url(plan, plan.compfile),
+                               plan.compfile.name, 'HTTP',
+                               size=getattr(plan.compfile, 'size', None))
+            finished(plan.compfile)
+        else:
+            _out._('downloading volume/chapters... ', end='')
+            _g.conf._stdscr.erase()
+            _g.conf._stdscr.addstr(0, 0, 'title - {}'.format(plan.title))
+            _g.conf._stdscr.refresh()
+            xfers = []
+            for f,v,c in plan.todo:
+                t        = _curl.Transfer(file_url(plan, f), f.name, 'HTTP',
+                                          size=getattr(f, 'size', None))
+                t.ondone = lambda f=f: finished(f)
+                xfers.append(t)
+            _curl.curl_multi_to_files(xfers)
+    except:
+        raise
+    finally:
+        unicurses.nocbreak()
+        _g.conf._stdscr.keypad(False)
+        unicurses.echo()
+        unicurses.endwin()
+
+        _g.conf._throughput.record(_curl.Transfer.total - nbytes,
+                                   time.time() - st)
+
+    print('done', file=sys.stderr)
+
+    return None
+
+def journal_loc():
+    return os.path.join(_g.conf._home, '.cache', 'madodl', 'journal')
+
+def plan_record(plan):
+    '''Returns what the journal keeps of a plan: the files left to
+       download and how to get them.'''
+    return {
+        'title'    : plan.title ,
+        'ppfx'     : plan.ppfx ,
+        'compfile' : plan.compfile is not None ,
+        'files'    : [{'basename' : f.basename ,
+                       'name'     : f.name ,
+                       'size'     : getattr(f, 'size', None) ,
+                       'mtime'    : getattr(f, 'mtime', None)}
+                      for f, v, c in plan.todo] ,
+    }
+
+def record_plan(rec):
+    '''Rebuild a plan from its journal record, for fetch_plan().'''
+    plan       = Struct()
+    plan.title = rec['title']
+    plan.ppfx  = rec['ppfx']
+    plan.have  = []
+    plan.todo  = []
+
+    for fr in rec['files']:
+        f          = Struct()
+        f.basename = fr['basename']
+        f.name     = fr['name']
+        f.size     = fr['size']
+        f.mtime    = fr['mtime']
+        plan.todo.append((f, [], []))
+
+    plan.files    = plan.todo
+    plan.compfile = plan.todo[0][0] if rec['compfile'] and plan.todo \
+                                    else None
+
+    return plan
+
+def fetch_plans(plans, journal):
+    '''Download the files of several plans, recording each finished file
+       in the journal. The journal is ended once all are done.'''
+    for i, plan in enumerate(plans):
+        if plan.todo:
+            fetch_plan(plan, lambda f, i=i: journal.done(i, f.name))
+
+    journal.end()
+
+    return None
 
-            if any((compfile, compc, compv)):
-                # XXX sigh...
-                # need to append MLOC when we get a cache match.
-                ppfx = ''.join(['https://', loc['DOMAIN']])
+def resume(journal, recs):
+    '''Finish the downloads of an interrupted run (--resume).
 
-                if _g.conf._found_in_cache:
-                    ppfx = ''.join([ppfx, loc['MLOC']])
+       The plans are taken from the journal as they were, so nothing is
+       searched or listed again. Files that were partially downloaded
+       resume from their .part files.
+
+       Parameters:
+       journal - the Journal of the run.
+       recs - the plan records that Journal.load() returned.
+    '''
+    plans = [record_plan(rec) for rec in recs]
+    left  = [plan for plan in plans if plan.todo]
+
+    _out._('resuming {} file(s) of {} title(s)'
+           .format(sum(len(plan.todo) for plan in left), len(left)))
+
+    journal.resume()
+    fetch_plans(plans, journal)
+
+    return 0
+
+def follow_loc(path=None):
+    '''Returns the location of the follow list.'''
+    if path:
+        return path
+
+    if _g.conf._followfile:
+        return _g.conf._followfile
+
+    return os.path.join(_g.conf._home, '.config', 'madodl', 'follow')
+
+def read_follow(path):
+    '''Read a follow list.
+
+       Each line is one title, written like the arguments to -m, e.g.
+       `berserk v30-` or `"one piece" c900-`. Empty lines and lines
+       starting with `#` are skipped. Each request is checked here, so
+       a bad one is reported with its line number.
+
+       Returns a list of -m argument lists.
+    '''
+    ents = []
+
+    try:
+        with open(path) as fh:
+            for n, line in enumerate(fh, 1):
+                line = line.strip()
+
+                if not line or line.startswith('#'):
+                    continue
 
                 try:
-                    stdscr          = unicurses.initscr()
-                    _g.conf._stdscr = stdscr
-                    unicurses.noecho()
-
-                    if compfile:
-                        _out._('downloading complete archive... ', end='')
-                        _g.conf._stdscr.erase()
-                        _g.conf._stdscr.addstr(0, 0, compfile.name)
-                        _g.conf._stdscr.refresh()
-                        _curl.curl_to_file('/'.join([ppfx, 
-                                                     _util.create_nwo_basename(
-                                                        compfile.basename),
-                                                     urllib
-                                                       .parse
-                                                       .quote(compfile.name)]),
-                                           compfile.name, 'HTTP')
-                    elif compv or compc:
-                        _out._('downloading volume/chapters... ', end='')
-                        for f,v,c in allf:
-                            #_g.log.info('DL ' + f)
-                            _g.conf._stdscr.erase()
-                            _g.conf._stdscr.addstr(0, 0, 'title - {}'
-                                                           .format(title))
-                            _g.conf._stdscr.addstr(1, 0, 'current - {}'
-                                                           .format(f.name))
-                            _g.conf._stdscr.refresh()
-                            _curl.curl_to_file('/'.join([ppfx,
-                                                         _util
-                                                           .create_nwo_basename(                                                             f.basename),
-                                                         urllib
-                                                           .parse
-                                                           .quote(f.name)]),
-                                               f.name, 'HTTP')
-                except:
-                    raise
-                finally:
-                    unicurses.nocbreak()
-                    _g.conf._stdscr.keypad(False)
-                    unicurses.echo()
-                    unicurses.endwin()
-
-                print('done', file=sys.stderr)
+                    m = shlex.split(line)
+                    _parsers.ParseRequest(list(m))
+                except (ValueError, RequestError) as e:
+                    _out.die('{}:{}: {}'.format(path, n, e))
+
+                ents.append(m)
+    except OSError as e:
+        _out.die("couldn't read follow list: {}".format(e))
+
+    return ents
+
+def sync_lookup(manga_list):
+    '''Look up all the titles of a follow list in the JSON tree at once.
+
+       Titles are found through their alias or at their NWO path. The
+       ones that can't be found that way are left to get_listing().
+
+       Returns a dict that maps the index of each title in `manga_list`
+       to the `found` argument of plan_title().
+    '''
+    if not _g.conf._usecache:
+        return {}
+
+    wants = {}
+
+    for i, m in enumerate(manga_list):
+        hit = _g.conf._aliases.get(m[0])
+
+        if hit:
+            # /Manga/d1/d2/d3/title
+            path  = '/'.join(hit[0].split('/')[2:5])
+            title = hit[1]
+        else:
+            path  = _util.create_nwo_path(m[0])
+            title = m[0]
+
+        wants[i] = (path, title)
+
+    hits = cache_lookup_many(set(wants.values()))
+    ret  = {}
+
+    for i, (path, title) in wants.items():
+        hit = hits.get((path, title.lower()))
+
+        if hit:
+            ret[i] = (path,) + hit
+
+    _g.log.info('found {} of {} followed titles in the JSON tree'
+                .format(len(ret), len(manga_list)))
+
+    return ret
+
+def main_loop(manga_list, dry_run=False, detail=False, sync=False):
+    '''Plan and download each -m request in turn.
+
+       Parameters:
+       manga_list - list of -m argument lists.
+       dry_run - only print the plans (-n).
+       detail - print detailed plans (--plan).
+       sync - `manga_list` is a follow list (--sync). Titles are looked
+              up together, and titles with nothing to download are
+              skipped quietly.
+    '''
+    left    = 0
+    unknown = 0
+    have    = []
+    found   = sync_lookup(manga_list) if sync else {}
+    nnew    = 0
+    plans   = []
+    err     = None
+    ret     = 0
+
+    for i, m in enumerate(manga_list):
+        try:
+            plan = plan_title(m, found.get(i))
+        # SystemExit is _out.die(), e.g. for a title that's gone
+        except (Error, pycurl.error, OSError, SystemExit) as e:
+            if not sync:
+                err = e
+                break
+
+            # one bad title shouldn't stop the rest of the list
+            _g.log.error('{}: check failed: {}'.format(m[0], e))
+            continue
+
+        if not any((plan.compfile, plan.compc, plan.compv)):
+            if sync:
+                _g.log.info('{}: no requested volume/chapters'
+                            .format(plan.title))
+                continue
+
+            _out._('could not find any requested volume/chapters.')
+            ret = 1
+            break
+
+        have.extend(plan.have)
+
+        if plan.todo:
+            nnew += 1
+        elif sync:
+            _g.log.info('{}: nothing new'.format(plan.title))
+            continue
+
+        if dry_run:
+            l, u     = print_plan(plan, detail)
+            left    += l
+            unknown += u
+        elif plan.todo:
+            plans.append(plan)
+        else:
+            _out._('{}: nothing new to download'.format(plan.title))
+
+    # everything is resolved before the first download, so an
+    # interrupted run can be finished with --resume. a title that
+    # fails still leaves the ones before it to be downloaded.
+    if plans:
+        journal = _journal.Journal(journal_loc())
+        journal.start(os.path.abspath(_g.conf._outdir),
+                      [plan_record(plan) for plan in plans])
+        fetch_plans(plans, journal)
+
+    if err is not None:
+        raise err
+
+    if ret:
+        return ret
+
+    if sync:
+        _out._('{} of {} followed title(s) have new files'
+               .format(nnew, len(manga_list)))
+
+    if have and not dry_run:
+        _out._('skipped {} file(s) already downloaded ({})'
+               .format(len(have), _util.conv_bytes(have_size(have))))
+
+    if detail and len(manga_list) > 1:
+        print('total: {} left{}, {}'.format(_util.conv_bytes(left),
+              ' ({} file(s) of unknown size)'.format(unknown)
+                if unknown else '', eta(left)))
+
+    return 0
+
+# how the poll interval of a title changes after a check that found new
+# files, and after one that didn't. checks are spread out by up to
+# WATCH_JITTER times the interval either way.
+WATCH_FASTER = 0.5
+WATCH_SLOWER = 1.5
+WATCH_JITTER = 0.1
+# how often to look for changes to the follow list, in seconds
+WATCH_RELOAD = 60
+
+def watch_key(m):
+    return ' '.join(shlex.quote(a) for a in m)
+
+def watch_interval(iv, res):
+    '''Returns the next poll interval of a title.
+
+       Titles that got new files are checked more often, the others
+       less often, and a title with a complete archive is only checked
+       every `watch_max` minutes.
+
+       Parameters:
+       iv - the current interval in seconds.
+       res - what watch_cycle() returned for the title.
+    '''
+    lo = _g.conf._watch_min * 60
+    hi = _g.conf._watch_max * 60
+
+    if res is not None and res[1]:
+        iv = hi
+    elif res is not None and res[0]:
+        iv *= WATCH_FASTER
+    else:
+        iv *= WATCH_SLOWER
+
+    return min(max(iv, lo), hi)
+
+def watch_cycle(due):
+    '''Check the titles of a follow list that are due and download what
+       is new.
+
+       A cached LISTing is only used if it is less than half the title's
+       poll interval old, so every check sees the current listing.
+
+       Parameters:
+       due - list of (-m argument list, poll interval) tuples.
+
+       Returns a list with a (number of new files, has a complete
+       archive) tuple for each title, or None if its check failed.
+    '''
+    found = sync_lookup([m for m, iv in due])
+    lc    = _g.conf._listcache
+    ret   = []
+
+    try:
+        for i, (m, iv) in enumerate(due):
+            if lc:
+                lc.ttl = min(_g.conf._listcache_ttl * 3600, iv / 2)
+
+            try:
+                plan = plan_title(m, found.get(i))
+
+                if plan.todo:
+                    fetch_plan(plan)
+            # SystemExit is _out.die(), e.g. for a title that's gone
+            except (Error, pycurl.error, OSError, SystemExit) as e:
+                _g.log.error('{}: check failed: {}'.format(m[0], e))
+                ret.append(None)
+                continue
+
+            if plan.todo:
+                _out._('{}: got {} new file(s)'.format(plan.title,
+                                                       len(plan.todo)))
+
+            ret.append((len(plan.todo), plan.compfile is not None))
+    finally:
+        if lc:
+            lc.ttl = _g.conf._listcache_ttl * 3600
+
+    return ret
+
+def watch(path):
+    '''Keep checking the titles of a follow list until interrupted
+       (--watch).
+
+       Each title is checked on its own schedule, see watch_interval().
+       The schedule is kept in the cache database, and the follow list
+       is read again whenever it changes.
+    '''
+    state = _cache.WatchState(_g.conf._db)
+    lo    = _g.conf._watch_min * 60
+    ents  = []
+    mtime = None
+
+    while True:
+        try:
+            st = os.stat(path).st_mtime
+        except OSError as e:
+            if mtime is None:
+                _out.die("couldn't read follow list: {}".format(e))
+
+            st = mtime
+
+        if st != mtime:
+            ents  = read_follow(path)
+            mtime = st
+            state.prune(watch_key(m) for m in ents)
+            _out._('following {} title(s)'.format(len(ents)))
+
+        now  = time.time()
+        due  = []
+        wake = now + WATCH_RELOAD
+
+        for m in ents:
+            iv, t = state.get(watch_key(m), lo)
+
+            if t <= now:
+                due.append((m, iv))
             else:
-                _out._('could not find any requested volume/chapters.')
-                return 1
+                wake = min(wake, t)
+
+        if not due:
+            time.sleep(max(wake - now, 1))
+            continue
+
+        # let cache_jsonloc() check the JSON tree for updates again
+        rt = _g.conf._refresh_thread
+
+        if rt is not None and not rt.is_alive():
+            _g.conf._refresh_thread = None
+
+        try:
+            if _g.conf._library:
+                _g.conf._library.scan()
+
+            res = watch_cycle(due)
+        except (Error, pycurl.error, OSError) as e:
+            _g.log.error('check failed: {}'.format(e))
+            res = [None] * len(due)
+
+        now = time.time()
+
+        for (m, iv), r in zip(due, res):
+            iv = watch_interval(iv, r)
+            state.put(watch_key(m), iv,
+                      now + iv * random.uniform(1 - WATCH_JITTER,
+                                                1 + WATCH_JITTER),
+                      bool(r and r[0]))
+
+        _g.log.info('checked {} title(s)'.format(len(due)))
+
+def alias_cmd(args):
+    '''Handle the alias cache switches.'''
+    aliases = _g.conf._aliases
+
+    if args.alias:
+        name, path = args.alias
+        path = '/' + path.strip('/')
+
+        if not path.startswith(loc['MLOC']) or path.count('/') != 5:
+            _out.die('alias path must look like {}B/BE/BERS/Berserk'
+                     .format(loc['MLOC']))
+
+        aliases.put(name, path, os.path.basename(path))
+
+    if args.unalias and not aliases.remove(args.unalias):
+        _out._('no alias for {}'.format(args.unalias))
+
+    if args.prune_aliases:
+        n = aliases.prune(args.prune_aliases * 86400)
+        _out._('pruned {} alias(es)'.format(n))
+
+    if args.aliases:
+        for name, path, title in aliases.items():
+            print('{} -> {}'.format(name, path))
 
     return 0
 
@@ -1015,8 +2273,13 @@ def main_loop(manga_list):
 # - allow for pausing and skipping during DL
 #
 def main():
+    interrupted = False
+
     try:
         _g.conf = Struct()
+        _g.conf._refresh_thread = None
+        _g.conf._parsepool      = None
+        _g.conf._listcmd        = None
         args    = init_args()
 
         local_import()
@@ -1035,17 +2298,114 @@ def main():
 
             _g.conf._user, _g.conf._pass = up
 
+        if args.maxconns:
+            _g.conf._maxconns = args.maxconns
+
+        if args.select:
+            _g.conf._select = args.select
+
+        _g.conf._cachedb = os.path.join(_g.conf._home, '.cache', 'madodl',
+                                        'cache.db')
+
+        _g.conf._db         = _cache.open_db(_g.conf._cachedb)
+        _g.conf._aliases    = _cache.AliasCache(_g.conf._db)
+        _g.conf._throughput = _cache.ThroughputStats(_g.conf._db)
+
+        if _g.conf._listcache:
+            _g.conf._listcache = _cache.ListCache(_g.conf._db,
+                                              _g.conf._listcache_ttl * 3600,
+                                              _g.conf._listcache_max * 1024**2,
+                                              args.refresh)
+        else:
+            _g.conf._listcache = None
+
+        if _g.conf._parsecache:
+            _g.conf._parsecache = _cache.ParseCache(_g.conf._db,
+                                                    _g.conf._parsecache_max)
+        else:
+            _g.conf._parsecache = None
+
+        if _g.conf._parseprocs:
+            _g.conf._parsepool = _parsers.ParsePool(_g.conf._parseprocs,
+                                                    _g.conf._parseprocs_min,
+                                                    _g.log.level)
+
         if args.silent or _g.conf._no_output:
             # go ahead and set this so it is globally known.
             # there is no need for distinction at this point.
             _g.conf._no_output = True
             _g.log.addFilter(nullfilter)
 
-        ret = main_loop(args.manga)
+        if any((args.alias, args.unalias, args.aliases,
+                args.prune_aliases)):
+            return alias_cmd(args)
+
+        if args.search:
+            for path, title, score in search_offline(args.search, 20):
+                print('{:.2f} {}{}/{}'.format(score, loc['MLOC'], path, title))
+
+            return 0
+
+        if args.resume:
+            journal = _journal.Journal(journal_loc())
+            resumed = journal.load()
+
+            if resumed is None:
+                _out._('nothing to resume')
+                return 0
+
+            # the files go where the interrupted run put them
+            _g.conf._outdir = resumed[0]
+
+        if _g.conf._library and not args.redownload:
+            _g.conf._library = _cache.LibraryIndex(_g.conf._db,
+                                                   _g.conf._outdir,
+                                                   _g.conf._library_hash)
+            _g.conf._library.scan()
+        else:
+            _g.conf._library = None
+
+        if args.resume:
+            ret = resume(journal, resumed[1])
+        elif args.watch is not None:
+            ret = watch(follow_loc(args.watch))
+        elif args.sync is not None:
+            ret = main_loop(read_follow(follow_loc(args.sync)),
+                            args.dry_run or args.plan, args.plan, True)
+        else:
+            ret = main_loop(args.manga, args.dry_run or args.plan,
+                            args.plan)
+
+        if _g.conf._listcache:
+            _g.log.info('LIST cache: {} hits, {} misses'
+                        .format(_g.conf._listcache.hits,
+                                _g.conf._listcache.misses))
+
+        if _g.conf._parsecache:
+            _g.log.info('parse cache: {} hits, {} misses'
+                        .format(_g.conf._parsecache.hits,
+                                _g.conf._parsecache.misses))
     except (KeyboardInterrupt, EOFError) as e:
         print()
         _out._('caught {} signal, exiting...'.format(type(e).__name__))
+        interrupted = True
         return 0
+    finally:
+        busy = _g.conf._refresh_thread is not None and \
+               _g.conf._refresh_thread.is_alive()
+
+        if busy and not interrupted:
+            _out._('waiting for JSON tree refresh to finish...')
+            _g.conf._refresh_thread.join()
+            busy = False
+
+        # the pool is left alone while the refresh still uses it, it
+        # goes away with the process
+        if '_curl' in globals() and not busy:
+            _curl.curl_pool_close()
+
+        if _g.conf._parsepool is not None:
+            _g.conf._parsepool.close()
 
     return ret
 
@@ -5,34 +5,134 @@
 #
 
 import re
+import json
 import logging
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+from itertools   import chain, repeat
 from html.parser import HTMLParser
 
 import madodl.out   as _out
+import madodl.util  as _util
 import madodl.gvars as _g
+from madodl.intervals  import IntervalSet
 from madodl.exceptions import *
 
+# Token abbreviations:
+# EXT -> Extension
+# GRB -> Group Beginning
+# GRE -> Group End
+# RNG -> Range
+# DLM -> Delimiter
+# VOL -> Volume
+# CHP -> Chapter
+# ALL -> Complete Archive
+# ART -> Artbook
+# PLT -> Pilot
+# PRL -> Prolog
+# PRE -> Prelude
+# PRO -> Prototype
+# OMK -> Omake
+# NUM -> Number
+# COM -> Comma Separator
+# DAT -> Data
+#
+# Multi-character alpha regex have to
+# be checked in a certain order because
+# they are then grouped with logical `ORs`.
+# In case of mismatches, The logic following
+# the matching trys to sort out the tokens in
+# a somewhat sane matter.
+#
+# NOTE: anything starting with `v` needs to be put _before_ VOL
+#       anything starting with `c` needs to be put _before_ CHP
+FILE_TOK_SPEC = [
+    ('EXT', r'\.[^\.]+$')            ,
+    ('GRB', r'(\(|\[|<|\{)')         ,
+    ('GRE', r'(\)|\]|>|\})')         ,
+    ('RNG', r'(-|\.\.(?=[^.]*[.]))') , # assertion checks for EXT `.`
+    ('DLM', r'(-|_|\.|\s+)')         ,
+    ('VOL', r'''
+                v(ol(ume)?)?
+                (?=(-|_|\.|\s+)*[0-9]) # look-ahead assertion
+             ''') ,
+    ('CHP', r'''
+                (c(h(a?p(ter)?)?)?|e(p(isode)?)?)
+                (?=(-|_|\.|\s+)*[0-9])
+             ''') ,
+    ('ALL', r'complete')  ,
+    ('ART', r'artbook')   ,
+    ('PLT', r'pilot')     ,
+    ('PRL', r'prologu?e') ,
+    ('PRE', r'prelude')   ,
+    ('PRO', r'prototype') ,
+    ('OMK', r'''
+                \+?(?=(-|_|\.|\s+)*)
+                (omake|extra|bonus|special)
+             ''') ,
+    ('NUM', r'\d+(\.\d+)?') ,
+    ('COM', r',')           ,
+    ('DAT', r'.')           ,
+]
+# the whole scanner is compiled once, in verbose mode. none of the
+# non-verbose patterns above contain whitespace or a `#`.
+FILE_TOK_RE = re.compile('|'.join('(?P<%s>%s)' % p for p in FILE_TOK_SPEC),
+                         re.I | re.X)
+
+class Token:
+    '''A single lexer token.
+
+       Parameters:
+       typ - token type, one of the names from the token spec
+       val - token value
+       raw - the matched text, kept for NUM tokens whose
+             value has been converted to a float
+    '''
+    __slots__ = ('typ', 'val', 'raw')
+
+    def __init__(self, typ, val, raw=None):
+        self.typ = typ
+        self.val = val
+        self.raw = raw
+
+    def __repr__(self):
+        return 'Token({!r}, {!r})'.format(self.typ, self.val)
+
 class ParseCommon:
     ''' ADDME '''
 
-    ALL = float((1 << 32)-1)
-
     def __init__(self):
         self._idx     = 0
         self._alltoks = []
         self._all     = False
-        self._vols    = []
-        self._chps    = []
+        self._vols    = IntervalSet()
+        self._chps    = IntervalSet()
 
     def push_to_last(self, uval=-1):
         val = self.cur_tok_val() if uval < 0 else uval
 
         if self.last:
             _g.log.debug(self.last)
-            self._vols.append(val)
+            self._vols.add(val)
         else:
             _g.log.debug(self.last)
-            self._chps.append(val)
+            self._chps.add(val)
+
+        return None
+
+    def push_range_to_last(self, st, end):
+        if self.last:
+            self._vols.add_range(st, end)
+        else:
+            self._chps.add_range(st, end)
+
+        return None
+
+    def push_from_to_last(self, st):
+        if self.last:
+            self._vols.add_from(st)
+        else:
+            self._chps.add_from(st)
 
         return None
 
@@ -40,19 +140,19 @@ class ParseCommon:
         if self._idx == len(self._alltoks):
             return None
 
-        return self._alltoks[self._idx]['typ']
+        return self._alltoks[self._idx].typ
 
     def cur_tok_val(self):
         if self._idx == len(self._alltoks):
             return None
 
-        return self._alltoks[self._idx]['val']
+        return self._alltoks[self._idx].val
 
     def set_cur_tok_typ(self, newtyp):
         if self._idx == len(self._alltoks):
             return False
 
-        self._alltoks[self._idx]['typ'] = newtyp
+        self._alltoks[self._idx].typ = newtyp
 
         return True
 
@@ -60,23 +160,23 @@ class ParseCommon:
         if self._idx == len(self._alltoks):
             return False
 
-        self._alltoks[self._idx]['val'] = newval
+        self._alltoks[self._idx].val = newval
 
         return True
 
     def get_tok_typ(self, uidx):
-        return self._alltoks[uidx]['typ']
+        return self._alltoks[uidx].typ
 
     def get_tok_val(self, uidx):
-        return self._alltoks[uidx]['val']
+        return self._alltoks[uidx].val
 
     def set_tok_typ(self, uidx, newtyp):
-        self._alltoks[uidx]['typ'] = newtyp
+        self._alltoks[uidx].typ = newtyp
 
         return True
 
     def set_tok_val(self, uidx, newval):
-        self._alltoks[uidx]['val'] = newval
+        self._alltoks[uidx].val = newval
 
         return True
 
@@ -86,12 +186,12 @@ class ParseCommon:
 
         _idx_ = self._idx if uidx < 0 else uidx
 
-        self._alltoks[_idx_]['typ'] = goodtyp
+        self._alltoks[_idx_].typ = goodtyp
 
         # put back original token value so integers in non volume/chapter
         # tokens don't stay in float format.
         if badtyp == 'NUM':
-            self._alltoks[_idx_]['val'] = self._alltoks[_idx_]['raw']
+            self._alltoks[_idx_].val = self._alltoks[_idx_].raw
 
         return None
 
@@ -100,8 +200,8 @@ class ParseCommon:
         typset = {'DLM',} if norng else {'DLM', 'RNG'}
 
         while self._idx < len(self._alltoks):
-            if self._alltoks[self._idx]['typ'] in typset:
-                if not norng and self._alltoks[self._idx]['typ'] == 'RNG':
+            if self._alltoks[self._idx].typ in typset:
+                if not norng and self._alltoks[self._idx].typ == 'RNG':
                     self.regex_mismatch('DLM', 'RNG')
                     self._idx += 1
             else:
@@ -126,78 +226,25 @@ class ParseFile(ParseCommon):
         self._f     = f
         self._tag   = []
         self._title = ''
-        # Token abbreviations:
-        # EXT -> Extension
-        # GRB -> Group Beginning
-        # GRE -> Group End
-        # RNG -> Range
-        # DLM -> Delimiter
-        # VOL -> Volume
-        # CHP -> Chapter
-        # ALL -> Complete Archive
-        # ART -> Artbook
-        # PLT -> Pilot
-        # PRL -> Prolog
-        # PRE -> Prelude
-        # PRO -> Prototype
-        # OMK -> Omake
-        # NUM -> Number
-        # COM -> Comma Separator
-        # DAT -> Data
-        #
-        # Multi-character alpha regex have to
-        # be checked in a certain order because
-        # they are then grouped with logical `ORs`.
-        # In case of mismatches, The logic following
-        # the matching trys to sort out the tokens in
-        # a somewhat sane matter.
-        #
-        # NOTE: anything starting with `v` needs to be put _before_ VOL
-        #       anything starting with `c` needs to be put _before_ CHP
-        tok_spec = [
-            ('EXT', r'\.[^\.]+$')            ,
-            ('GRB', r'(\(|\[|<|\{)')         ,
-            ('GRE', r'(\)|\]|>|\})')         ,
-            ('RNG', r'(-|\.\.(?=[^.]*[.]))') , # assertion checks for EXT `.`
-            ('DLM', r'(-|_|\.|\s+)')         ,
-            ('VOL', r'''(?x)
-                        v(ol(ume)?)?
-                        (?=(-|_|\.|\s+)*[0-9]) # look-ahead assertion
-                     ''') ,
-            ('CHP', r'''(?x)
-                        (c(h(a?p(ter)?)?)?|e(p(isode)?)?)
-                        (?=(-|_|\.|\s+)*[0-9])
-                     ''') ,
-            ('ALL', r'complete')  ,
-            ('ART', r'artbook')   ,
-            ('PLT', r'pilot')     ,
-            ('PRL', r'prologu?e') ,
-            ('PRE', r'prelude')   ,
-            ('PRO', r'prototype') ,
-            ('OMK', r'''(?x)
-                        \+?(?=(-|_|\.|\s+)*)
-                        (omake|extra|bonus|special)
-                     ''') ,
-            ('NUM', r'\d+(\.\d+)?') ,
-            ('COM', r',')           ,
-            ('DAT', r'.')           ,
-        ]
-        tok_regex = '|'.join('(?P<%s>%s)' % p for p in tok_spec)
-
-        for t in re.finditer(tok_regex, f, flags=re.I):
+        toks = self._alltoks
+
+        for t in FILE_TOK_RE.finditer(f):
             typ = t.lastgroup
             val = t.group(typ)
-            self._alltoks.append({'typ' : typ, 'val' : val})
 
-        if self._alltoks[-1]['typ'] != 'EXT':
+            if typ == 'NUM':
+                toks.append(Token(typ, float(val), val))
+            elif typ == 'DAT' and toks and toks[-1].typ == 'DAT':
+                # runs of plain characters are only ever read back
+                # as a whole, so keep them in a single token.
+                toks[-1].val += val
+            else:
+                toks.append(Token(typ, val))
+
+        if toks[-1].typ != 'EXT':
             _out.die('Encountered a file without an extension, which is '
                      'not currently supported. Bailing.', lvl='FATAL')
 
-        for t in self._alltoks:
-            if t['typ'] == 'NUM':
-                t['raw'] = t['val']
-                t['val'] = float(t['val'])
-
         # variable stores whether vol or chp
         # was seen last. True = vol, False = chp
         self.last    = None
@@ -209,7 +256,7 @@ class ParseFile(ParseCommon):
         while self._idx < len(self._alltoks):
             t = self.cur_tok_typ()
 
-            _g.log.debug('{} {}'.format(self._idx, t))
+            _g.log.debug('%s %s', self._idx, t)
 
             if t == 'VOL':
                 self.last = True
@@ -226,13 +273,7 @@ class ParseFile(ParseCommon):
                     continue
 
                 vval = self.cur_tok_val()
-                self._vols.append(vval)
-
-                # we need this line in case of a range
-                # with a fractional e.g. vol1.5-3 in which
-                # case we assume the successive volumes are
-                # whole volumes.
-                vval = int(vval) + 1
+                self._vols.add(vval)
                 self.eat_delim(True)
 
                 if self.cur_tok_typ() == 'RNG':
@@ -240,16 +281,13 @@ class ParseFile(ParseCommon):
 
                     if self._idx == len(self._alltoks):
                         # open-ended range
-                        self._vols.append(vidx)
-                        self._vols.append(self.ALL)
+                        self._vols.add_from(vval)
                         continue
                     elif self.cur_tok_typ() == 'NUM':
-                        for n in range(vval, int(self.cur_tok_val()+1)):
-                            self._vols.append(float(n))
-
-                        if self.cur_tok_val() % 1:
-                            self._vols.append(self.cur_tok_val())
-
+                        # in case of a range with a fractional e.g.
+                        # vol1.5-3 we assume the successive volumes
+                        # are whole volumes.
+                        self._vols.add_range(vval, self.cur_tok_val())
                         self._idx += 1
 
                 continue # XXX
@@ -262,18 +300,12 @@ class ParseFile(ParseCommon):
                 self.eat_delim()
 
                 if self.cur_tok_typ() != 'NUM':
-                    self.regex_mismatch('DAT', 'VOL', vidx)
+                    self.regex_mismatch('DAT', 'CHP', cidx)
                     self._idx += 1
                     continue
 
                 cval = self.cur_tok_val()
-                self._chps.append(cval)
-
-                # we need this line in case of a range
-                # with a fractional e.g. vol1.5-3 in which
-                # case we assume the successive volumes are
-                # whole volumes.
-                cval = int(cval) + 1
+                self._chps.add(cval)
                 self.eat_delim(True)
 
                 if self.cur_tok_typ() == 'RNG':
@@ -281,16 +313,11 @@ class ParseFile(ParseCommon):
 
                     if self._idx == len(self._alltoks):
                         # open-ended range
-                        self._vols.append(vidx)
-                        self._vols.append(self.ALL)
+                        self._chps.add_from(cval)
                         continue
                     elif self.cur_tok_typ() == 'NUM':
-                        for n in range(cval, int(self.cur_tok_val()+1)):
-                            self._chps.append(float(n))
-
-                        if self.cur_tok_val() % 1:
-                            self._chps.append(self.cur_tok_val())
-
+                        # same as with volumes, e.g. ch1.5-3
+                        self._chps.add_range(cval, self.cur_tok_val())
                         self._idx += 1
 
                 continue # XXX
@@ -311,12 +338,12 @@ class ParseFile(ParseCommon):
                 self.eat_delim(True)
 
                 if self.cur_tok_typ() == 'RNG':
-                    comval = int(comval) + 1
                     self.eat_delim()
 
                     if self.cur_tok_typ() == 'NUM':
-                        for n in range(comval, int(self.cur_tok_val())+1):
-                            self.push_to_last(float(n))
+                        # only whole numbers after a comma
+                        self.push_range_to_last(comval,
+                                                int(self.cur_tok_val()))
             elif t == 'RNG':
                 self.regex_mismatch('DLM', 'RNG')
             elif t == 'NUM':
@@ -344,7 +371,7 @@ class ParseFile(ParseCommon):
                         continue
 
                     st = self.get_tok_val(nidx)
-                    self._alltoks[nidx]['val'] = tmprng = []
+                    self._alltoks[nidx].val = tmprng = []
                     tmprng.append(st)
                     rngb = int(st) + 1
 
@@ -416,7 +443,7 @@ class ParseFile(ParseCommon):
         if wildnums:
             # These are numbers that did not have
             # a prefix, so we do our best to guess.
-            wnls    = [n['val'] for n in wildnums]
+            wnls    = [n.val for n in wildnums]
             wnsubls = []
 
             for n in wnls:
@@ -429,35 +456,169 @@ class ParseFile(ParseCommon):
 
             del wnsubls
 
-            if len(wildnums[0]['raw']) >= 3:
-                dot = wildnums[0]['raw'].find('.')
+            if len(wildnums[0].raw) >= 3:
+                dot = wildnums[0].raw.find('.')
 
                 if -1 < dot < 2:
                     pass
                 else:
-                    self._chps.extend(sorted(wnls))
+                    self._chps.update(wnls)
             elif not self._vols and not self._chps:
                 if not max(wnls) % 100:
                     # assuming chp
-                    self._chps.extend(sorted(wnls))
+                    self._chps.update(wnls)
                 else:
                     # assuming vol
-                    self._vols.extend(sorted(wnls))
+                    self._vols.update(wnls)
             elif not self._vols:
                 # assuming vol
-                self._vols.extend(sorted(wnls))
+                self._vols.update(wnls)
             elif not self._chps:
                 # assuming chp
-                self._chps.extend(sorted(wnls))
+                self._chps.update(wnls)
 
         self._title = self._title.strip()
 
-        self._vols = sorted(set(self._vols))
-        self._chps = sorted(set(self._chps))
+    def fields(self):
+        '''Returns the parse results as a list of plain values.'''
+        return [self._vols.to_spec(), self._chps.to_spec(), self._all,
+                self._tag, self.other, self._title]
+
+    @classmethod
+    def from_fields(cls, f, fields):
+        '''Rebuild a parsed object from the output of fields().'''
+        fo = cls.__new__(cls)
+        ParseCommon.__init__(fo)
+
+        fo._f = f
+        vols, chps, fo._all, fo._tag, fo.other, fo._title = fields
+        fo._vols = IntervalSet.from_spec(vols)
+        fo._chps = IntervalSet.from_spec(chps)
+
+        return fo
+
+    @classmethod
+    def parse_many(cls, files, title, cache=None, pool=None):
+        '''Parse a batch of filenames belonging to the same title.
+
+           Parameters:
+           files - iterable of filenames
+           title - the title they are listed under
+           cache - optional cache.ParseCache. Only the filenames it
+                   doesn't know are run through the parser.
+           pool  - optional ParsePool for batches that are large
+                   enough to be worth spreading over several processes.
+
+           Returns a list of parsed objects in the order of `files`.
+        '''
+        files = list(files)
+        known = cache.get_many(files, title) if cache is not None else {}
+        todo  = [f for f in files if f not in known]
+
+        if pool is not None and len(todo) >= pool.minfiles:
+            new = pool.parse(todo, title)
+        else:
+            new = [cls(f, title) for f in todo]
+
+        if cache is not None and new:
+            cache.put_many(new, title)
+
+        if not known:
+            return new
+
+        new = iter(new)
+
+        return [cls.from_fields(f, known[f]) if f in known else next(new)
+                for f in files]
+
+_worker_loglvl = None
+
+def _parse_chunk(files, title, loglvl):
+    '''Runs in a ParsePool worker. Returns the fields() of each file.'''
+    global _worker_loglvl
+
+    if _worker_loglvl != loglvl:
+        # workers only log to the console. a forked worker inherits
+        # the log file handler too, which it must not rotate.
+        _worker_loglvl = loglvl
+        _g.log = logging.getLogger('stream_logger')
+        _g.log.setLevel(loglvl)
+
+        for h in _g.log.handlers[:]:
+            if type(h) is not logging.StreamHandler:
+                _g.log.removeHandler(h)
+
+        if not _g.log.handlers:
+            h = logging.StreamHandler()
+            h.setFormatter(logging.Formatter('madodl: %(filename)s: '
+                                             '%(funcName)s(): '
+                                             '%(levelname)s: %(message)s'))
+            _g.log.addHandler(h)
+
+    return [ParseFile(f, title).fields() for f in files]
+
+class ParsePool:
+    '''Parses large batches of filenames in worker processes.
+
+       The workers are started on first use and kept until close().
+       If they can't be started or die, the batch is parsed in-process.
+
+       Parameters:
+       procs - number of worker processes.
+       minfiles - batches with fewer files than this are parsed
+                  in-process (see ParseFile.parse_many()).
+       loglvl - console log level of the workers.
+    '''
+    # chunks handed out per worker, to even out slow chunks
+    CHUNKS_PER_PROC = 4
+
+    def __init__(self, procs, minfiles, loglvl=logging.ERROR):
+        self.procs    = procs
+        self.minfiles = minfiles
+        self.loglvl   = loglvl
+        self._ex      = None
+
+    def parse(self, files, title):
+        n      = -(-len(files) // (self.procs * self.CHUNKS_PER_PROC))
+        chunks = [files[i:i+n] for i in range(0, len(files), n)]
+
+        try:
+            if self._ex is None:
+                self._ex = concurrent.futures.ProcessPoolExecutor(self.procs)
+
+            # map() hands the results back in the order of `chunks`
+            fields = chain.from_iterable(
+                self._ex.map(_parse_chunk, chunks, repeat(title),
+                             repeat(self.loglvl)))
+            fields = list(fields)
+        except (OSError, NotImplementedError, BrokenProcessPool) as e:
+            _g.log.warning('parser processes failed ({}), parsing '
+                           'in-process'.format(e))
+            self.close()
+            return [ParseFile(f, title) for f in files]
+
+        return [ParseFile.from_fields(f, fl) for f, fl in zip(files, fields)]
+
+    def close(self):
+        if self._ex is not None:
+            self._ex.shutdown()
+            self._ex = None
+
+        return None
 
 class ParseRequest(ParseCommon):
     ''' ADDME '''
 
+    TOK_SPEC = [
+        ('VOL', r'v(ol)?')      ,
+        ('CHP', r'ch?p?')       ,
+        ('NUM', r'\d+(\.\d+)?') ,
+        ('RNG', r'-')           ,
+        ('COM', r',')           ,
+        ('BAD', r'.')           ,
+    ]
+    TOK_RE = re.compile('|'.join('(?P<%s>%s)' % p for p in TOK_SPEC))
+
     def __init__(self, req):
         ParseCommon.__init__(self)
         self._name = req[0]
@@ -481,28 +642,17 @@ class ParseRequest(ParseCommon):
 
             return
 
-        tok_spec =  [
-            ('VOL', r'v(ol)?')      ,
-            ('CHP', r'ch?p?')       ,
-            ('NUM', r'\d+(\.\d+)?') ,
-            ('RNG', r'-')           ,
-            ('COM', r',')           ,
-            ('BAD', r'.')           ,
-        ]
-
-        tok_regex = '|'.join('(?P<%s>%s)' % p for p in tok_spec)
-
         for vc in req:
             self._alltoks = []
 
-            for t in re.finditer(tok_regex, vc):
+            for t in self.TOK_RE.finditer(vc):
                 typ = t.lastgroup
                 val = t.group(typ)
 
                 if typ == 'BAD':
                     raise RequestError('bad char {}'.format(val))
 
-                self._alltoks.append({'typ' : typ, 'val' : val})
+                self._alltoks.append(Token(typ, val))
 
             what = self.get_tok_typ(0)
 
@@ -512,10 +662,7 @@ class ParseRequest(ParseCommon):
                 else:
                     _g.log.warning('No vol/ch prefix. Assuming volume.')
                     what = 'VOL'
-                    tmp = [0 for z in range(len(self._alltoks)+1)]
-                    for idx in range(len(self._alltoks)):
-                        tmp[idx+1] = self._alltoks[idx]
-                    self._alltoks = tmp
+                    self._alltoks.insert(0, Token(what, 'v'))
             elif len(self._alltoks) == 1 or self.get_tok_typ(1) != 'NUM':
                 raise RequestError('no number specified for {}'.format(what))
 
@@ -537,7 +684,8 @@ class ParseRequest(ParseCommon):
                         if self.get_tok_typ(self._idx-1) != 'NUM':
                             raise RequestError('bad range for {}'.format(what))
                         else:
-                            self.push_to_last(self.ALL)
+                            self.push_from_to_last(
+                                float(self.get_tok_val(self._idx-1)))
                             break
 
                     if ((self.get_tok_typ(self._idx-1) != 'NUM' and
@@ -545,24 +693,17 @@ class ParseRequest(ParseCommon):
                          self.get_tok_typ(self._idx+1) == 'COM'):
                         raise RequestError('bad range for {}'.format(what))
 
-                    st  = int(float(self.get_tok_val(self._idx-1)))
+                    st  = float(self.get_tok_val(self._idx-1))
                     end = float(self.get_tok_val(self._idx+1))
 
-                    if st > end:
-                        end += st
-
-                    st += 1
-
-                    for n in range(st, int(end)+1):
-                        self.push_to_last(float(n))
-
-                    if end % 1:
-                        self.push_to_last(end)
+                    if int(st) > end:
+                        end += int(st)
 
+                    self.push_range_to_last(st, end)
                     self._idx += 1
                 elif typ == 'COM':
                     if (self._idx == len(self._alltoks)-1 or
-                        self._alltoks[self._idx+1]['typ'] != 'NUM'):
+                        self._alltoks[self._idx+1].typ != 'NUM'):
                         _g.log.warning('Extraneous comma detected. Removing.')
                         del self._alltoks[self._idx]
                         continue
@@ -574,9 +715,6 @@ class ParseRequest(ParseCommon):
 
                 self._idx += 1
 
-            self._vols = sorted(set(self._vols))
-            self._chps = sorted(set(self._chps))
-
 class ParseQuery(HTMLParser):
     def __init__(self):
         HTMLParser.__init__(self)
@@ -625,3 +763,447 @@ class ParseQuery(HTMLParser):
                         self.results[-1][1] += data
                     else:
                         self.results.append([self.href,data])
+
+class JSONStream:
+    '''An incremental reader for large JSON documents.
+
+       The document is read in chunks and walked one value at a time.
+       Values that aren't needed are skipped without building any Python
+       objects for them, so memory use is bounded by the largest value
+       actually read, not by the size of the document.
+
+       iter_array() and iter_object() stop at each value, which the
+       caller has to consume with read_value(), skip_value() or another
+       iter_*() call before advancing.
+
+       Parameters:
+       fh - text file object to read from.
+    '''
+    CHUNK = 1 << 16
+
+    # returned by entries() for a `contents` value that is still in the
+    # stream.
+    STREAM = object()
+
+    _ws_re     = re.compile(r'\s*')
+    _str_re    = re.compile(r'"(?:[^"\\]|\\.)*"')
+    _scalar_re = re.compile(r'[^,:\]}\s]+')
+    # everything up to the next bracket, including complete strings.
+    _skip_re   = re.compile(r'(?:[^"\[\]{}]+|"(?:[^"\\]|\\.)*")*')
+
+    def __init__(self, fh):
+        self._fh   = fh
+        self._buf     = ''
+        self._pos     = 0
+        self._eof     = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self, size=None):
+        if self._eof:
+            return False
+
+        chunk = self._fh.read(size or self.CHUNK)
+
+        if not chunk:
+            self._eof = True
+            return False
+
+        # drop what has been consumed.
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+
+        return True
+
+    def _peek(self):
+        while True:
+            self._pos = self._ws_re.match(self._buf, self._pos).end()
+
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+
+            if not self._fill():
+                return None
+
+    def _expect(self, ch):
+        if self._peek() != ch:
+            raise ValueError('expected {!r} at offset {} of JSON stream'
+                             .format(ch, self._pos))
+
+        self._pos += 1
+
+        return None
+
+    def _match(self, regex):
+        '''Match `regex` at the current position, reading more data
+           until the match doesn't reach the end of the buffer.'''
+        while True:
+            m = regex.match(self._buf, self._pos)
+
+            if m and m.end() < len(self._buf) or not self._fill():
+                return m
+
+    def _skip_string(self):
+        m = self._match(self._str_re)
+
+        if m is None:
+            raise ValueError('unterminated string in JSON stream')
+
+        self._pos = m.end()
+
+        return m.group()
+
+    def skip_value(self):
+        ch = self._peek()
+
+        if ch == '"':
+            self._skip_string()
+            return None
+
+        if ch not in {'[', '{'}:
+            m = self._match(self._scalar_re)
+            if m is None:
+                raise ValueError('bad value in JSON stream')
+            self._pos = m.end()
+            return None
+
+        depth = 0
+
+        while True:
+            m         = self._skip_re.match(self._buf, self._pos)
+            self._pos = m.end()
+
+            if self._pos == len(self._buf):
+                if not self._fill():
+                    raise ValueError('truncated JSON stream')
+                continue
+
+            ch = self._buf[self._pos]
+
+            if ch == '"':
+                # string that goes past the end of the buffer
+                self._skip_string()
+                continue
+
+            self._pos += 1
+            depth     += 1 if ch in {'[', '{'} else -1
+
+            if not depth:
+                return None
+
+    def read_value(self):
+        self._peek()
+
+        while True:
+            try:
+                val, end = self._decoder.raw_decode(self._buf, self._pos)
+            except ValueError:
+                end = None
+
+            # a number at the end of the buffer may be cut short.
+            if end is not None and (end < len(self._buf) or self._eof):
+                self._pos = end
+                return val
+
+            # grow geometrically so big values aren't decoded too often.
+            if not self._fill(max(self.CHUNK, len(self._buf) - self._pos)):
+                if end is None:
+                    raise ValueError('bad value in JSON stream')
+                self._pos = end
+                return val
+
+    def iter_array(self):
+        self._expect('[')
+
+        if self._peek() == ']':
+            self._pos += 1
+            return
+
+        while True:
+            yield
+
+            ch = self._peek()
+            self._pos += 1
+
+            if ch == ']':
+                return
+            elif ch != ',':
+                raise ValueError('expected , or ] in JSON stream')
+
+    def iter_object(self):
+        self._expect('{')
+
+        if self._peek() == '}':
+            self._pos += 1
+            return
+
+        while True:
+            self._peek()
+            key = json.loads(self._skip_string())
+            self._expect(':')
+
+            yield key
+
+            ch = self._peek()
+            self._pos += 1
+
+            if ch == '}':
+                return
+            elif ch != ',':
+                raise ValueError('expected , or }} in JSON stream')
+
+    def _iter_entries(self):
+        for _ in self.iter_array():
+            name = typ = contents = None
+            done = False
+
+            for key in self.iter_object():
+                if key == 'name':
+                    name = self.read_value()
+                elif key == 'type':
+                    typ = self.read_value()
+                elif key == 'contents' and name is not None:
+                    yield (name, typ, self.STREAM)
+                    done = True
+                elif key == 'contents':
+                    # name comes after contents. can't tell if we need
+                    # it, so it has to be read.
+                    contents = self.read_value()
+                else:
+                    self.skip_value()
+
+            if not done:
+                yield (name, typ, contents)
+
+    def entries(self, contents):
+        '''Iterate the entries of a dumbtree directory listing.
+
+           Yields (name, type, contents) for every entry. `contents` is
+           None for files, a list if it was already read, or STREAM if
+           the listing is next in the stream, in which case it has to be
+           consumed with consume(), skip() or entries().
+        '''
+        if contents is self.STREAM:
+            return self._iter_entries()
+
+        return ((e.get('name'), e.get('type'), e.get('contents'))
+                for e in contents)
+
+    def consume(self, contents):
+        return self.read_value() if contents is self.STREAM else contents
+
+    def skip(self, contents):
+        if contents is self.STREAM:
+            self.skip_value()
+
+        return None
+
+def dumbtree_root(js):
+    '''Returns the contents of the dumbtree's /Manga directory.'''
+    for _ in js.iter_array():
+        # only the first element is the tree. the rest is a summary.
+        for key in js.iter_object():
+            if key != 'contents':
+                js.skip_value()
+                continue
+
+            for name, typ, contents in js.entries(js.STREAM):
+                if name == 'Manga' and contents is not None:
+                    return contents
+
+                js.skip(contents)
+
+            return None
+
+    return None
+
+def dumbtree_find(fh, nwo, title):
+    '''Find a title in a stupidapi dumbtree file without loading it.
+
+       Only the /Manga/`nwo` path is descended into, and only the
+       contents of the matching title are built.
+
+       Parameters:
+       fh - text file object of the dumbtree.
+       nwo - NWO path of the title (see util.create_nwo_path()).
+       title - name of the title directory (case insensitive).
+
+       Returns a 2-tuple of the title's contents and its exact name, or
+       None if it isn't in the tree.
+    '''
+    js    = JSONStream(fh)
+    level = dumbtree_root(js)
+    tlow  = title.lower()
+
+    if level is None:
+        return None
+
+    for want in nwo.split('/'):
+        for name, typ, contents in js.entries(level):
+            if name == want and contents is not None:
+                level = contents
+                break
+
+            js.skip(contents)
+        else:
+            return None
+
+    for name, typ, contents in js.entries(level):
+        if name.lower() == tlow and contents is not None:
+            return (js.consume(contents), name)
+
+        js.skip(contents)
+
+    return None
+
+def dumbtree_find_many(fh, wants):
+    '''Find several titles in one pass over a stupidapi dumbtree file.
+
+       Like dumbtree_find(), only the NWO paths of the wanted titles are
+       descended into.
+
+       Parameters:
+       fh - text file object of the dumbtree.
+       wants - iterable of (nwo path, title) tuples.
+
+       Returns a dict that maps (nwo path, lower-cased title) to a
+       2-tuple of the title's contents and its exact name, for each
+       title that is in the tree.
+    '''
+    tree = {}
+    left = 0
+    ret  = {}
+
+    for nwo, title in wants:
+        d1, d2, d3 = nwo.split('/')
+        titles     = tree.setdefault(d1, {}).setdefault(d2, {}) \
+                         .setdefault(d3, set())
+
+        if title.lower() not in titles:
+            titles.add(title.lower())
+            left += 1
+
+    js   = JSONStream(fh)
+    root = dumbtree_root(js) if tree else None
+
+    if root is None:
+        return ret
+
+    def level(contents, want):
+        for name, typ, sub in js.entries(contents):
+            if name in want and sub is not None:
+                yield (name, sub)
+            else:
+                js.skip(sub)
+
+    for d1, c1 in level(root, tree):
+        for d2, c2 in level(c1, tree[d1]):
+            for d3, c3 in level(c2, tree[d1][d2]):
+                nwo    = '/'.join((d1, d2, d3))
+                titles = tree[d1][d2][d3]
+
+                for name, typ, contents in js.entries(c3):
+                    key = (nwo, name.lower())
+
+                    if (contents is not None and key[1] in titles and
+                        key not in ret):
+                        ret[key]  = (js.consume(contents), name)
+                        left     -= 1
+
+                        if not left:
+                            return ret
+                    else:
+                        js.skip(contents)
+
+    return ret
+
+def dumbtree_titles(fh):
+    '''Iterate all title directories in a stupidapi dumbtree file.
+
+       Yields (nwo path, title, contents) for one title at a time, so
+       only one title's contents are in memory at once.
+    '''
+    js   = JSONStream(fh)
+    root = dumbtree_root(js)
+
+    if root is None:
+        return
+
+    for d1, t1, c1 in js.entries(root):
+        if c1 is None:
+            continue
+
+        for d2, t2, c2 in js.entries(c1):
+            if c2 is None:
+                continue
+
+            for d3, t3, c3 in js.entries(c2):
+                if c3 is None:
+                    continue
+
+                nwo = '/'.join((d1, d2, d3))
+
+                for name, typ, contents in js.entries(c3):
+                    if contents is None:
+                        continue
+
+                    yield (nwo, name, js.consume(contents))
+
+def list_entry(line):
+    '''Parse one line of an FTP LIST.
+
+       madokami's FTP LIST format is long ls, [{}/ are meta tokens]:
+       {d,-}rwxrwxrwx 1 u g sz mon day y/time fname
+        |                                     |
+        |=> directory or regular file         |=> filename
+
+       XXX: while highly unlikely that whitespace gives any significant
+       distinction beyond one space, the split() module splits by any
+       amount of wspace; thus, when re-join()ed, any extra wspace is
+       truncated to one space. MLSD listings don't have this problem.
+
+       Returns a 4-tuple of the type (`d`, `-`, ...), the name, the size
+       and the mtime, or None for lines that aren't entries (`total`).
+       The size and mtime are None if they can't be read.
+    '''
+    fields = line.split()
+
+    if len(fields) < 9:
+        return None
+
+    size = int(fields[4]) if fields[4].isdigit() else None
+
+    return (fields[0][:1], ' '.join(fields[8:]), size,
+            _util.list_mtime(*fields[5:8]))
+
+def mlsd_entry(line):
+    '''Parse one line of an MLSD listing (RFC 3659), e.g.
+       `type=file;size=1024;modify=20160101120000; name`.
+
+       Returns the same as list_entry(). `file` and `dir` entries have
+       the types `-` and `d`, other types are returned as they are. The
+       entries of the directory itself and its parent give None.
+    '''
+    facts, sep, name = line.partition(' ')
+
+    if not sep or not name:
+        return None
+
+    fd = {}
+
+    for fact in facts.split(';'):
+        key, eq, val = fact.partition('=')
+
+        if eq:
+            fd[key.lower()] = val
+
+    typ = fd.get('type', '').lower()
+
+    if typ in {'cdir', 'pdir'}:
+        return None
+
+    size  = fd.get('size', '')
+    mtime = fd.get('modify')
+
+    return ({'file' : '-', 'dir' : 'd'}.get(typ, typ), name,
+            int(size) if size.isdigit() else None,
+            _util.mlsd_mtime(mtime) if mtime else None)
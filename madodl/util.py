@@ -5,54 +5,12 @@
 #
 
 import re
+import time
+import calendar
 import urllib.parse
-from itertools import chain
 
 import madodl.out as _out
 
-def rm_req_elems(req, comp):
-    for n in comp:
-        if n in req:
-            req.remove(n)
-
-    return None
-
-#
-# XXX this looks to be O(n^2) to me. check if python
-#     optimizes this or has a std util for it.
-#
-def common_elem(iter1, iter2, flat=True):
-    if not any((iter1, iter2)):
-        return None
-
-    loc1 = iter1
-    loc2 = iter2
-
-    if not flat:
-        loc2 = chain.from_iterable(iter2)
-
-    for elem in loc1:
-        if elem in loc2:
-            return elem
-
-    return None
-
-def common_elem_gen(iter1, iter2, flat=True):
-    if not any((iter1, iter2)):
-        return None
-
-    loc1 = iter1
-    loc2 = iter2
-
-    if not flat:
-        loc2 = chain.from_iterable(iter2)
-
-    for elem in loc1:
-        if elem in loc2:
-            yield elem
-
-    return None
-
 def create_nwo_path(name):
     '''Create the exact path that the manga `name` should be in.
 
@@ -94,6 +52,78 @@ def conv_bytes(bvar):
 
     return ret
 
+MONTHS = {m: i for i, m in enumerate(('jan', 'feb', 'mar', 'apr', 'may',
+                                        'jun', 'jul', 'aug', 'sep', 'oct',
+                                        'nov', 'dec'), 1)}
+
+def list_mtime(mon, day, year_or_time, now=None):
+    '''Convert the date of an FTP LIST line to a UNIX time.
+
+       ls prints `Mon DD HH:MM` for files changed in the last six months
+       and `Mon DD YYYY` otherwise. The former has no year, so it is
+       taken to be the latest one that doesn't put the date in the
+       future. All times are taken to be UTC.
+
+       Returns None if the date can't be parsed.
+    '''
+    try:
+        mon = MONTHS[mon[:3].lower()]
+        day = int(day)
+
+        if ':' in year_or_time:
+            hh, mm = (int(n) for n in year_or_time.split(':', 1))
+            now    = time.time() if now is None else now
+            year   = time.gmtime(now).tm_year
+            mtime  = calendar.timegm((year, mon, day, hh, mm, 0))
+
+            # allow for clock skew between us and the server
+            if mtime > now + 86400:
+                mtime = calendar.timegm((year-1, mon, day, hh, mm, 0))
+        else:
+            mtime = calendar.timegm((int(year_or_time), mon, day, 0, 0, 0))
+    except (KeyError, ValueError, OverflowError):
+        return None
+
+    return mtime
+
+def tree_mtime(val):
+    '''Convert the `time` of a JSON tree entry to a UNIX time.
+
+       Accepts a UNIX time or a `YYYY-MM-DD[ HH:MM[:SS]]` string, which
+       is taken to be UTC. Returns None for anything else.
+    '''
+    if isinstance(val, (int, float)) and not isinstance(val, bool):
+        return val
+
+    if not isinstance(val, str):
+        return None
+
+    m = re.match(r'(\d{4})-(\d\d)-(\d\d)(?:[ T](\d\d):(\d\d)(?::(\d\d))?)?',
+                 val.strip())
+
+    if m is None:
+        return None
+
+    try:
+        return calendar.timegm(tuple(int(n or 0) for n in m.groups()))
+    except (ValueError, OverflowError):
+        return None
+
+def mlsd_mtime(val):
+    '''Convert the `modify` fact of an MLSD entry (YYYYMMDDHHMMSS[.sss],
+       UTC) to a UNIX time. Returns None if it can't be parsed.'''
+    m = re.match(r'(\d{4})(\d\d)(\d\d)(\d\d)(\d\d)(\d\d)(\.\d+)?$', val)
+
+    if m is None:
+        return None
+
+    try:
+        mtime = calendar.timegm(tuple(int(n) for n in m.groups()[:6]))
+    except (ValueError, OverflowError):
+        return None
+
+    return mtime + float(m.group(7)) if m.group(7) else mtime
+
 def flatten_sublists(ls):
     retls = []
 
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+#
+# tests for madodl/cover.py
+#
+
+import logging
+import unittest
+
+import madodl.main as _main
+
+_main.local_import()
+
+import madodl.gvars as _g
+import madodl.cover as _cover
+from madodl.parsers import ParseRequest, ParseFile
+
+class Entry:
+    def __init__(self, name, size=None):
+        self.name = name
+        self.size = size
+
+class CoverTest(unittest.TestCase):
+    TITLE = 'Berserk'
+
+    def setUp(self):
+        self._log = getattr(_g, 'log', None)
+        _g.log    = logging.getLogger('madodl.test')
+        _g.log.addHandler(logging.NullHandler())
+        _g.log.propagate = False
+
+    def tearDown(self):
+        _g.log = self._log
+
+    def select(self, req, files, pref=(), npref=()):
+        '''`files` is a list of (name, size) tuples, `pref`/`npref` the
+           names with a prefer/not prefer tag.'''
+        ents = [Entry(n, s) for n, s in files]
+        fos  = ParseFile.parse_many((e.name for e in ents), self.TITLE)
+
+        for e, fo in zip(ents, fos):
+            fo._preftag  = e.name in pref
+            fo._npreftag = e.name in npref
+
+        req = ParseRequest([self.TITLE] + req)
+
+        return [(f.name, v, c) for f, v, c in
+                _cover.select(req, list(zip(ents, fos)))]
+
+    def names(self, ret):
+        return [n for n, v, c in ret]
+
+class TestExactVsGreedy(CoverTest):
+    # one bundle of volumes 1-4 against singles that are cheaper per
+    # volume at first, but more expensive altogether
+    FILES = [
+        ('Berserk v01-04 [A].zip', 10) ,
+        ('Berserk v01 [A].zip'   , 2) ,
+        ('Berserk v02 [A].zip'   , 2) ,
+        ('Berserk v03 [A].zip'   , 3.5) ,
+        ('Berserk v04 [A].zip'   , 3.5) ,
+    ]
+
+    def cands(self):
+        bundle = frozenset(('v', float(v)) for v in range(1, 5))
+        cands  = [(10, bundle)]
+        cands.extend((s, frozenset([('v', float(v))]))
+                     for v, (n, s) in enumerate(self.FILES[1:], 1))
+
+        return cands
+
+    def test_greedy_misses_bundle(self):
+        cands = self.cands()
+        ids   = list(range(len(cands)))
+
+        self.assertEqual(sorted(_cover._greedy(cands, ids)), [1, 2, 3, 4])
+
+    def test_exact_finds_bundle(self):
+        cands = self.cands()
+        ids   = list(range(len(cands)))
+        sol   = _cover._exact(cands, ids, _cover._greedy(cands, ids))
+
+        self.assertEqual(sol, [0])
+
+    def test_select(self):
+        ret = self.select(['v1-4'], self.FILES)
+
+        self.assertEqual(ret, [('Berserk v01-04 [A].zip',
+                                [1.0, 2.0, 3.0, 4.0], [])])
+
+    def test_select_large_group(self):
+        # groups too large to solve exactly still get the bundle
+        # swapped in after greedy
+        old = _cover.EXACT_MAX_FILES
+        _cover.EXACT_MAX_FILES = 1
+
+        try:
+            ret = self.select(['v1-4'], self.FILES)
+        finally:
+            _cover.EXACT_MAX_FILES = old
+
+        self.assertEqual(self.names(ret), ['Berserk v01-04 [A].zip'])
+
+    def test_cheaper_singles(self):
+        files = [('Berserk v01-02 [A].zip', 10), ('Berserk v01 [A].zip', 4),
+                 ('Berserk v02 [A].zip', 4)]
+        ret   = self.select(['v1-2'], files)
+
+        self.assertEqual(self.names(ret), ['Berserk v01 [A].zip',
+                                           'Berserk v02 [A].zip'])
+
+class TestWeights(CoverTest):
+    def test_pref(self):
+        files = [('Berserk v01 [A].zip', 6), ('Berserk v01 [P].zip', 10)]
+
+        self.assertEqual(self.names(self.select(['v1'], files)),
+                         ['Berserk v01 [A].zip'])
+        # PREF_WEIGHT halves the cost of the preferred file
+        self.assertEqual(self.names(self.select(['v1'], files,
+                                                pref=['Berserk v01 [P].zip'])),
+                         ['Berserk v01 [P].zip'])
+
+    def test_npref(self):
+        files = [('Berserk v01 [N].zip', 4), ('Berserk v01 [A].zip', 6)]
+
+        self.assertEqual(self.names(self.select(['v1'], files)),
+                         ['Berserk v01 [N].zip'])
+        # NPREF_WEIGHT doubles the cost of the nonpreferred file
+        self.assertEqual(self.names(self.select(['v1'], files,
+                                                npref=['Berserk v01 [N].zip'])),
+                         ['Berserk v01 [A].zip'])
+
+class TestUnknownSize(CoverTest):
+    def test_median_rate(self):
+        # the bundle is costed at the median size per volume, 5 * 2
+        files = [('Berserk v01-02 [A].zip', None), ('Berserk v01 [A].zip', 3),
+                 ('Berserk v02 [A].zip', 5)]
+
+        self.assertEqual(self.names(self.select(['v1-2'], files)),
+                         ['Berserk v01 [A].zip', 'Berserk v02 [A].zip'])
+
+        files[0] = ('Berserk v01-02 [A].zip', 7)
+
+        self.assertEqual(self.names(self.select(['v1-2'], files)),
+                         ['Berserk v01-02 [A].zip'])
+
+    def test_all_unknown(self):
+        files = [('Berserk v01 [A].zip', None), ('Berserk v02 [A].zip', None)]
+
+        self.assertEqual(self.names(self.select(['v1-2'], files)),
+                         ['Berserk v01 [A].zip', 'Berserk v02 [A].zip'])
+
+class TestExtras(CoverTest):
+    FILES = [
+        ('Berserk v01 [A].zip'  , 5) ,
+        ('Berserk Omake [A].zip', 1) ,
+        ('Berserk v02 [A].zip'  , 5) ,
+    ]
+
+    def test_all_keeps_extras(self):
+        ret = self.select(['all'], self.FILES)
+
+        self.assertEqual(ret, [('Berserk v01 [A].zip', [1.0], []),
+                               ('Berserk Omake [A].zip', [], []),
+                               ('Berserk v02 [A].zip', [2.0], [])])
+
+    def test_only_extras(self):
+        ret = self.select(['all'], self.FILES[1:2])
+
+        self.assertEqual(self.names(ret), ['Berserk Omake [A].zip'])
+
+    def test_range_skips_extras(self):
+        ret = self.select(['v1-2'], self.FILES)
+
+        self.assertEqual(self.names(ret), ['Berserk v01 [A].zip',
+                                           'Berserk v02 [A].zip'])
+
+if __name__ == '__main__':
+    unittest.main()
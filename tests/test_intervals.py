@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+#
+# tests for madodl/intervals.py and how missing numbers are reported
+#
+
+import unittest
+
+import madodl.main as _main
+
+_main.local_import()
+
+from madodl.intervals import IntervalSet
+
+def spec(s):
+    return IntervalSet.from_spec(s)
+
+class TestIntervalSet(unittest.TestCase):
+    def test_runs(self):
+        s = spec('1-3,5,7-9')
+
+        self.assertEqual(list(s), [1.0, 2.0, 3.0, 5.0, 7.0, 8.0, 9.0])
+        self.assertIn(2, s)
+        self.assertNotIn(4, s)
+        self.assertEqual(s.to_spec(), '1-3,5,7-9')
+
+    def test_fractional(self):
+        s = spec('1.5-3.5')
+
+        self.assertEqual(list(s), [1.5, 2.0, 3.0, 3.5])
+        self.assertNotIn(2.5, s)
+
+    def test_tail(self):
+        s = spec('1,5-')
+
+        self.assertEqual(s.tail, 5.0)
+        self.assertIn(1000, s)
+        self.assertIn(5.5, s)
+        self.assertNotIn(4, s)
+        self.assertEqual(list(s), [1.0])
+
+    def test_difference(self):
+        self.assertEqual((spec('1-10') - spec('3-4,8')).to_spec(),
+                         '1-2,5-7,9-10')
+        # the tail has no holes cut into it
+        self.assertEqual((spec('5-') - spec('6-7')).to_spec(), '5-')
+        self.assertEqual((spec('5-') - spec('8-')).to_spec(), '5-7')
+
+class TestFindMissing(unittest.TestCase):
+    def missing(self, want, got):
+        return _main.find_missing(spec(want), got).to_spec()
+
+    def test_closed(self):
+        self.assertEqual(self.missing('1-5', [1, 2, 5]), '3-4')
+        self.assertEqual(self.missing('1-5', [1, 2, 3, 4, 5]), '')
+
+    def test_open_nothing_found(self):
+        self.assertEqual(self.missing('5-', []), '5-')
+        self.assertEqual(self.missing('5-', [3]), '5-')
+
+    def test_open_gaps(self):
+        self.assertEqual(self.missing('5-', [6, 7]), '5')
+        self.assertEqual(self.missing('5-', [7]), '5-6')
+        self.assertEqual(self.missing('5-', [5, 6, 7]), '')
+        self.assertEqual(self.missing('5-', [5, 6.5]), '6')
+
+    def test_open_and_closed(self):
+        self.assertEqual(self.missing('1-3,5-', [1, 7]), '2-3,5-6')
+
+if __name__ == '__main__':
+    unittest.main()
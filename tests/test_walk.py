@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+
+#
+# tests for walk_thru_listing() and its tag preferences
+#
+
+import random
+import logging
+import unittest
+
+import madodl.main as _main
+
+_main.local_import()
+
+import madodl.gvars as _g
+from madodl.parsers import ParseRequest, ParseFile
+
+class Entry:
+    def __init__(self, name):
+        self.name = name
+
+class Tag:
+    '''Stands in for the config file's TagFilter.'''
+    def __init__(self, name, filt, case='any', for_='all'):
+        self._name   = name
+        self._filter = filt
+        self._case   = case
+        self._for    = for_
+
+def linear_check_preftags(vc, vcq, fo, allf, npref, v_or_c):
+    # the check_preftags() of the linear scan, see linear_walk()
+    if v_or_c:
+        ftupidx = 1
+        whatls  = fo._vols
+    else:
+        ftupidx = 2
+        whatls  = fo._chps
+
+    if fo._preftag:
+        for ftup in allf:
+            if vc in ftup[ftupidx]:
+                allf.remove(ftup)
+                vcq.extend(whatls)
+                return 'break'
+
+        if vc in vcq:
+            return 'break'
+
+        raise AssertionError('no dup {} to replace'.format(vc))
+    elif not fo._npreftag and npref:
+        for t in npref:
+            if vc in t[ftupidx]:
+                tup = t
+                break
+        else:
+            return 'break'
+
+        allf.remove(tup)
+        npref.remove(tup)
+        return 'continue'
+
+    return None
+
+def linear_walk(req, title, dir_ls):
+    '''walk_thru_listing() as it was before the matches were indexed:
+       every duplicate volume/chapter is looked up by scanning the list
+       of matched files. The two crashes it had (the stale volume of the
+       `all` branch and a preferred file whose numbers were queued by its
+       own replacement) are fixed here the way walk_thru_listing() fixed
+       them, everything else is kept as it was.'''
+    compv    = []
+    compc    = []
+    allf     = []
+    npref    = []
+    compfile = None
+
+    oerng_v = req._vols.tail is not None
+    oest_c  = req._chps.tail
+    oerng_c = oest_c is not None
+
+    only_file = len(dir_ls) == 1
+    parsed    = ParseFile.parse_many((f.name for f in dir_ls), title)
+
+    for f, fo in zip(dir_ls, parsed):
+        if not _main.apply_tag_filters(fo, title):
+            continue
+
+        vq   = []
+        cq   = []
+        apnd = False
+
+        if only_file and not any((fo._vols, fo._chps, fo._all)):
+            fo._all = True
+
+        if fo._all and req._all:
+            compfile = f
+            break
+        elif req._all and not req._vols:
+            for c in fo._chps:
+                if c not in cq and c not in compc:
+                    cq.append(c)
+                else:
+                    act = linear_check_preftags(c, cq, fo, allf, npref,
+                                                False)
+                    if isinstance(act, str):
+                        if fo._preftag:
+                            continue
+                        if act == 'break': break
+                        cq.append(c)
+                        continue
+                    cq = []
+                    break
+
+        if req._vols and not any({oerng_v, req._all}):
+            if [v for v in fo._vols if v not in req._vols]:
+                continue
+
+        for fov in fo._vols:
+            if req._all or fov in req._vols:
+                if fov in compv:
+                    for foc in fo._chps:
+                        if compc and foc not in compc:
+                            continue
+                        else:
+                            act = linear_check_preftags(fov, vq, fo, allf,
+                                                        npref, True)
+                            if isinstance(act, str):
+                                if fo._preftag:
+                                    apnd = True
+                                if act == 'break'   : break
+                                if act == 'continue':
+                                    apnd = True
+                                    continue
+                            break
+                    else:
+                        apnd = True
+                        vq.append(fov)
+                else:
+                    apnd = True
+                    vq.append(fov)
+
+        if apnd:
+            cq.extend(fo._chps)
+
+        if (not oerng_c and len(req._chps) > 1 and
+            len(fo._chps) == len(req._chps) and
+            req._chps.min() == fo._chps.min()):
+            rmax  = None
+            fomax = None
+            reqc  = list(req._chps)
+            foc   = list(fo._chps)
+            last  = reqc[0]
+
+            for i in range(1, len(reqc)):
+                if reqc[i] == last+1:
+                    rmax = reqc[i]
+                else:
+                    break
+                last = reqc[i]
+
+            last = foc[0]
+
+            for i in range(1, len(foc)):
+                if foc[i] == last+1:
+                    fomax = foc[i]
+                else:
+                    break
+                last = foc[i]
+
+            if None not in {rmax, fomax} and rmax == fomax:
+                for c in [c for c in reqc if c in cq + compc]:
+                    linear_check_preftags(c, cq, fo, allf, npref, False)
+
+                for i in reqc:
+                    if i <= rmax:
+                        cq.append(float(i))
+                    else:
+                        break
+
+        if req._chps:
+            if oerng_c and fo._chps and fo._chps.min() >= oest_c:
+                for c in fo._chps:
+                    if c in cq + compc:
+                        act = linear_check_preftags(c, cq, fo, allf, npref,
+                                                    False)
+                        if act == 'break'   : break
+                        if act == 'continue': continue
+                        break
+                else:
+                    cq.extend(fo._chps)
+            else:
+                if req._all or not [c for c in fo._chps
+                                    if c not in req._chps]:
+                    for c in [c for c in fo._chps if c in req._chps]:
+                        if c not in cq + compc:
+                            cq.append(c)
+                        else:
+                            act = linear_check_preftags(c, cq, fo, allf,
+                                                        npref, False)
+
+                            if act == 'break'   : break
+                            if act == 'continue':
+                                cq.append(c)
+                                continue
+
+        if vq or cq:
+            if fo._npreftag:
+                npref.append((f, vq, cq))
+
+            allf.append((f, vq, cq))
+
+        compv = list(set(compv + vq))
+        compc = list(set(compc + cq))
+
+    return (sorted(compv), sorted(compc), allf, compfile)
+
+GROUPS = ['Pref', 'Neutral', 'Meh', 'Other']
+
+TAGSETS = [
+    [] ,
+    [Tag('Pref', 'prefer')] ,
+    [Tag('Meh', 'not prefer')] ,
+    [Tag('Meh', 'not prefer'), Tag('Pref', 'prefer')] ,
+    [Tag('Other', 'out')] ,
+]
+
+REQUESTS = [
+    ['all'] ,
+    ['v1'] ,
+    ['v1-5'] ,
+    ['v5-'] ,
+    ['v1,5-7'] ,
+    ['c10-20'] ,
+    ['c30-'] ,
+    ['c12.5'] ,
+    ['v2', 'c30-'] ,
+    ['v1-3', 'c1-20'] ,
+]
+
+def gen_listing(rng, title):
+    '''A listing with duplicate volumes and chapters from several
+       groups, packs, mixed volume+chapter files and extras.'''
+    names = set()
+    nv    = rng.randint(3, 12)
+    nc    = rng.randint(20, 60)
+
+    for v in range(1, nv+1):
+        for g in rng.sample(GROUPS, rng.randint(0, 2)):
+            names.add('{} v{:02d} [{}].zip'.format(title, v, g))
+
+    for c in range(nc-30, nc+1):
+        for g in rng.sample(GROUPS, rng.randint(0, 2)):
+            names.add('{} - c{:03d} [{}].zip'.format(title, c, g))
+
+        if rng.random() < 0.1:
+            names.add('{} - c{:03d}.5 [{}].zip'
+                      .format(title, c, rng.choice(GROUPS)))
+
+    if rng.random() < 0.5:
+        names.add('{} v{:02d}-{:02d} [{}].zip'
+                  .format(title, 1, nv // 2, rng.choice(GROUPS)))
+
+    if rng.random() < 0.5:
+        names.add('{} c{:03d}-{:03d} [{}].zip'
+                  .format(title, 1, nc // 3, rng.choice(GROUPS)))
+
+    if rng.random() < 0.5:
+        names.add('{} v{:02d} c{:03d}-{:03d} [{}].zip'
+                  .format(title, nv+1, nc-40, nc-31, rng.choice(GROUPS)))
+
+    if rng.random() < 0.3:
+        names.add('{} (Complete) [{}].zip'.format(title,
+                                                  rng.choice(GROUPS)))
+
+    names = sorted(names)
+
+    if rng.random() < 0.3:
+        rng.shuffle(names)
+
+    return names
+
+class WalkTest(unittest.TestCase):
+    TITLE = 'Berserk'
+
+    def setUp(self):
+        self._conf = getattr(_g, 'conf', None)
+        self._log  = getattr(_g, 'log', None)
+
+        _g.conf             = _main.Struct()
+        _g.conf._alltags    = []
+        _g.conf._parsecache = None
+        _g.conf._parsepool  = None
+        _g.conf._no_output  = True
+        _g.log              = logging.getLogger('madodl.test')
+        _g.log.addHandler(logging.NullHandler())
+        _g.log.propagate    = False
+
+    def tearDown(self):
+        _g.conf = self._conf
+        _g.log  = self._log
+
+    def walk(self, names, req, tags=()):
+        _g.conf._alltags = list(tags)
+        req = ParseRequest([self.TITLE] + list(req))
+
+        return _main.walk_thru_listing(req, self.TITLE,
+                                       [Entry(n) for n in names])
+
+    @staticmethod
+    def result(ret):
+        compv, compc, allf, compfile = ret
+
+        return (list(compv), list(compc),
+                [(f.name, list(v), list(c)) for f, v, c in allf],
+                compfile.name if compfile else None)
+
+class TestWalkSemantics(WalkTest):
+    def names(self, ret):
+        return [f.name for f, v, c in ret[2]]
+
+    def test_prefer(self):
+        ls  = ['Berserk - c001 [Neutral].zip', 'Berserk - c001 [Pref].zip',
+               'Berserk - c002 [Pref].zip', 'Berserk - c002 [Neutral].zip']
+        ret = self.walk(ls, ['c1-2'], [Tag('Pref', 'prefer')])
+
+        self.assertEqual(self.names(ret), ['Berserk - c001 [Pref].zip',
+                                           'Berserk - c002 [Pref].zip'])
+        self.assertEqual(ret[1], [1.0, 2.0])
+
+    def test_prefer_vol(self):
+        ls  = ['Berserk v01 c001-005 [Neutral].zip',
+               'Berserk v01 c001-005 [Pref].zip']
+        ret = self.walk(ls, ['v1'], [Tag('Pref', 'prefer')])
+
+        self.assertEqual(self.names(ret), ['Berserk v01 c001-005 [Pref].zip'])
+
+    def test_not_prefer(self):
+        ls  = ['Berserk - c001 [Meh].zip', 'Berserk - c001 [Neutral].zip',
+               'Berserk - c002 [Meh].zip']
+        ret = self.walk(ls, ['c1-2'], [Tag('Meh', 'not prefer')])
+
+        self.assertEqual(self.names(ret), ['Berserk - c001 [Neutral].zip',
+                                           'Berserk - c002 [Meh].zip'])
+
+    def test_first_match_wins(self):
+        ls  = ['Berserk - c001 [Neutral].zip', 'Berserk - c001 [Other].zip']
+        ret = self.walk(ls, ['c1'])
+
+        self.assertEqual(self.names(ret), ['Berserk - c001 [Neutral].zip'])
+
+    def test_vol_dups_kept(self):
+        # a volume without chapters is never seen as a duplicate
+        ls  = ['Berserk v01 [Neutral].zip', 'Berserk v01 [Pref].zip']
+        ret = self.walk(ls, ['v1'], [Tag('Pref', 'prefer')])
+
+        self.assertEqual(self.names(ret), ls)
+
+    def test_prefer_all(self):
+        ls  = ['Berserk - c001 [Neutral].zip', 'Berserk - c001 [Pref].zip',
+               'Berserk - c002 [Meh].zip', 'Berserk - c002 [Neutral].zip']
+        ret = self.walk(ls, ['all'], [Tag('Pref', 'prefer'),
+                                      Tag('Meh', 'not prefer')])
+
+        self.assertEqual(self.names(ret), ['Berserk - c001 [Pref].zip',
+                                           'Berserk - c002 [Neutral].zip'])
+
+    def test_complete_archive(self):
+        ls  = ['Berserk v01 [Neutral].zip', 'Berserk (Complete) [Other].zip',
+               'Berserk v02 [Neutral].zip']
+        ret = self.walk(ls, ['all'])
+
+        self.assertEqual(ret[3].name, 'Berserk (Complete) [Other].zip')
+        # only asked for with `all`
+        self.assertIsNone(self.walk(ls, ['v1-2'])[3])
+
+    def test_open_range(self):
+        ls  = ['Berserk v{:02d} [Neutral].zip'.format(v)
+               for v in (3, 4, 5, 6, 8)]
+        ret = self.walk(ls, ['v5-'])
+
+        self.assertEqual(ret[0], [5.0, 6.0, 8.0])
+        self.assertEqual(self.names(ret), ls[2:])
+
+    def test_open_range_prefs(self):
+        ls  = ['Berserk - c029 [Pref].zip', 'Berserk - c030 [Neutral].zip',
+               'Berserk - c031 [Neutral].zip', 'Berserk - c031 [Pref].zip',
+               'Berserk - c032 [Meh].zip', 'Berserk - c032 [Neutral].zip']
+        ret = self.walk(ls, ['c30-'], [Tag('Pref', 'prefer'),
+                                       Tag('Meh', 'not prefer')])
+
+        self.assertEqual(ret[1], [30.0, 31.0, 32.0])
+        self.assertEqual(self.names(ret), ['Berserk - c030 [Neutral].zip',
+                                           'Berserk - c031 [Pref].zip',
+                                           'Berserk - c032 [Neutral].zip'])
+
+    def test_mixed_vol_chp(self):
+        ls  = ['Berserk v01 c001-005 [Neutral].zip',
+               'Berserk - c006 [Neutral].zip',
+               'Berserk v02 c006-010 [Neutral].zip',
+               'Berserk - c011 [Neutral].zip']
+        ret = self.walk(ls, ['v1', 'c6-11'])
+
+        self.assertEqual(ret[0], [1.0])
+        self.assertEqual(ret[1], [1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 11.0])
+        self.assertEqual(self.names(ret),
+                         [ls[0], ls[1], ls[3]])
+
+class TestWalkMatchesLinearScan(WalkTest):
+    '''The indexed walk has to pick the same files as the linear scan
+       it replaced.'''
+    def check(self, names, req, tags):
+        _g.conf._alltags = list(tags)
+        ents = [Entry(n) for n in names]
+        want = self.result(linear_walk(ParseRequest([self.TITLE] + req),
+                                       self.TITLE, ents))
+        got  = self.result(self.walk(names, req, tags))
+
+        self.assertEqual(got, want, 'request {} tags {}\n{}'.format(
+                         req, [(t._name, t._filter) for t in tags],
+                         '\n'.join(names)))
+
+    def test_generated(self):
+        rng = random.Random(17)
+
+        for _ in range(12):
+            names = gen_listing(rng, self.TITLE)
+
+            for req in REQUESTS:
+                for tags in TAGSETS:
+                    self.check(names, req, tags)
+
+    def test_cases(self):
+        cases = [
+            # a preferred pack replaces the singles before it
+            ['Berserk v01 [Neutral].zip', 'Berserk v02 [Neutral].zip',
+             'Berserk v01-02 [Pref].zip'] ,
+            # a preferred chapter pack over an open-ended range
+            ['Berserk - c030 [Meh].zip', 'Berserk - c031 [Neutral].zip',
+             'Berserk c030-031 [Pref].zip', 'Berserk - c032 [Meh].zip',
+             'Berserk - c032 [Neutral].zip'] ,
+            # a preferred volume replaces the first of several kept ones
+            ['Berserk v01 [Neutral].zip', 'Berserk v01 [Other].zip',
+             'Berserk v01 c001-005 [Pref].zip',
+             'Berserk v01 c001-005 [Neutral].zip'] ,
+            # and a neutral one replaces the first nonpreferred one
+            ['Berserk v01 [Meh].zip', 'Berserk v01 [Meh] (HQ).zip',
+             'Berserk v01 c001 [Neutral].zip'] ,
+            # volume and chapter files of the same numbers
+            ['Berserk v01 c001-010 [Meh].zip', 'Berserk - c005 [Pref].zip',
+             'Berserk v01 [Neutral].zip', 'Berserk - c012.5 [Neutral].zip'] ,
+        ]
+
+        for names in cases:
+            for req in REQUESTS:
+                for tags in TAGSETS:
+                    self.check(names, req, tags)
+
+if __name__ == '__main__':
+    unittest.main()